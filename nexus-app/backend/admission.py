@@ -0,0 +1,121 @@
+#admission control for the endpoints that spend their time in bcrypt, abusive clients are turned
+#away with a 429 before any hashing work is queued
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from fastapi import HTTPException, Request, status
+import config
+
+#rates are attempts per minute, bursts are how many attempts can be made back to back
+LOGIN_IP_RATE = float(os.environ.get("LOGIN_IP_RATE", 30))
+LOGIN_IP_BURST = float(os.environ.get("LOGIN_IP_BURST", 10))
+#per username across every client, caps guessing one account from many addresses,
+#the burst is above the per ip one so a single address can't drain it and lock the owner out
+LOGIN_USERNAME_RATE = float(os.environ.get("LOGIN_USERNAME_RATE", 10))
+LOGIN_USERNAME_BURST = float(os.environ.get("LOGIN_USERNAME_BURST", 20))
+REGISTER_IP_RATE = float(os.environ.get("REGISTER_IP_RATE", 5))
+REGISTER_IP_BURST = float(os.environ.get("REGISTER_IP_BURST", 5))
+#upper bound on tracked keys per bucket set, the least recently seen key goes first
+ADMISSION_MAX_KEYS = int(os.environ.get("ADMISSION_MAX_KEYS", 100000))
+#only enable behind a proxy that overwrites the header, clients can set it to anything
+TRUST_FORWARDED_FOR = os.environ.get("TRUST_FORWARDED_FOR", "false").lower() == "true"
+
+class TokenBuckets:
+    #one token bucket per key, kept in least recently used order
+    def __init__(self, rate_per_minute, burst, maxsize=ADMISSION_MAX_KEYS):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def take(self, key):
+        #returns 0 when a token was taken, otherwise the seconds until one is available
+        now = time.monotonic()
+
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+
+            retry_after = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                retry_after = (1 - tokens) / self.rate
+
+            self._buckets[key] = (tokens, now)
+            self._evict(now)
+            return retry_after
+
+    def _evict(self, now):
+        #a bucket that has refilled behaves exactly like a missing one, so idle keys are dropped
+        #from the least recently used end, and the oldest go regardless once over maxsize
+        while self._buckets:
+            key, (tokens, updated_at) = next(iter(self._buckets.items()))
+            idle = tokens + (now - updated_at) * self.rate >= self.burst
+            if not idle and len(self._buckets) <= self.maxsize:
+                break
+            del self._buckets[key]
+            if not idle:
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._buckets)
+
+class AdmissionController:
+    def __init__(self):
+        self.login_ip = TokenBuckets(LOGIN_IP_RATE, LOGIN_IP_BURST)
+        self.login_username = TokenBuckets(LOGIN_USERNAME_RATE, LOGIN_USERNAME_BURST)
+        self.register_ip = TokenBuckets(REGISTER_IP_RATE, REGISTER_IP_BURST)
+        self.admitted = 0
+        self.rejected = {"login_ip": 0, "login_username": 0, "register_ip": 0}
+
+    def client_ip(self, request: Request):
+        if TRUST_FORWARDED_FOR:
+            forwarded = request.headers.get("x-forwarded-for")
+            if forwarded:
+                return forwarded.split(",")[0].strip()
+        return request.client.host if request.client else "unknown"
+
+    def admit(self, checks):
+        #every bucket is charged so an attacker can't probe one limit while resting another
+        retry_after = 0
+        rejected_by = None
+        for name, buckets, key in checks:
+            wait = buckets.take(key)
+            if wait > retry_after:
+                retry_after = wait
+                rejected_by = name
+
+        if rejected_by is None:
+            self.admitted += 1
+            return
+
+        self.rejected[rejected_by] += 1
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many attempts, please try again later.",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+    def admit_login(self, request: Request, username: str):
+        ip = self.client_ip(request)
+        self.admit([
+            ("login_ip", self.login_ip, ip),
+            ("login_username", self.login_username, username.lower()),
+        ])
+
+    def admit_register(self, request: Request):
+        self.admit([("register_ip", self.register_ip, self.client_ip(request))])
+
+    def stats(self):
+        stats = {"admitted": self.admitted}
+        stats.update({f"rejected_{name}": count for name, count in self.rejected.items()})
+        stats["tracked_keys"] = len(self.login_ip) + len(self.login_username) + len(self.register_ip)
+        stats["evictions"] = self.login_ip.evictions + self.login_username.evictions + self.register_ip.evictions
+        return stats
+
+admission_controller = AdmissionController()
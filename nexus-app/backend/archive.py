@@ -0,0 +1,204 @@
+#moves expired listings out of the live tables in small batches so boards and indexes only cover current listings
+import os
+from datetime import datetime, timedelta, timezone
+import config
+from sqlalchemy import delete, func, insert, literal, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import (
+    Application, BusinessAccount, built_ranking_index, JobListing, Listing, ListingType, ProductListing, Tag,
+    listing_tags, listing_archive, listing_tag_archive, application_archive,
+)
+from cache import board_versions
+from listing_index import trade_index, CatchUpWatermark
+from board_stream import board_broker
+from geo import geo_index
+
+ARCHIVE_INTERVAL_SECONDS = float(os.environ.get("ARCHIVE_INTERVAL_SECONDS", 300))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", 500))
+#caps how long one run can keep going, whatever is left waits for the next run
+ARCHIVE_MAX_BATCHES = int(os.environ.get("ARCHIVE_MAX_BATCHES", 20))
+#listings stay on the live tables this long after they were required
+ARCHIVE_GRACE_HOURS = float(os.environ.get("ARCHIVE_GRACE_HOURS", 24))
+ARCHIVE_HISTORY_PAGE_SIZE = 50
+
+listings = Listing.__table__
+job_listings = JobListing.__table__
+product_listings = ProductListing.__table__
+applications = Application.__table__
+
+class ArchivedListings:
+    #per worker catch-up over listing_archive, the worker that archived a batch applies it through here too
+    def __init__(self):
+        self.watermark = CatchUpWatermark()
+
+    def apply(self, rows):
+        #rows are (archive_id, listing_id, type, tag name) for listings another batch archived
+        self.watermark.advance(list(dict.fromkeys(row[0] for row in rows)))
+        partitions = {}
+        for archive_id, listing_id, listing_type, tag in rows:
+            listing_partitions = partitions.setdefault(listing_id, set())
+            if listing_type == ListingType.PRODUCT:
+                listing_partitions.add(ListingType.PRODUCT.value)
+            elif tag is not None:
+                listing_partitions.add(tag)
+
+        ranking_index = built_ranking_index()
+        for listing_id, listing_partitions in partitions.items():
+            trade_index.remove(listing_id)
+            geo_index.remove(listing_id)
+            if ranking_index is not None:
+                ranking_index.remove(listing_id)
+            board_versions.bump(listing_partitions)
+            board_broker.publish(listing_partitions, {"event": "removed", "listing": {"id": listing_id}})
+
+        return len(partitions)
+
+archived_listings = ArchivedListings()
+
+def archive_cutoff():
+    #datetime_required is stored naive in utc
+    return datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=ARCHIVE_GRACE_HOURS)
+
+class AsyncArchiveManager:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    def expired_ids_query(self, cutoff, limit):
+        #type leads the board index, so each type is a range scan on datetime_required,
+        #skip locked keeps concurrent archivers on other workers off the same rows where supported
+        return (
+            select(Listing.id)
+            .filter(Listing.type.in_(list(ListingType)), Listing.datetime_required < cutoff)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+
+    def archive_statements(self, ids, archived_at):
+        #copy into the archive tables, then delete children before parents
+        listing_rows = (
+            select(
+                listings.c.id, listings.c.type, listings.c.title, listings.c.description, listings.c.location,
+                listings.c.latitude, listings.c.longitude, listings.c.datetime_required, listings.c.datetime_end, listings.c.created_by,
+                listings.c.created_at, job_listings.c.rate_per_h, product_listings.c.price, product_listings.c.quantity,
+                literal(archived_at),
+            )
+            .select_from(listings.outerjoin(job_listings, job_listings.c.id == listings.c.id).outerjoin(product_listings, product_listings.c.id == listings.c.id))
+            .filter(listings.c.id.in_(ids))
+            .order_by(listings.c.id)
+        )
+        archive_columns = [
+            "listing_id", "type", "title", "description", "location", "latitude", "longitude", "datetime_required", "datetime_end",
+            "created_by", "created_at", "rate_per_h", "price", "quantity", "archived_at",
+        ]
+
+        return [
+            insert(listing_archive).from_select(archive_columns, listing_rows),
+            insert(listing_tag_archive).from_select(
+                ["listing_id", "tag_id"],
+                select(listing_tags.c.listing_id, listing_tags.c.tag_id).filter(listing_tags.c.listing_id.in_(ids)),
+            ),
+            insert(application_archive).from_select(
+                ["id", "applicant_id", "listing_id"],
+                select(applications.c.id, applications.c.applicant_id, applications.c.listing_id).filter(applications.c.listing_id.in_(ids)),
+            ),
+            delete(applications).filter(applications.c.listing_id.in_(ids)),
+            delete(listing_tags).filter(listing_tags.c.listing_id.in_(ids)),
+            delete(job_listings).filter(job_listings.c.id.in_(ids)),
+            delete(product_listings).filter(product_listings.c.id.in_(ids)),
+            delete(listings).filter(listings.c.id.in_(ids)),
+        ]
+
+    def archived_rows_query(self, after_id=0, gaps=()):
+        condition = listing_archive.c.archive_id > after_id
+        if gaps:
+            condition = or_(condition, listing_archive.c.archive_id.in_(gaps))
+        return (
+            select(listing_archive.c.archive_id, listing_archive.c.listing_id, listing_archive.c.type, Tag.name)
+            .outerjoin(listing_tag_archive, listing_tag_archive.c.listing_id == listing_archive.c.listing_id)
+            .outerjoin(Tag, Tag.id == listing_tag_archive.c.tag_id)
+            .filter(condition)
+        )
+
+    def max_archive_id_query(self):
+        return select(func.coalesce(func.max(listing_archive.c.archive_id), 0))
+
+    def history_query(self, user, limit, before=None):
+        #newest archived first, keyset on archive_id
+        query = select(listing_archive)
+        if isinstance(user, BusinessAccount):
+            query = query.filter(listing_archive.c.created_by == user.id)
+        else:
+            applied = select(application_archive.c.listing_id).filter(application_archive.c.applicant_id == user.id)
+            query = query.filter(listing_archive.c.listing_id.in_(applied))
+
+        if before is not None:
+            query = query.filter(listing_archive.c.archive_id < before)
+        return query.order_by(listing_archive.c.archive_id.desc()).limit(limit + 1)
+
+    def history_tags_query(self, listing_ids):
+        return (
+            select(listing_tag_archive.c.listing_id, Tag.name)
+            .join(Tag, Tag.id == listing_tag_archive.c.tag_id)
+            .filter(listing_tag_archive.c.listing_id.in_(listing_ids))
+        )
+
+    def history_page(self, rows, tag_rows, limit):
+        tags = {}
+        for listing_id, name in tag_rows:
+            tags.setdefault(listing_id, []).append(name)
+
+        listings = []
+        for row in rows[:limit]:
+            listing = row._asdict()
+            listing["tags"] = tags.get(row.listing_id, [])
+            listings.append(listing)
+
+        next_before = rows[limit - 1].archive_id if len(rows) > limit else None
+        return listings, next_before
+
+    async def archive_batch(self, cutoff, limit=ARCHIVE_BATCH_SIZE):
+        #one short transaction per batch, returns how many listings were moved
+        result = await self.session.execute(self.expired_ids_query(cutoff, limit))
+        ids = result.scalars().all()
+        if not ids:
+            await self.session.rollback()
+            return 0
+
+        try:
+            for statement in self.archive_statements(ids, datetime.now(timezone.utc).replace(tzinfo=None)):
+                await self.session.execute(statement)
+            await self.session.commit()
+        except IntegrityError:
+            #another worker archived these first
+            await self.session.rollback()
+            return 0
+
+        return len(ids)
+
+    async def archive_expired(self, cutoff=None):
+        cutoff = cutoff or archive_cutoff()
+        archived = 0
+        for _ in range(ARCHIVE_MAX_BATCHES):
+            moved = await self.archive_batch(cutoff)
+            archived += moved
+            if moved < ARCHIVE_BATCH_SIZE:
+                break
+
+        await self.catch_up_archived()
+        return archived
+
+    async def skip_archived(self):
+        #called before the indexes are rebuilt from the live tables, which already exclude the archive
+        result = await self.session.execute(self.max_archive_id_query())
+        archived_listings.watermark.reset(result.scalar())
+
+    async def catch_up_archived(self):
+        result = await self.session.execute(self.archived_rows_query(*archived_listings.watermark.pending()))
+        return archived_listings.apply(result.all())
+
+    async def get_history(self, user, limit=ARCHIVE_HISTORY_PAGE_SIZE, before=None):
+        result = await self.session.execute(self.history_query(user, limit, before))
+        rows = result.all()
+        result = await self.session.execute(self.history_tags_query([row.listing_id for row in rows[:limit]]))
+        return self.history_page(rows, result.all(), limit)
@@ -0,0 +1,157 @@
+#shared setup for the load test and micro-benchmarks
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+SEED_PASSWORD = "benchmark-password"
+
+def configure_database(database_url=None):
+    #must run before any backend module is imported, database.py reads the url at import time
+    if database_url is None:
+        database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='nexus-bench-'), 'bench.db')}"
+
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+    os.environ.setdefault("SQL_ECHO", "false")
+    return database_url
+
+def add_arguments(parser):
+    parser.add_argument("--database-url", help="defaults to a fresh sqlite file in a temp dir")
+    parser.add_argument("--accounts", type=int, default=200, help="accounts to seed, split evenly between businesses and providers")
+    parser.add_argument("--listings", type=int, default=5000, help="job listings to seed")
+    parser.add_argument("--seed", type=int, default=1234, help="random seed so runs are comparable")
+    parser.add_argument("--output", help="write results as json to this path")
+
+def seed_database(accounts, listings, seed):
+    from sqlalchemy import insert
+    from database import SessionLocal, get_engine
+    from migrations import run_migrations
+    from models import BusinessAccount, ServiceProviderAccount, ProductListing, ListingManager, AccountType, ListingType, TradeType, pwd_context
+
+    run_migrations(get_engine())
+
+    rng = random.Random(seed)
+    trades = list(TradeType)
+
+    #every seeded account shares one hash, bcrypt would otherwise dominate seeding time
+    hashed_password = pwd_context.hash(SEED_PASSWORD)
+    businesses = [f"bench_business_{i}" for i in range(max(1, accounts // 2))]
+    providers = [f"bench_provider_{i}" for i in range(max(1, accounts - len(businesses)))]
+
+    with SessionLocal() as db:
+        business_ids = db.execute(insert(BusinessAccount).returning(BusinessAccount.id), [
+            {
+                "username": username,
+                "hashed_password": hashed_password,
+                "email": f"{username}@example.com",
+                "phone_number": f"1{i:09d}"[:10],
+                "account_type": AccountType.BUSINESS,
+                "abn": f"{i:011d}",
+                "address": "1 Bench St",
+            }
+            for i, username in enumerate(businesses)
+        ]).scalars().all()
+
+        db.execute(insert(ServiceProviderAccount), [
+            {
+                "username": username,
+                "hashed_password": hashed_password,
+                "email": f"{username}@example.com",
+                "phone_number": f"2{i:09d}"[:10],
+                "account_type": AccountType.SERVICEPROVIDER,
+                "first_name": "Bench",
+                "last_name": f"Provider{i}",
+                "address": "2 Bench St",
+                "trade": trades[i % len(trades)],
+            }
+            for i, username in enumerate(providers)
+        ])
+
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        db.execute(insert(ProductListing), [
+            {
+                "type": ListingType.PRODUCT,
+                "title": f"Product {i}",
+                "description": "Seeded product",
+                "location": "Bench City",
+                "datetime_required": now + timedelta(hours=rng.randint(1, 24 * 60)),
+                "created_by": rng.choice(business_ids),
+                "created_at": now,
+                "price": round(rng.uniform(1, 500), 2),
+                "quantity": rng.randint(1, 100),
+            }
+            for i in range(max(1, listings // 10))
+        ])
+        db.commit()
+
+        listing_manager = ListingManager(db)
+        jobs = [job_payload(rng, i, trades) for i in range(listings)]
+        for start in range(0, len(jobs), 1000):
+            listing_manager.create_job_listings(jobs[start:start + 1000], rng.choice(business_ids))
+
+    return businesses, providers
+
+def job_payload(rng, i, trades):
+    #naive utc, the way the schemas hand listing times to the managers
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return {
+        "type": "JOB",
+        "title": f"Shift {i}",
+        "description": "Seeded shift",
+        "location": "Bench City",
+        "datetime_required": now + timedelta(hours=rng.randint(1, 24 * 60)),
+        "created_by": "benchmark",
+        "created_at": now,
+        "rate_per_h": rng.randint(25, 80),
+        "tags": rng.sample([trade.value for trade in trades], rng.randint(1, 2)),
+    }
+
+def summarize(samples):
+    #samples are durations in seconds, reported in milliseconds
+    if not samples:
+        return {"count": 0}
+
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+def environment_info():
+    import sqlalchemy
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "sqlalchemy": sqlalchemy.__version__,
+    }
+
+def write_results(results, path):
+    text = json.dumps(results, indent=2, default=str)
+    if path:
+        with open(path, "w") as f:
+            f.write(text + "\n")
+    print(text)
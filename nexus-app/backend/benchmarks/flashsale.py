@@ -0,0 +1,166 @@
+#flash sale load test, hundreds of buyers reserve and purchase one product until it sells out
+#usage (from backend/): python benchmarks/flashsale.py --buyers 300 --stock 2000 --output flash.json
+import argparse
+import asyncio
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from common import add_arguments, configure_database, seed_database, summarize, environment_info, write_results
+from loadtest import free_port, start_server
+
+def create_product(stock, owner_username):
+    from database import SessionLocal
+    from models import AccountManager, ListingType, ProductListing
+
+    with SessionLocal() as db:
+        owner = AccountManager(db).get_user(owner_username)
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        product = ProductListing(ListingType.PRODUCT, "Flash sale", "Limited stock", "Bench City", now + timedelta(days=1), owner.id, now, [], 10.0, stock)
+        db.add(product)
+        db.commit()
+        return product.id
+
+def issue_tokens(usernames):
+    #tokens are minted directly, logging hundreds of buyers in would be a bcrypt benchmark
+    from database import SessionLocal
+    from models import AccountManager
+
+    with SessionLocal() as db:
+        account_manager = AccountManager(db)
+        return [account_manager.create_user_token(account_manager.get_user(username)) for username in usernames]
+
+def stock_ledger(product_id):
+    from sqlalchemy import func, select
+    from database import SessionLocal
+    from models import ProductListing, Reservation
+
+    with SessionLocal() as db:
+        quantity = db.execute(select(ProductListing.quantity).filter(ProductListing.id == product_id)).scalar()
+        rows = db.execute(
+            select(Reservation.status, func.coalesce(func.sum(Reservation.quantity), 0))
+            .filter(Reservation.listing_id == product_id)
+            .group_by(Reservation.status)
+        ).all()
+    return quantity, {status.value: total for status, total in rows}
+
+async def run(args, port, product_id, tokens):
+    import httpx
+
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.buyers, max_keepalive_connections=args.buyers)
+    latencies = {"reserve": [], "purchase": []}
+    outcomes = {"purchased": 0, "sold_out": 0, "errors": 0}
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as client:
+
+        async def buyer(token, deadline):
+            headers = {"Authorization": f"Bearer {token}"}
+            while time.perf_counter() < deadline:
+                quantity = rng.randint(1, args.max_quantity)
+                start = time.perf_counter()
+                try:
+                    response = await client.post(f"/products/{product_id}/reserve", json={"quantity": quantity}, headers=headers)
+                except Exception:
+                    outcomes["errors"] += 1
+                    continue
+                latencies["reserve"].append(time.perf_counter() - start)
+
+                if response.status_code == 409:
+                    outcomes["sold_out"] += 1
+                    return
+                if response.status_code != 201:
+                    outcomes["errors"] += 1
+                    continue
+
+                #some buyers walk away and leave their reservation for the sweeper
+                if rng.random() < args.abandon_rate:
+                    continue
+
+                start = time.perf_counter()
+                try:
+                    response = await client.post(f"/reservations/{response.json()['reservation_id']}/purchase", headers=headers)
+                except Exception:
+                    outcomes["errors"] += 1
+                    continue
+                latencies["purchase"].append(time.perf_counter() - start)
+                if response.status_code == 200:
+                    outcomes["purchased"] += 1
+                else:
+                    outcomes["errors"] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(buyer(token, start + args.duration) for token in tokens))
+        elapsed = time.perf_counter() - start
+
+    requests = len(latencies["reserve"]) + len(latencies["purchase"])
+    return {
+        "duration_s": elapsed,
+        "throughput_rps": requests / elapsed,
+        "outcomes": outcomes,
+        "endpoints": {name: summarize(samples) for name, samples in latencies.items()},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Flash sale load test for product reservations")
+    add_arguments(parser)
+    parser.set_defaults(accounts=600, listings=0)
+    parser.add_argument("--buyers", type=int, default=300, help="concurrent buyers, at most the seeded providers (half of --accounts)")
+    parser.add_argument("--stock", type=int, default=2000)
+    parser.add_argument("--max-quantity", type=int, default=3, help="each reserve asks for 1 to this many")
+    parser.add_argument("--abandon-rate", type=float, default=0.1, help="share of reservations never purchased")
+    parser.add_argument("--duration", type=float, default=60, help="upper bound, the run ends once every buyer sees a sell out")
+    parser.add_argument("--batch-window-ms", type=float, help="overrides RESERVATION_BATCH_WINDOW_MS, 0 turns batching off")
+    args = parser.parse_args()
+
+    if args.batch_window_ms is not None:
+        os.environ["RESERVATION_BATCH_WINDOW_MS"] = str(args.batch_window_ms)
+
+    database_url = configure_database(args.database_url)
+    businesses, providers = seed_database(args.accounts, args.listings, args.seed)
+    #only service providers can reserve, the product belongs to the first business
+    buyers = providers[:args.buyers]
+
+    product_id = create_product(args.stock, businesses[0])
+    tokens = issue_tokens(buyers)
+
+    port = free_port()
+    server, thread = start_server(port)
+    try:
+        results = asyncio.run(run(args, port, product_id, tokens))
+    finally:
+        server.should_exit = True
+        thread.join()
+
+    #every unit is either still in stock or held by exactly one reservation
+    quantity, reserved = stock_ledger(product_id)
+    held = reserved.get("HELD", 0) + reserved.get("PURCHASED", 0)
+    results["stock"] = {
+        "initial": args.stock,
+        "remaining": quantity,
+        "reserved": reserved,
+        "never_negative": quantity >= 0,
+        "balanced": quantity + held == args.stock,
+    }
+
+    from inventory import reservation_batcher, RESERVATION_BATCH_WINDOW_MS
+    results["batches"] = reservation_batcher.stats()
+
+    write_results({
+        "benchmark": "flashsale",
+        "environment": environment_info(),
+        "parameters": {
+            "database": database_url.split("@")[-1],
+            "buyers": len(buyers),
+            "stock": args.stock,
+            "max_quantity": args.max_quantity,
+            "abandon_rate": args.abandon_rate,
+            "batch_window_ms": RESERVATION_BATCH_WINDOW_MS,
+            "seed": args.seed,
+        },
+        "results": results,
+    }, args.output)
+
+if __name__ == "__main__":
+    main()
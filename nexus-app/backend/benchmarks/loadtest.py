@@ -0,0 +1,204 @@
+#mixed-workload load test against a locally served copy of the api
+#usage (from backend/): python benchmarks/loadtest.py --concurrency 32 --duration 30 --output run.json
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from common import add_arguments, configure_database, seed_database, summarize, environment_info, write_results, SEED_PASSWORD
+
+#relative weight of each endpoint in the mixed workload
+DEFAULT_MIX = {
+    "live_board": 55,
+    "profile": 25,
+    "add_job_listing": 10,
+    "login": 7,
+    "register": 3,
+}
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, weight = part.split("=")
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name}")
+        mix[name] = float(weight)
+    return mix
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(port):
+    import uvicorn
+    from main import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+class Workload:
+    def __init__(self, client, business_tokens, provider_tokens, businesses, providers, rng):
+        self.client = client
+        self.business_tokens = business_tokens
+        self.provider_tokens = provider_tokens
+        self.businesses = businesses
+        self.providers = providers
+        self.rng = rng
+        self.registrations = itertools.count()
+
+    def auth(self, tokens):
+        return {"Authorization": f"Bearer {self.rng.choice(tokens)}"}
+
+    async def live_board(self):
+        tokens = self.provider_tokens if self.rng.random() < 0.8 else self.business_tokens
+        return await self.client.get("/live_board", headers=self.auth(tokens))
+
+    async def profile(self):
+        return await self.client.get("/profile", headers=self.auth(self.provider_tokens + self.business_tokens))
+
+    async def add_job_listing(self):
+        now = datetime.now(timezone.utc)
+        return await self.client.post("/add_job_listing", headers=self.auth(self.business_tokens), json={
+            "type": "JOB",
+            "title": "Load test shift",
+            "description": "Posted by the load test",
+            "location": "Bench City",
+            "datetime_required": (now + timedelta(days=self.rng.randint(1, 30))).isoformat(),
+            "created_by": "loadtest",
+            "created_at": now.isoformat(),
+            "rate_per_h": self.rng.randint(25, 80),
+            "tags": [self.rng.choice(["BARISTA", "CHEF", "FOH", "PLUMBER"])],
+        })
+
+    async def login(self):
+        username = self.rng.choice(self.providers + self.businesses)
+        return await self.client.post("/login", data={"username": username, "password": SEED_PASSWORD})
+
+    async def register(self):
+        n = next(self.registrations)
+        username = f"loadtest_{time.time_ns()}_{n}"
+        return await self.client.post("/register", json={
+            "username": username,
+            "email": f"{username}@example.com",
+            "password": SEED_PASSWORD,
+            "phone_number": f"9{n:09d}"[:10],
+            "account_type": "SERVICEPROVIDER",
+            "first_name": "Load",
+            "last_name": "Test",
+            "address": "3 Bench St",
+            "trade": "CHEF",
+        })
+
+async def login_all(client, usernames):
+    tokens = []
+    for username in usernames:
+        response = await client.post("/login", data={"username": username, "password": SEED_PASSWORD})
+        response.raise_for_status()
+        tokens.append(response.json()["access_token"])
+    return tokens
+
+async def run(args, port, businesses, providers):
+    import httpx
+
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=30) as client:
+        business_tokens = await login_all(client, businesses[:args.token_users])
+        provider_tokens = await login_all(client, providers[:args.token_users])
+        workload = Workload(client, business_tokens, provider_tokens, businesses, providers, rng)
+
+        names = list(args.mix)
+        weights = [args.mix[name] for name in names]
+        latencies = {name: [] for name in names}
+        errors = {name: 0 for name in names}
+
+        async def worker(deadline):
+            while time.perf_counter() < deadline:
+                name = rng.choices(names, weights)[0]
+                start = time.perf_counter()
+                try:
+                    response = await getattr(workload, name)()
+                    ok = response.status_code < 400
+                except Exception:
+                    ok = False
+                elapsed = time.perf_counter() - start
+
+                if ok:
+                    latencies[name].append(elapsed)
+                else:
+                    errors[name] += 1
+
+        #warm up caches and connections before measuring
+        await asyncio.gather(*(worker(time.perf_counter() + args.warmup) for _ in range(args.concurrency)))
+        latencies = {name: [] for name in names}
+        errors = {name: 0 for name in names}
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(start + args.duration) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+
+    endpoints = {}
+    for name in names:
+        endpoints[name] = summarize(latencies[name])
+        endpoints[name]["errors"] = errors[name]
+        endpoints[name]["throughput_rps"] = len(latencies[name]) / elapsed
+
+    total = sum(len(samples) for samples in latencies.values())
+    return {"duration_s": elapsed, "total_requests": total, "throughput_rps": total / elapsed, "endpoints": endpoints}
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Nexus API with a mixed workload")
+    add_arguments(parser)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3, help="unmeasured seconds before the run")
+    parser.add_argument("--token-users", type=int, default=20, help="accounts of each type logged in up front")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="e.g. live_board=60,profile=40")
+    parser.add_argument("--admission-limits", action="store_true", help="keep the login and registration rate limits on")
+    args = parser.parse_args()
+
+    if not args.admission_limits:
+        #every simulated client shares one ip and a few usernames, the limits would reject the login and register mix
+        for name in ("LOGIN_IP_RATE", "LOGIN_IP_BURST", "LOGIN_USERNAME_RATE", "LOGIN_USERNAME_BURST", "REGISTER_IP_RATE", "REGISTER_IP_BURST"):
+            os.environ.setdefault(name, "1e9")
+
+    database_url = configure_database(args.database_url)
+    businesses, providers = seed_database(args.accounts, args.listings, args.seed)
+
+    port = free_port()
+    server, thread = start_server(port)
+    try:
+        results = asyncio.run(run(args, port, businesses, providers))
+    finally:
+        server.should_exit = True
+        thread.join()
+
+    write_results({
+        "benchmark": "loadtest",
+        "environment": environment_info(),
+        "parameters": {
+            "database": database_url.split("@")[-1],
+            "accounts": args.accounts,
+            "listings": args.listings,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "mix": args.mix,
+            "seed": args.seed,
+        },
+        "results": results,
+    }, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#micro-benchmarks for the hot functions behind the live board and auth
+#usage (from backend/): python benchmarks/microbench.py --iterations 2000 --output micro.json
+import argparse
+import asyncio
+import time
+
+from common import add_arguments, configure_database, seed_database, summarize, environment_info, write_results
+
+def measure(fn, iterations, warmup):
+    for _ in range(warmup):
+        fn()
+
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+
+    result = summarize(samples)
+    result["ops_per_s"] = iterations / sum(samples)
+    return result
+
+def measure_async(fn, iterations, warmup):
+    async def run():
+        for _ in range(warmup):
+            await fn()
+
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            await fn()
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    samples = asyncio.run(run())
+    result = summarize(samples)
+    result["ops_per_s"] = iterations / sum(samples)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark Nexus backend internals")
+    add_arguments(parser)
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--warmup-iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    database_url = configure_database(args.database_url)
+    businesses, providers = seed_database(args.accounts, args.listings, args.seed)
+
+    from jose import jwt
+    from database import SessionLocal, AsyncSessionLocal
+    from listing_index import trade_index
+    from models import AccountManager, AsyncAccountManager, ListingManager, SECRET_KEY, ALGORITHM
+
+    results = {}
+    n, warmup = args.iterations, args.warmup_iterations
+
+    with SessionLocal() as db:
+        account_manager = AccountManager(db)
+        listing_manager = ListingManager(db)
+        provider = account_manager.get_user(providers[0])
+        business = account_manager.get_user(businesses[0])
+        token = account_manager.create_user_token(provider)
+
+        results["AccountManager.get_user"] = measure(lambda: account_manager.get_user(providers[0]), n, warmup)
+        results["AccountManager.create_user_token"] = measure(lambda: account_manager.create_user_token(provider), n, warmup)
+        results["jwt.decode"] = measure(lambda: jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]), n, warmup)
+        results["ListingManager.get_listings[business]"] = measure(lambda: listing_manager.get_listings(business), n, warmup)
+
+        #provider boards are measured on the sql path and from the in-memory trade index
+        results["ListingManager.get_listings[provider,sql]"] = measure(lambda: listing_manager.get_listings(provider), n, warmup)
+        listing_manager.rebuild_trade_index()
+        results["ListingManager.get_listings[provider,index]"] = measure(lambda: listing_manager.get_listings(provider), n, warmup)
+        trade_index.ready = False
+
+    async def async_get_user():
+        async with AsyncSessionLocal() as db:
+            await AsyncAccountManager(db).get_user(providers[0])
+
+    results["AsyncAccountManager.get_user"] = measure_async(async_get_user, n, warmup)
+
+    write_results({
+        "benchmark": "microbench",
+        "environment": environment_info(),
+        "parameters": {
+            "database": database_url.split("@")[-1],
+            "accounts": args.accounts,
+            "listings": args.listings,
+            "iterations": n,
+            "seed": args.seed,
+        },
+        "results": results,
+    }, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#compares the vectorized relevance ranking with the same scoring written as a per listing python loop
+#usage (from backend/): python benchmarks/rankbench.py --candidates 1000,10000,100000 --output ranking.json
+import argparse
+import heapq
+import math
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from common import summarize, environment_info, write_results
+from geo import haversine_km
+from ranking import RankingIndex, RANKING_WEIGHTS, RANKING_SOON_HOURS, RANKING_DISTANCE_KM, group_rows
+
+TRADES = ["BARISTA", "BARTENDER", "CHEF", "FOH", "PLUMBER"]
+ORIGIN = (-37.8136, 144.9631)
+
+def synthetic_rows(count, rng, now):
+    #(listing_id, datetime_required, datetime_end, rate_per_h, latitude, longitude, trade) rows, one per listing tag
+    rows = []
+    for listing_id in range(1, count + 1):
+        required = now + timedelta(hours=rng.uniform(1, 24 * 30))
+        rate = rng.randint(25, 80)
+        latitude = ORIGIN[0] + rng.uniform(-0.5, 0.5) if rng.random() > 0.05 else None
+        longitude = ORIGIN[1] + rng.uniform(-0.5, 0.5) if latitude is not None else None
+        trades = ["CHEF"] + rng.sample([trade for trade in TRADES if trade != "CHEF"], rng.randint(0, 2))
+        rows += [(listing_id, required, required + timedelta(hours=4), rate, latitude, longitude, trade) for trade in trades]
+    return rows
+
+def python_rank(listings, trade, limit, origin, weights, now, soon_hours, distance_km):
+    #the baseline, one python loop over the candidates and a heap for the top k
+    candidates = [
+        (listing_id, required.timestamp(), rate, latitude, longitude, trades)
+        for listing_id, (required, _, rate, latitude, longitude, trades) in listings.items()
+        if trade in trades and required.timestamp() >= now
+    ]
+    if not candidates:
+        return []
+
+    rates = [candidate[2] for candidate in candidates]
+    low, spread = min(rates), max(rates) - min(rates)
+
+    def score(candidate):
+        listing_id, required, rate, latitude, longitude, trades = candidate
+        total = weights["rate"] * ((rate - low) / spread if spread > 0 else 1.0)
+        total += weights["soon"] / (1 + max(required - now, 0) / 3600 / soon_hours)
+        if latitude is not None:
+            total += weights["distance"] * math.exp(-haversine_km(*origin, latitude, longitude) / distance_km)
+        total += weights["tags"] / max(len(trades), 1)
+        return total
+
+    return [candidate[0] for candidate in heapq.nlargest(limit, candidates, key=lambda candidate: (score(candidate), -candidate[0]))]
+
+def measure(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+
+    result = summarize(samples)
+    result["ops_per_s"] = iterations / sum(samples)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark relevance ranking against a pure python baseline")
+    parser.add_argument("--candidates", default="1000,10000,100000", help="comma separated board sizes")
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="write results as json to this path")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    now = datetime.now(timezone.utc)
+    results = {}
+
+    for count in [int(value) for value in args.candidates.split(",")]:
+        rows = synthetic_rows(count, rng, now)
+        index = RankingIndex()
+        index.rebuild(rows)
+
+        listings = group_rows(rows)
+        timestamp = now.timestamp()
+
+        vectorized = lambda: index.rank("CHEF", args.limit, origin=ORIGIN, now=timestamp)[0]
+        baseline = lambda: python_rank(listings, "CHEF", args.limit, ORIGIN, RANKING_WEIGHTS, timestamp, RANKING_SOON_HOURS, RANKING_DISTANCE_KM)
+
+        #both implementations must agree before their timings mean anything
+        matches = vectorized() == baseline()
+
+        results[count] = {
+            "numpy": measure(vectorized, args.iterations),
+            "python": measure(baseline, args.iterations),
+            "same_top_k": matches,
+        }
+        results[count]["speedup"] = results[count]["python"]["mean_ms"] / results[count]["numpy"]["mean_ms"]
+        print(f"{count} candidates: numpy {results[count]['numpy']['mean_ms']:.2f}ms, python {results[count]['python']['mean_ms']:.2f}ms, {results[count]['speedup']:.1f}x, same top k: {matches}")
+
+    write_results({
+        "benchmark": "ranking",
+        "environment": environment_info(),
+        "parameters": {"candidates": args.candidates, "limit": args.limit, "iterations": args.iterations, "seed": args.seed},
+        "results": results,
+    }, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#cold start profile, how long importing the app takes and what the lifespan costs before the first request
+#usage (from backend/): python benchmarks/startup.py --runs 5 --max-import-ms 1500
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+from common import BACKEND_DIR, configure_database, environment_info, write_results
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s*(\S+)")
+
+#runs in a fresh interpreter per sample so nothing is already imported
+IMPORT_PROBE = """
+import time
+start = time.perf_counter()
+import main
+import database
+elapsed = time.perf_counter() - start
+engines = database.get_engine.cache_info().currsize + database.get_async_engine.cache_info().currsize
+print(f"{elapsed} {engines}")
+"""
+
+LIFESPAN_PROBE = """
+import asyncio, time
+import main
+async def run():
+    start = time.perf_counter()
+    async with main.lifespan(main.app):
+        return time.perf_counter() - start
+print(asyncio.run(run()))
+"""
+
+def run_probe(code, *flags):
+    result = subprocess.run([sys.executable, *flags, "-c", code], cwd=BACKEND_DIR, capture_output=True, text=True, env=os.environ)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    return result
+
+def slowest_imports(stderr, top):
+    #self time summed per top level package, so "sqlalchemy" covers every sqlalchemy submodule
+    packages = {}
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            package = match.group(3).split(".")[0]
+            packages[package] = packages.get(package, 0) + int(match.group(1))
+    return [{"package": name, "self_ms": micros / 1000} for name, micros in sorted(packages.items(), key=lambda item: -item[1])[:top]]
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile Nexus backend start up")
+    parser.add_argument("--database-url", help="defaults to a fresh sqlite file in a temp dir")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="slowest packages to report")
+    parser.add_argument("--max-import-ms", type=float, help="exit non-zero when the median import is slower")
+    parser.add_argument("--output", help="write results as json to this path")
+    args = parser.parse_args()
+
+    database_url = configure_database(args.database_url)
+
+    imports, engines = [], 0
+    for _ in range(args.runs):
+        elapsed, created = run_probe(IMPORT_PROBE).stdout.split()
+        imports.append(float(elapsed) * 1000)
+        engines = max(engines, int(created))
+
+    #the first lifespan migrates the fresh database, later ones find it up to date
+    lifespans = [float(run_probe(LIFESPAN_PROBE).stdout.strip()) * 1000 for _ in range(args.runs + 1)]
+    importtime = run_probe("import main", "-X", "importtime").stderr
+
+    results = {
+        "import_ms": {"median": statistics.median(imports), "min": min(imports), "max": max(imports)},
+        "engines_created_on_import": engines,
+        "first_lifespan_ms": lifespans[0],
+        "warm_lifespan_ms": {"median": statistics.median(lifespans[1:]), "min": min(lifespans[1:]), "max": max(lifespans[1:])},
+        "slowest_imports": slowest_imports(importtime, args.top),
+    }
+
+    write_results({
+        "benchmark": "startup",
+        "environment": environment_info(),
+        "parameters": {"database": database_url.split("@")[-1], "runs": args.runs},
+        "results": results,
+    }, args.output)
+
+    if engines:
+        print("importing the app created a database engine", file=sys.stderr)
+        return 1
+    if args.max_import_ms is not None and results["import_ms"]["median"] > args.max_import_ms:
+        print(f"median import {results['import_ms']['median']:.0f}ms exceeds {args.max_import_ms:.0f}ms", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
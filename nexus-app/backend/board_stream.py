@@ -0,0 +1,80 @@
+#in-process pub/sub fanning live board changes out to streaming subscribers
+import asyncio
+import os
+import threading
+import config
+
+LIVE_BOARD_STREAM_QUEUE_SIZE = int(os.environ.get("LIVE_BOARD_STREAM_QUEUE_SIZE", 100))
+
+#delivered in place of events once a subscriber has been dropped for falling behind
+EVICTED = object()
+
+class Subscription:
+    def __init__(self, partition, queue_size):
+        self.partition = partition
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.loop = asyncio.get_running_loop()
+        self.evicted = False
+
+class BoardBroker:
+    def __init__(self, queue_size=LIVE_BOARD_STREAM_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self.published = 0
+        self.evictions = 0
+
+    def subscribe(self, partition):
+        subscription = Subscription(partition, self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(partition, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.partition)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.partition]
+
+    def publish(self, partitions, event):
+        #one write fans out to every subscriber of the partitions it touches
+        with self._lock:
+            subscriptions = {subscription for partition in partitions for subscription in self._subscribers.get(partition, ())}
+            self.published += 1
+
+        for subscription in subscriptions:
+            if self._in_loop(subscription.loop):
+                self._deliver(subscription, event)
+            else:
+                #writes from sync code run off the event loop
+                subscription.loop.call_soon_threadsafe(self._deliver, subscription, event)
+
+    def _in_loop(self, loop):
+        try:
+            return asyncio.get_running_loop() is loop
+        except RuntimeError:
+            return False
+
+    def _deliver(self, subscription, event):
+        if subscription.evicted:
+            return
+
+        try:
+            subscription.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            #a slow consumer is dropped rather than buffering without bound, it resyncs from /live_board
+            self.unsubscribe(subscription)
+            subscription.evicted = True
+            self.evictions += 1
+
+            while not subscription.queue.empty():
+                subscription.queue.get_nowait()
+            subscription.queue.put_nowait(EVICTED)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+board_broker = BoardBroker()
@@ -0,0 +1,222 @@
+#in-process caches shared by every request handled by this worker
+import os
+import threading
+import time
+from collections import OrderedDict
+import config
+
+PRINCIPAL_CACHE_SIZE = int(os.environ.get("PRINCIPAL_CACHE_SIZE", 1024))
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.environ.get("PRINCIPAL_CACHE_TTL_SECONDS", 300))
+
+class PrincipalCache:
+    #bounded LRU of authenticated accounts keyed by (token subject, token expiry)
+    #entries live for at most ttl seconds and never past the token's own expiry
+    def __init__(self, maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, subject, expiry):
+        key = (subject, expiry)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, user = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return user
+
+    def set(self, subject, expiry, user):
+        if self.maxsize <= 0:
+            return
+
+        now = time.monotonic()
+        lifetime = self.ttl
+        if expiry is not None:
+            #don't keep a principal around after its token has expired
+            lifetime = min(lifetime, expiry - time.time())
+        if lifetime <= 0:
+            return
+
+        with self._lock:
+            self._entries[(subject, expiry)] = (now + lifetime, user)
+            self._entries.move_to_end((subject, expiry))
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, subject):
+        #drop every cached token for this subject, called whenever the account row changes
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == subject]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+principal_cache = PrincipalCache()
+
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 512))
+#stock changes bump the product board only on the worker that made them, cached product pages are
+#retired after this long so changes made through other workers show up within it
+PRODUCT_BOARD_CACHE_SECONDS = float(os.environ.get("PRODUCT_BOARD_CACHE_SECONDS", 5))
+
+class BoardVersions:
+    #per board partition counter bumped whenever a listing on that board is written,
+    #partitions with a ttl also move on to a new version every ttl seconds
+    def __init__(self, ttls=None):
+        self.ttls = ttls or {}
+        self._versions = {}
+        self._bumped_at = {}
+        self._lock = threading.Lock()
+
+    def get(self, partition):
+        with self._lock:
+            version = self._versions.get(partition, 0)
+        ttl = self.ttls.get(partition)
+        if ttl:
+            return version, int(time.time() // ttl)
+        return version
+
+    def changed_within(self, partition, seconds):
+        with self._lock:
+            return time.monotonic() - self._bumped_at.get(partition, float("-inf")) < seconds
+
+    def bump(self, partitions):
+        now = time.monotonic()
+        with self._lock:
+            for partition in set(partitions):
+                self._versions[partition] = self._versions.get(partition, 0) + 1
+                self._bumped_at[partition] = now
+
+class ResponseCache:
+    #serialized response bodies shared by every user who sees the same board version
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, etag, body):
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (etag, body)
+            self._entries.move_to_end(key)
+
+            #keys embed the board version, so superseded versions age out from the front
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+#the product board partition is ListingType.PRODUCT.value
+board_versions = BoardVersions({"PRODUCT": PRODUCT_BOARD_CACHE_SECONDS})
+response_cache = ResponseCache()
+
+class TagCache:
+    #tag name to id, tags are never deleted and an id is only cached once the transaction
+    #that created it has committed, so a cached id always names a stored tag
+    def __init__(self):
+        self._ids = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, names):
+        #returns ({name: id} for cached names, [names that aren't cached])
+        with self._lock:
+            found = {name: self._ids[name] for name in names if name in self._ids}
+            missing = [name for name in names if name not in found]
+            self.hits += len(found)
+            self.misses += len(missing)
+            return found, missing
+
+    def update(self, rows):
+        with self._lock:
+            self._ids.update({name: tag_id for tag_id, name in rows})
+
+    def replace(self, rows):
+        ids = {name: tag_id for tag_id, name in rows}
+        with self._lock:
+            self._ids = ids
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._ids), "hits": self.hits, "misses": self.misses}
+
+tag_cache = TagCache()
+
+class TokenDenylist:
+    #revoked refresh token families, entries only need to outlive the access tokens issued to them
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, family):
+        now = time.monotonic()
+        with self._lock:
+            self._entries[family] = now + self.ttl
+            self._entries.move_to_end(family)
+            self._evict(now)
+
+    def __contains__(self, family):
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            return family in self._entries
+
+    def _evict(self, now):
+        #insertion order is expiry order since the ttl is fixed
+        while self._entries:
+            family, expires_at = next(iter(self._entries.items()))
+            if expires_at > now:
+                break
+            del self._entries[family]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
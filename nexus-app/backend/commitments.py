@@ -0,0 +1,145 @@
+#per provider interval index of the shifts they have applied for, used to reject overlapping
+#applications and to hide clashing jobs from the live board
+import os
+import threading
+from bisect import bisect_left, insort
+from collections import OrderedDict
+import config
+from listing_index import CatchUpWatermark
+
+COMMITMENT_CACHE_SIZE = int(os.environ.get("COMMITMENT_CACHE_SIZE", 4096))
+
+class IntervalSet:
+    #shift windows sorted by start with a running max of the ends, so "does anything overlap
+    #[start, end)" is one bisect and one lookup however many shifts the provider holds,
+    #times are naive utc as stored, the same values the database re-check in apply compares
+    def __init__(self, intervals=()):
+        self._intervals = sorted((start, end or start, listing_id) for listing_id, start, end in intervals)
+        self._listing_ids = {listing_id for _, _, listing_id in self._intervals}
+        self._reindex()
+
+    def _reindex(self):
+        #rebuilt on every add, a provider holds a handful of shifts
+        starts = [start for start, _, _ in self._intervals]
+        max_ends = []
+        latest = None
+        for _, end, listing_id in self._intervals:
+            if latest is None or end > latest[0]:
+                latest = (end, listing_id)
+            max_ends.append(latest)
+        #swapped in as one reference so a board read running alongside an apply sees a consistent pair
+        self._index = (starts, max_ends)
+
+    def __contains__(self, listing_id):
+        return listing_id in self._listing_ids
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def add(self, listing_id, start, end):
+        if listing_id in self._listing_ids:
+            return
+        insort(self._intervals, (start, end or start, listing_id))
+        self._listing_ids.add(listing_id)
+        self._reindex()
+
+    def remove(self, listing_id):
+        if listing_id not in self._listing_ids:
+            return
+        self._intervals = [interval for interval in self._intervals if interval[2] != listing_id]
+        self._listing_ids.discard(listing_id)
+        self._reindex()
+
+    def overlapping(self, start, end):
+        #returns the id of a held listing overlapping [start, end), or None
+        #only shifts starting before end can overlap, and one of them does iff the latest of their ends is after start
+        starts, max_ends = self._index
+        position = bisect_left(starts, end)
+        if position == 0:
+            return None
+        latest_end, listing_id = max_ends[position - 1]
+        return listing_id if latest_end > start else None
+
+    def overlaps(self, start, end):
+        return self.overlapping(start, end) is not None
+
+    def bounds(self):
+        #(starts, running max of ends) for callers that test many windows at once
+        starts, max_ends = self._index
+        return starts, [end for end, _ in max_ends]
+
+class CommitmentIndex:
+    #bounded LRU of providers' interval sets, a provider's set is loaded from the database on first use
+    #and kept current by applies on this worker and a catch-up on applications made through other workers,
+    #it is a fast path only, apply re-checks the database before committing
+    def __init__(self, maxsize=COMMITMENT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._sets = OrderedDict()
+        self._lock = threading.Lock()
+        #application ids, applies on this worker claim theirs
+        self.watermark = CatchUpWatermark()
+        self.loads = 0
+        self.conflicts = 0
+        #overlaps the database check caught after this worker's sets let them through
+        self.late_conflicts = 0
+
+    def get(self, provider_id):
+        with self._lock:
+            intervals = self._sets.get(provider_id)
+            if intervals is not None:
+                self._sets.move_to_end(provider_id)
+            return intervals
+
+    def load(self, provider_id, rows):
+        #rows are (listing_id, start, end), a set loaded concurrently by another request wins
+        intervals = IntervalSet(rows)
+        with self._lock:
+            self.loads += 1
+            intervals = self._sets.setdefault(provider_id, intervals)
+            self._sets.move_to_end(provider_id)
+            while len(self._sets) > self.maxsize:
+                self._sets.popitem(last=False)
+            return intervals
+
+    def reserve(self, provider_id, listing_id, start, end):
+        #claims the window before the application commits so two applies on this worker can't both pass,
+        #an apply through another worker is only seen once caught up,
+        #returns the id of the listing it clashes with (listing_id itself when already held), or None
+        with self._lock:
+            intervals = self._sets.get(provider_id)
+            if intervals is None:
+                return None
+            if listing_id in intervals:
+                return listing_id
+
+            conflict = intervals.overlapping(start, end)
+            if conflict is not None:
+                self.conflicts += 1
+                return conflict
+
+            intervals.add(listing_id, start, end)
+            return None
+
+    def release(self, provider_id, listing_id):
+        with self._lock:
+            intervals = self._sets.get(provider_id)
+            if intervals is not None:
+                intervals.remove(listing_id)
+
+    def extend(self, rows):
+        #rows are (application_id, applicant_id, listing_id, start, end) from a catch-up scan, applications this
+        #worker made are skipped, providers that aren't cached will load them from the database anyway
+        fresh = set(self.watermark.advance([row[0] for row in rows]))
+        with self._lock:
+            for application_id, applicant_id, listing_id, start, end in rows:
+                if application_id not in fresh:
+                    continue
+                intervals = self._sets.get(applicant_id)
+                if intervals is not None:
+                    intervals.add(listing_id, start, end)
+
+    def stats(self):
+        with self._lock:
+            return {"providers": len(self._sets), "maxsize": self.maxsize, "loads": self.loads, "conflicts": self.conflicts, "late_conflicts": self.late_conflicts}
+
+commitment_index = CommitmentIndex()
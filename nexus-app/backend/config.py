@@ -0,0 +1,4 @@
+#settings come from the environment, a local .env file is read once here for every module that imports this
+from dotenv import load_dotenv
+
+load_dotenv()
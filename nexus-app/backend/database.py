@@ -1,22 +1,221 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
-from models import Base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from fastapi import Request
+from instrumentation import instrument_engine
+from collections import OrderedDict
+from functools import cache, cached_property
+import hashlib
+import itertools
+import logging
 import os
-from dotenv import load_dotenv
-
-load_dotenv()
+import threading
+import time
+import config
 
 DATABASE_URL = os.environ.get("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL, echo=True)
+#statement logging is for local debugging only, use /metrics for aggregate figures
+SQL_ECHO = os.environ.get("SQL_ECHO", "false").lower() == "true"
+
+#async drivers for the dialects we run against
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+def to_async_url(url):
+    url = make_url(url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No async driver configured for {url.get_backend_name()}")
+    return url.set(drivername=driver)
+
+#can be set explicitly when the async driver isn't the default one
+ASYNC_DATABASE_URL = os.environ.get("ASYNC_DATABASE_URL")
+
+#comma separated read replicas of DATABASE_URL, reads fall back to the primary when none are healthy
+DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+#how long a client keeps reading from the primary after one of its writes, should exceed replica lag
+REPLICA_PIN_SECONDS = float(os.environ.get("REPLICA_PIN_SECONDS", 5))
+REPLICA_PIN_MAX_CLIENTS = int(os.environ.get("REPLICA_PIN_MAX_CLIENTS", 10000))
+
+def pool_options(prefix):
+    #DB_POOL_SIZE, DB_MAX_OVERFLOW and DB_POOL_RECYCLE for the primary, DB_REPLICA_* for replicas,
+    #unset values keep sqlalchemy's defaults
+    options = {"pool_pre_ping": True}
+    for name, option in (("POOL_SIZE", "pool_size"), ("MAX_OVERFLOW", "max_overflow"), ("POOL_RECYCLE", "pool_recycle")):
+        value = os.environ.get(f"{prefix}_{name}")
+        if value is not None:
+            options[option] = int(value)
+    return options
+
+#engines are built on first use, importing this module never touches the database,
+#the schema is managed by migrations.py from the app lifespan
+@cache
+def get_engine():
+    engine = create_engine(DATABASE_URL, echo=SQL_ECHO, **pool_options("DB"))
+    instrument_engine(engine)
+    return engine
+
+@cache
+def get_async_engine():
+    async_engine = create_async_engine(ASYNC_DATABASE_URL or to_async_url(DATABASE_URL), echo=SQL_ECHO, **pool_options("DB"))
+    instrument_engine(async_engine.sync_engine)
+    return async_engine
+
+@cache
+def session_factory():
+    return sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
+
+@cache
+def async_session_factory():
+    #objects stay readable after commit, async sessions can't lazy load expired attributes
+    return async_sessionmaker(bind=get_async_engine(), autoflush=False, expire_on_commit=False)
+
+def SessionLocal(**kwargs):
+    return session_factory()(**kwargs)
+
+def AsyncSessionLocal(**kwargs):
+    return async_session_factory()(**kwargs)
+
+class Replica:
+    def __init__(self, url):
+        self.url = make_url(url)
+        self.healthy = True
+
+    @cached_property
+    def engine(self):
+        engine = create_engine(self.url, echo=SQL_ECHO, **pool_options("DB_REPLICA"))
+        instrument_engine(engine)
+        return engine
+
+    @cached_property
+    def async_engine(self):
+        async_engine = create_async_engine(to_async_url(self.url), echo=SQL_ECHO, **pool_options("DB_REPLICA"))
+        instrument_engine(async_engine.sync_engine)
+        return async_engine
+
+    @cached_property
+    def session(self):
+        return sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+
+    @cached_property
+    def async_session(self):
+        return async_sessionmaker(bind=self.async_engine, autoflush=False, expire_on_commit=False)
+
+class ReplicaSet:
+    #round robin over the replicas that passed their last health check
+    def __init__(self, urls):
+        self.replicas = [Replica(url) for url in urls]
+        self._cycle = itertools.cycle(self.replicas)
+        self._lock = threading.Lock()
+        self.reads = {"replica": 0, "primary": 0}
+
+    def choose(self):
+        with self._lock:
+            for _ in range(len(self.replicas)):
+                replica = next(self._cycle)
+                if replica.healthy:
+                    self.reads["replica"] += 1
+                    return replica
+            self.reads["primary"] += 1
+            return None
 
-Base.metadata.create_all(engine)
+    def mark(self, replica, healthy):
+        if replica.healthy != healthy:
+            logging.warning(f"Read replica {replica.url.render_as_string(hide_password=True)} is {'healthy' if healthy else 'unhealthy'}")
+        replica.healthy = healthy
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    async def check(self):
+        for replica in self.replicas:
+            try:
+                async with replica.async_engine.connect() as connection:
+                    await connection.execute(text("SELECT 1"))
+                self.mark(replica, True)
+            except Exception:
+                self.mark(replica, False)
+
+    def stats(self):
+        stats = dict(self.reads)
+        stats["healthy"] = sum(replica.healthy for replica in self.replicas)
+        stats["replicas"] = len(self.replicas)
+        return stats
+
+replica_set = ReplicaSet(DATABASE_REPLICA_URLS)
+
+class PrimaryPins:
+    #clients that wrote recently read from the primary so they see their own writes
+    def __init__(self, ttl=REPLICA_PIN_SECONDS, maxsize=REPLICA_PIN_MAX_CLIENTS):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._pins = OrderedDict()
+        self._lock = threading.Lock()
+
+    def client_key(self, request):
+        authorization = request.headers.get("authorization")
+        if not authorization:
+            return None
+        return hashlib.sha256(authorization.encode()).digest()
+
+    def pin(self, request):
+        key = self.client_key(request)
+        if key is None:
+            return
+
+        with self._lock:
+            self._pins[key] = time.monotonic() + self.ttl
+            self._pins.move_to_end(key)
+            while len(self._pins) > self.maxsize:
+                self._pins.popitem(last=False)
+
+    def is_pinned(self, request):
+        key = self.client_key(request)
+        if key is None:
+            return False
+
+        now = time.monotonic()
+        with self._lock:
+            #pins share one ttl, so the front of the dict expires first
+            while self._pins and next(iter(self._pins.values())) <= now:
+                self._pins.popitem(last=False)
+            return key in self._pins
+
+primary_pins = PrimaryPins()
+
+def is_replica_session(db):
+    return db.bind is not get_async_engine() and db.bind is not get_engine()
+
+def read_replica(request):
+    #only safe methods from clients without a recent write are sent to a replica
+    if not replica_set.replicas or request.method not in ("GET", "HEAD"):
+        return None
+    if primary_pins.is_pinned(request):
+        return None
+    return replica_set.choose()
 
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def get_read_db(request: Request):
+    replica = read_replica(request)
+    db = (replica.session if replica else SessionLocal)()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_read_db(request: Request):
+    replica = read_replica(request)
+    async with (replica.async_session if replica else AsyncSessionLocal)() as db:
+        yield db
@@ -0,0 +1,166 @@
+#geocoding and an in-process spatial grid for radius searches over listings
+import asyncio
+import hashlib
+import math
+import os
+import threading
+from abc import ABC, abstractmethod
+import config
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+#roughly 11km cells, a radius query touches a handful of cells at city scale
+GEO_GRID_CELL_DEGREES = float(os.environ.get("GEO_GRID_CELL_DEGREES", 0.1))
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+class Geocoder(ABC):
+    #geocoders that call out over the network block, async callers run them on a thread
+    blocking = True
+
+    @abstractmethod
+    def geocode(self, address):
+        #returns (latitude, longitude) or None when the address can't be resolved
+        pass
+
+class StubGeocoder(Geocoder):
+    #offline geocoder for local development, known places resolve to their centre and
+    #anything else lands at a stable point near the default centre
+    PLACES = {
+        "melbourne": (-37.8136, 144.9631),
+        "sydney": (-33.8688, 151.2093),
+        "brisbane": (-27.4698, 153.0251),
+        "perth": (-31.9523, 115.8613),
+        "adelaide": (-34.9285, 138.6007),
+        "hobart": (-42.8821, 147.3272),
+        "canberra": (-35.2809, 149.1300),
+        "darwin": (-12.4634, 130.8456),
+    }
+    DEFAULT_CENTRE = PLACES["melbourne"]
+    SPREAD_DEGREES = 0.3
+    blocking = False
+
+    def geocode(self, address):
+        if not address:
+            return None
+
+        normalised = address.lower()
+        centre = self.DEFAULT_CENTRE
+        for place, coordinates in self.PLACES.items():
+            if place in normalised:
+                centre = coordinates
+                break
+
+        #deterministic offset so the same address always maps to the same point
+        digest = hashlib.sha256(normalised.encode()).digest()
+        lat_offset = (digest[0] / 255 - 0.5) * self.SPREAD_DEGREES
+        lon_offset = (digest[1] / 255 - 0.5) * self.SPREAD_DEGREES
+        return centre[0] + lat_offset, centre[1] + lon_offset
+
+GEOCODERS = {
+    "stub": StubGeocoder,
+}
+
+geocoder = GEOCODERS[os.environ.get("GEOCODER", "stub")]()
+
+def set_geocoder(new_geocoder: Geocoder):
+    global geocoder
+    geocoder = new_geocoder
+
+def geocode(address):
+    return geocoder.geocode(address)
+
+async def geocode_async(address):
+    #for request handlers, a network geocoder must not hold up the event loop
+    if geocoder.blocking:
+        return await asyncio.to_thread(geocoder.geocode, address)
+    return geocoder.geocode(address)
+
+def bounding_box(latitude, longitude, radius_km):
+    #(min_lat, max_lat, min_lon, max_lon) around the circle, longitude degrees shrink towards the poles
+    lat_delta = radius_km / KM_PER_DEGREE_LAT
+    lon_delta = radius_km / (KM_PER_DEGREE_LAT * max(math.cos(math.radians(latitude)), 0.01))
+    return max(latitude - lat_delta, -90), min(latitude + lat_delta, 90), longitude - lon_delta, longitude + lon_delta
+
+def within_radius(latitude, longitude, radius_km, point_latitude, point_longitude):
+    if point_latitude is None or point_longitude is None:
+        return False
+    return haversine_km(latitude, longitude, point_latitude, point_longitude) <= radius_km
+
+def grid_cell(latitude, longitude):
+    return (math.floor(latitude / GEO_GRID_CELL_DEGREES), math.floor(longitude / GEO_GRID_CELL_DEGREES))
+
+class GeoGridIndex:
+    #uniform lat/lon grid, radius queries only look at cells overlapping the bounding box
+    def __init__(self):
+        self._cells = {}
+        self._points = {}
+        self._lock = threading.Lock()
+        self.ready = False
+
+    def add(self, listing_id, latitude, longitude):
+        if latitude is None or longitude is None:
+            return
+
+        with self._lock:
+            self._remove(listing_id)
+            self._points[listing_id] = (latitude, longitude)
+            self._cells.setdefault(grid_cell(latitude, longitude), set()).add(listing_id)
+
+    def remove(self, listing_id):
+        with self._lock:
+            self._remove(listing_id)
+
+    def _remove(self, listing_id):
+        point = self._points.pop(listing_id, None)
+        if point is None:
+            return
+
+        cell = grid_cell(*point)
+        ids = self._cells.get(cell)
+        if ids is not None:
+            ids.discard(listing_id)
+            if not ids:
+                del self._cells[cell]
+
+    def rebuild(self, rows):
+        points = {}
+        cells = {}
+        for listing_id, latitude, longitude in rows:
+            if latitude is None or longitude is None:
+                continue
+            points[listing_id] = (latitude, longitude)
+            cells.setdefault(grid_cell(latitude, longitude), set()).add(listing_id)
+
+        with self._lock:
+            self._points = points
+            self._cells = cells
+            self.ready = True
+
+    def within(self, latitude, longitude, radius_km):
+        #prune by grid cell first, then confirm each candidate with the exact distance
+        min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, radius_km)
+        min_cell = grid_cell(min_lat, min_lon)
+        max_cell = grid_cell(max_lat, max_lon)
+
+        with self._lock:
+            cell_count = (max_cell[0] - min_cell[0] + 1) * (max_cell[1] - min_cell[1] + 1)
+
+            #very large radii cover more cells than there are points
+            if cell_count > len(self._points):
+                candidates = self._points.items()
+            else:
+                candidates = (
+                    (listing_id, self._points[listing_id])
+                    for lat_cell in range(min_cell[0], max_cell[0] + 1)
+                    for lon_cell in range(min_cell[1], max_cell[1] + 1)
+                    for listing_id in self._cells.get((lat_cell, lon_cell), ())
+                )
+
+            return {listing_id for listing_id, point in candidates if haversine_km(latitude, longitude, *point) <= radius_km}
+
+geo_index = GeoGridIndex()
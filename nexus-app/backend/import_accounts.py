@@ -0,0 +1,125 @@
+#bulk account import for onboarding partner businesses and their staff
+#usage (from backend/): python import_accounts.py staff.csv --batch-size 500
+#rows take the same fields as /register, csv files need a header row, .ndjson/.jsonl files hold one object per line
+import argparse
+import csv
+import json
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
+from database import SessionLocal, get_engine
+from migrations import run_migrations
+from hashing import pwd_context, PASSWORD_HASH_WORKERS
+from models import AccountManager, account_conflict
+from schemas import BusinessRegistrationModel, ServiceProviderRegisterModel
+
+REGISTRATION_MODELS = {
+    "BUSINESS": BusinessRegistrationModel,
+    "SERVICEPROVIDER": ServiceProviderRegisterModel,
+}
+
+def read_rows(path, file_format=None):
+    #yields (line number, row dict), row is None for a line that isn't valid json
+    file_format = file_format or ("csv" if path.endswith(".csv") else "ndjson")
+
+    with open(path, newline="") as handle:
+        if file_format == "csv":
+            #the header is line 1, empty cells count as missing fields
+            for number, row in enumerate(csv.DictReader(handle), start=2):
+                yield number, {key: value for key, value in row.items() if value not in (None, "")}
+        else:
+            for number, line in enumerate(handle, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield number, row
+
+def validate(rows):
+    #returns ([(line, model)], [(line, error)])
+    valid, rejected = [], []
+    for line, row in rows:
+        if row is None:
+            rejected.append((line, "invalid JSON"))
+            continue
+        if not isinstance(row, dict):
+            rejected.append((line, "Expected a JSON object"))
+            continue
+        model = REGISTRATION_MODELS.get(row.get("account_type"))
+        if model is None:
+            rejected.append((line, "Invalid account type"))
+            continue
+        try:
+            valid.append((line, model(**row)))
+        except ValidationError as e:
+            rejected.append((line, "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())))
+    return valid, rejected
+
+def build_accounts(account_manager, users, hashes):
+    accounts, rejected = [], []
+    for (line, user), hashed_password in zip(users, hashes):
+        try:
+            account = account_manager.build_account(user.account_type.value, user.model_dump(), hashed_password)
+            account_manager.locate_account(account)
+            accounts.append((line, account))
+        except HTTPException as e:
+            rejected.append((line, e.detail))
+    return accounts, rejected
+
+def insert_batch(account_manager, batch):
+    #the whole batch goes in one transaction, a conflicting batch is retried row by row to find the culprits
+    try:
+        account_manager.bulk_add_accounts([account for _, account in batch])
+        return len(batch), []
+    except IntegrityError:
+        pass
+
+    created, rejected = 0, []
+    for line, account in batch:
+        try:
+            account_manager.bulk_add_accounts([account])
+            created += 1
+        except IntegrityError as e:
+            rejected.append((line, account_conflict(e).detail))
+    return created, rejected
+
+def main():
+    parser = argparse.ArgumentParser(description="Import Nexus accounts in bulk")
+    parser.add_argument("path", help="csv or ndjson file of registrations")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="defaults to the file extension")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--hash-workers", type=int, default=PASSWORD_HASH_WORKERS, help="parallel bcrypt threads")
+    args = parser.parse_args()
+
+    users, rejected = validate(read_rows(args.path, args.format))
+
+    #bcrypt releases the gil, so threads hash on every core
+    with ThreadPoolExecutor(max_workers=args.hash_workers) as executor:
+        hashes = list(executor.map(pwd_context.hash, [user.password for _, user in users]))
+
+    run_migrations(get_engine())
+
+    created = 0
+    with SessionLocal() as db:
+        account_manager = AccountManager(db)
+        accounts, build_rejected = build_accounts(account_manager, users, hashes)
+        rejected += build_rejected
+
+        for start in range(0, len(accounts), args.batch_size):
+            batch_created, batch_rejected = insert_batch(account_manager, accounts[start:start + args.batch_size])
+            created += batch_created
+            rejected += batch_rejected
+
+    for line, reason in sorted(rejected):
+        print(f"line {line}: {reason}", file=sys.stderr)
+    logging.warning(f"Account import: {created} created, {len(rejected)} rejected")
+    print(json.dumps({"created": created, "rejected": len(rejected)}))
+    return 0 if not rejected else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
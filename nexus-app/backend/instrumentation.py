@@ -0,0 +1,137 @@
+#per request sql instrumentation hooked into the engines' cursor events
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+from sqlalchemy import event
+import config
+
+#the same statement this many times in one request is almost always a lazy load in a loop
+N_PLUS_ONE_THRESHOLD = int(os.environ.get("N_PLUS_ONE_THRESHOLD", 5))
+
+#X-DB-* headers on every response, for local debugging only
+QUERY_DEBUG_HEADERS = os.environ.get("QUERY_DEBUG_HEADERS", "false").lower() == "true"
+#scrapers send it as a bearer token, without it /metrics only answers requests from this host
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+REQUEST_SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+class RequestQueryStats:
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.statements = Counter()
+
+    def record(self, statement, elapsed):
+        self.count += 1
+        self.total_time += elapsed
+
+        #n+1 patterns are repeated reads, batched writes legitimately repeat their insert
+        if statement.lstrip()[:6].upper() == "SELECT":
+            self.statements[statement] += 1
+
+    def repeated_statements(self, threshold=N_PLUS_ONE_THRESHOLD):
+        return {statement: count for statement, count in self.statements.items() if count >= threshold}
+
+#set by the request middleware, statements run outside a request aren't attributed
+current_query_stats = ContextVar("current_query_stats", default=None)
+
+def instrument_engine(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def record_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+
+        stats = current_query_stats.get()
+        if stats is not None:
+            stats.record(statement, elapsed)
+
+    @event.listens_for(engine, "handle_error")
+    def discard_query_timer(exception_context):
+        timers = exception_context.connection.info.get("query_start_time") if exception_context.connection is not None else None
+        if timers:
+            timers.pop()
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+class QueryMetrics:
+    #aggregated per route across every request this worker has served
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.request_seconds = {}
+        self.db_seconds = {}
+        self.query_count = {}
+        self.n_plus_one = Counter()
+
+    def observe(self, method, route, duration, stats: RequestQueryStats):
+        key = (method, route)
+        repeated = stats.repeated_statements()
+
+        with self._lock:
+            self.request_seconds.setdefault(key, Histogram(REQUEST_SECONDS_BUCKETS)).observe(duration)
+            self.db_seconds.setdefault(key, Histogram(REQUEST_SECONDS_BUCKETS)).observe(stats.total_time)
+            self.query_count.setdefault(key, Histogram(QUERY_COUNT_BUCKETS)).observe(stats.count)
+            if repeated:
+                self.n_plus_one[key] += 1
+
+        for statement, count in repeated.items():
+            logging.warning(f"Possible N+1 on {method} {route}: statement ran {count} times: {' '.join(statement.split())[:200]}")
+
+        return repeated
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, description, histograms in (
+                ("http_request_duration_seconds", "Request latency", self.request_seconds),
+                ("db_time_seconds", "Time spent in SQL per request", self.db_seconds),
+                ("db_queries_per_request", "SQL statements per request", self.query_count),
+            ):
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} histogram")
+                for (method, route), histogram in sorted(histograms.items()):
+                    lines.extend(histogram.render(name, f'method="{method}",route="{route}"'))
+
+            lines.append("# HELP db_n_plus_one_requests_total Requests that repeated a statement at least N_PLUS_ONE_THRESHOLD times")
+            lines.append("# TYPE db_n_plus_one_requests_total counter")
+            for (method, route), count in sorted(self.n_plus_one.items()):
+                lines.append(f'db_n_plus_one_requests_total{{method="{method}",route="{route}"}} {count}')
+
+        return lines
+
+def render_counters(name, description, values):
+    #plain counters/gauges for stats kept elsewhere, values maps a label value to a number
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+    for label, value in values.items():
+        lines.append(f'{name}{{kind="{label}"}} {value}')
+    return lines
+
+query_metrics = QueryMetrics()
@@ -0,0 +1,388 @@
+#product stock reservations, stock only moves through conditional updates so concurrent buyers can't oversell
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+import config
+from fastapi import HTTPException
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Account, Listing, ListingType, ProductListing, Reservation, ReservationStatus
+from cache import board_versions
+from board_stream import board_broker
+from database import AsyncSessionLocal
+
+#a held reservation keeps its stock this long before the sweeper returns it
+RESERVATION_TTL_SECONDS = float(os.environ.get("RESERVATION_TTL_SECONDS", 600))
+RESERVATION_SWEEP_SECONDS = float(os.environ.get("RESERVATION_SWEEP_SECONDS", 30))
+RESERVATION_SWEEP_BATCH_SIZE = int(os.environ.get("RESERVATION_SWEEP_BATCH_SIZE", 500))
+RESERVATION_SWEEP_MAX_BATCHES = int(os.environ.get("RESERVATION_SWEEP_MAX_BATCHES", 20))
+#reserves for the same product arriving this close together share one update, off by default since it only pays off
+#on a database with row locks (postgres), on sqlite every writer already queues on one database lock
+RESERVATION_BATCH_WINDOW_MS = float(os.environ.get("RESERVATION_BATCH_WINDOW_MS", 0))
+RESERVATION_MAX_BATCH = int(os.environ.get("RESERVATION_MAX_BATCH", 256))
+
+product_listings = ProductListing.__table__
+reservations = Reservation.__table__
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+class AsyncInventoryManager:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    def product_not_found(self):
+        return HTTPException(status_code=404, detail="Product listing not found")
+
+    def out_of_stock(self):
+        return HTTPException(status_code=409, detail="Not enough stock")
+
+    def reservation_not_found(self):
+        return HTTPException(status_code=404, detail="Reservation not found")
+
+    def reservation_closed(self):
+        return HTTPException(status_code=409, detail="Reservation has expired or is already complete")
+
+    def stock_changed(self):
+        return HTTPException(status_code=409, detail="Stock was changed by someone else, reload it and try again")
+
+    def take_stock_statement(self, listing_id, quantity):
+        #the check and the decrement are one statement, no other buyer can get between them
+        return (
+            update(product_listings)
+            .where(product_listings.c.id == listing_id, product_listings.c.quantity >= quantity)
+            .values(quantity=product_listings.c.quantity - quantity, version=product_listings.c.version + 1)
+            .returning(product_listings.c.quantity, product_listings.c.version)
+        )
+
+    def return_stock_statement(self):
+        #executemany over {"listing_id", "returned"} rows
+        return (
+            update(product_listings)
+            .where(product_listings.c.id == bindparam("listing_id"))
+            .values(quantity=product_listings.c.quantity + bindparam("returned"), version=product_listings.c.version + 1)
+        )
+
+    def stock_levels_query(self, listing_ids):
+        return select(product_listings.c.id, product_listings.c.quantity, product_listings.c.version).where(product_listings.c.id.in_(listing_ids))
+
+    def stock_event(self, listing_id, quantity, version):
+        #a partial listing, subscribers merge it into the product they already have by id
+        return {"event": "changed", "listing": {"id": listing_id, "quantity": quantity, "version": version}}
+
+    def publish_stock(self, rows):
+        #only called once the stock change has committed, rows are (listing_id, quantity, version)
+        partitions = [ListingType.PRODUCT.value]
+        board_versions.bump(partitions)
+        for listing_id, quantity, version in rows:
+            board_broker.publish(partitions, self.stock_event(listing_id, quantity, version))
+
+    def product_exists_query(self, listing_id):
+        return select(product_listings.c.id).where(product_listings.c.id == listing_id)
+
+    def insert_reservation_query(self, listing_id, buyer: Account, quantity, now):
+        return (
+            insert(Reservation)
+            .values(
+                listing_id=listing_id,
+                account_id=buyer.id,
+                quantity=quantity,
+                status=ReservationStatus.HELD,
+                created_at=now,
+                expires_at=now + timedelta(seconds=RESERVATION_TTL_SECONDS),
+            )
+            .returning(Reservation.id, Reservation.expires_at)
+        )
+
+    def reserved(self, listing_id, quantity, reservation, stock):
+        return {
+            "reservation_id": reservation.id,
+            "listing_id": listing_id,
+            "quantity": quantity,
+            "expires_at": reservation.expires_at,
+            "remaining": stock.quantity,
+            "version": stock.version,
+        }
+
+    def insert_reservations_query(self):
+        return insert(Reservation).returning(Reservation.id, sort_by_parameter_order=True)
+
+    def reservation_rows(self, listing_id, requests, granted, now):
+        expires_at = now + timedelta(seconds=RESERVATION_TTL_SECONDS)
+        return [
+            {
+                "listing_id": listing_id,
+                "account_id": account_id,
+                "quantity": quantity,
+                "status": ReservationStatus.HELD,
+                "created_at": now,
+                "expires_at": expires_at,
+            }
+            for (account_id, quantity), stock in zip(requests, granted)
+            if stock is not None
+        ]
+
+    def batch_results(self, listing_id, requests, granted, reservation_ids, now):
+        #one result per request, an exception for the requests there wasn't stock for
+        reservation_ids = iter(reservation_ids)
+        expires_at = now + timedelta(seconds=RESERVATION_TTL_SECONDS)
+        results = []
+        for (_, quantity), stock in zip(requests, granted):
+            if stock is None:
+                results.append(self.out_of_stock())
+                continue
+            results.append({
+                "reservation_id": next(reservation_ids),
+                "listing_id": listing_id,
+                "quantity": quantity,
+                "expires_at": expires_at,
+                "remaining": stock.quantity,
+                "version": stock.version,
+            })
+        return results
+
+    def complete_statement(self, reservation_id, buyer: Account, status, now):
+        #only a held reservation moves on, and a purchase only before it expires
+        query = update(reservations).where(
+            reservations.c.id == reservation_id,
+            reservations.c.account_id == buyer.id,
+            reservations.c.status == ReservationStatus.HELD,
+        )
+        if status == ReservationStatus.PURCHASED:
+            query = query.where(reservations.c.expires_at > now)
+        return query.values(status=status, completed_at=now).returning(reservations.c.listing_id, reservations.c.quantity)
+
+    def reservation_exists_query(self, reservation_id, buyer: Account):
+        return select(reservations.c.id).where(reservations.c.id == reservation_id, reservations.c.account_id == buyer.id)
+
+    def completed(self, reservation_id, status, row):
+        return {"reservation_id": reservation_id, "listing_id": row.listing_id, "quantity": row.quantity, "status": status.value}
+
+    def closed_or_missing(self, exists):
+        return self.reservation_closed() if exists is not None else self.reservation_not_found()
+
+    def set_stock_statement(self, listing_id, business: Account, quantity, version):
+        #optimistic, the owner sends the version it last read and loses to any stock change since
+        owned = select(Listing.id).where(Listing.id == listing_id, Listing.created_by == business.id)
+        return (
+            update(product_listings)
+            .where(product_listings.c.id.in_(owned), product_listings.c.version == version)
+            .values(quantity=quantity, version=product_listings.c.version + 1)
+            .returning(product_listings.c.quantity, product_listings.c.version)
+        )
+
+    def owned_product_query(self, listing_id, business: Account):
+        return select(product_listings.c.id).join(Listing, Listing.id == product_listings.c.id).where(product_listings.c.id == listing_id, Listing.created_by == business.id)
+
+    def stock_result(self, listing_id, row):
+        return {"listing_id": listing_id, "quantity": row.quantity, "version": row.version}
+
+    def expired_ids_query(self, now, limit):
+        #served by the status/expiry index, skip locked keeps sweepers on other workers off the same rows
+        return (
+            select(reservations.c.id)
+            .where(reservations.c.status == ReservationStatus.HELD, reservations.c.expires_at <= now)
+            .order_by(reservations.c.expires_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+
+    def release_expired_statement(self, ids, now):
+        #status is checked again, a reservation released by its buyer in the meantime isn't returned twice
+        return (
+            update(reservations)
+            .where(reservations.c.id.in_(ids), reservations.c.status == ReservationStatus.HELD)
+            .values(status=ReservationStatus.RELEASED, completed_at=now)
+            .returning(reservations.c.listing_id, reservations.c.quantity)
+        )
+
+    def returned_stock_rows(self, rows):
+        #one stock update per product however many of its reservations expired
+        returned = {}
+        for listing_id, quantity in rows:
+            returned[listing_id] = returned.get(listing_id, 0) + quantity
+        return [{"listing_id": listing_id, "returned": quantity} for listing_id, quantity in returned.items()]
+
+    async def grant_stock(self, listing_id, requests):
+        #returns a (quantity, version) row per request, None where there wasn't enough left
+        total = sum(quantity for _, quantity in requests)
+        result = await self.session.execute(self.take_stock_statement(listing_id, total))
+        stock = result.first()
+        if stock is not None or len(requests) == 1:
+            return [stock] * len(requests)
+
+        #not enough for the whole batch, first come first served within it
+        granted = []
+        for _, quantity in requests:
+            result = await self.session.execute(self.take_stock_statement(listing_id, quantity))
+            granted.append(result.first())
+        return granted
+
+    async def reserve_batch(self, listing_id, requests):
+        #requests are (account_id, quantity) pairs for one product, all reserved in one transaction
+        now = utcnow()
+        granted = await self.grant_stock(listing_id, requests)
+
+        rows = self.reservation_rows(listing_id, requests, granted, now)
+        if not rows:
+            await self.session.rollback()
+            result = await self.session.execute(self.product_exists_query(listing_id))
+            if result.first() is None:
+                return [self.product_not_found() for _ in requests]
+            return [self.out_of_stock() for _ in requests]
+
+        result = await self.session.execute(self.insert_reservations_query(), rows)
+        reservation_ids = result.scalars().all()
+        await self.session.commit()
+
+        #stock only goes down within the batch, the last grant holds the level it was left at
+        stock = [stock for stock in granted if stock is not None][-1]
+        self.publish_stock([(listing_id, stock.quantity, stock.version)])
+        return self.batch_results(listing_id, requests, granted, reservation_ids, now)
+
+    async def reserve(self, listing_id, buyer: Account, quantity):
+        if RESERVATION_BATCH_WINDOW_MS > 0:
+            return await reservation_batcher.submit(listing_id, buyer.id, quantity)
+
+        now = utcnow()
+        result = await self.session.execute(self.take_stock_statement(listing_id, quantity))
+        stock = result.first()
+        if stock is None:
+            await self.session.rollback()
+            result = await self.session.execute(self.product_exists_query(listing_id))
+            raise self.out_of_stock() if result.first() is not None else self.product_not_found()
+
+        result = await self.session.execute(self.insert_reservation_query(listing_id, buyer, quantity, now))
+        reservation = result.first()
+        await self.session.commit()
+
+        self.publish_stock([(listing_id, stock.quantity, stock.version)])
+        return self.reserved(listing_id, quantity, reservation, stock)
+
+    async def purchase(self, reservation_id, buyer: Account):
+        result = await self.session.execute(self.complete_statement(reservation_id, buyer, ReservationStatus.PURCHASED, utcnow()))
+        row = result.first()
+        if row is None:
+            await self.session.rollback()
+            result = await self.session.execute(self.reservation_exists_query(reservation_id, buyer))
+            raise self.closed_or_missing(result.first())
+
+        await self.session.commit()
+        return self.completed(reservation_id, ReservationStatus.PURCHASED, row)
+
+    async def release(self, reservation_id, buyer: Account):
+        result = await self.session.execute(self.complete_statement(reservation_id, buyer, ReservationStatus.RELEASED, utcnow()))
+        row = result.first()
+        if row is None:
+            await self.session.rollback()
+            result = await self.session.execute(self.reservation_exists_query(reservation_id, buyer))
+            raise self.closed_or_missing(result.first())
+
+        result = await self.session.execute(
+            self.return_stock_statement().returning(product_listings.c.id, product_listings.c.quantity, product_listings.c.version),
+            {"listing_id": row.listing_id, "returned": row.quantity},
+        )
+        stock = result.all()
+        await self.session.commit()
+
+        self.publish_stock(stock)
+        return self.completed(reservation_id, ReservationStatus.RELEASED, row)
+
+    async def set_stock(self, listing_id, business: Account, quantity, version):
+        result = await self.session.execute(self.set_stock_statement(listing_id, business, quantity, version))
+        row = result.first()
+        if row is None:
+            await self.session.rollback()
+            result = await self.session.execute(self.owned_product_query(listing_id, business))
+            raise self.stock_changed() if result.first() is not None else self.product_not_found()
+
+        await self.session.commit()
+        self.publish_stock([(listing_id, row.quantity, row.version)])
+        return self.stock_result(listing_id, row)
+
+    async def sweep_batch(self, now, limit=RESERVATION_SWEEP_BATCH_SIZE):
+        result = await self.session.execute(self.expired_ids_query(now, limit))
+        ids = result.scalars().all()
+        if not ids:
+            await self.session.rollback()
+            return 0
+
+        result = await self.session.execute(self.release_expired_statement(ids, now))
+        rows = result.all()
+        stock = []
+        if rows:
+            returned = self.returned_stock_rows(rows)
+            await self.session.execute(self.return_stock_statement(), returned)
+            result = await self.session.execute(self.stock_levels_query([row["listing_id"] for row in returned]))
+            stock = result.all()
+        await self.session.commit()
+
+        if stock:
+            self.publish_stock(stock)
+        return len(rows)
+
+    async def release_expired(self, now=None):
+        now = now or utcnow()
+        released = 0
+        for _ in range(RESERVATION_SWEEP_MAX_BATCHES):
+            swept = await self.sweep_batch(now)
+            released += swept
+            if swept < RESERVATION_SWEEP_BATCH_SIZE:
+                break
+        return released
+
+class ReservationBatcher:
+    #group commit for reserves: each product has at most one reserve transaction in flight on this worker,
+    #requests arriving while it runs queue up and go together in the next one, sharing a single conditional
+    #update while stock lasts, so a flash sale costs one write per batch instead of a row lock handoff per buyer
+    def __init__(self, window_seconds=RESERVATION_BATCH_WINDOW_MS / 1000, max_batch=RESERVATION_MAX_BATCH):
+        self.window_seconds = window_seconds
+        self.max_batch = max_batch
+        self._queues = {}
+        self._tasks = {}
+        self.batches = 0
+        self.requests = 0
+
+    async def submit(self, listing_id, account_id, quantity):
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(listing_id, []).append((account_id, quantity, future))
+
+        if listing_id not in self._tasks:
+            self._tasks[listing_id] = asyncio.create_task(self._drain(listing_id))
+
+        #a buyer who disconnects still gets their reservation, the sweeper returns it if it isn't bought
+        return await asyncio.shield(future)
+
+    async def _drain(self, listing_id):
+        try:
+            #the first request waits out the window so a burst starts as one batch
+            await asyncio.sleep(self.window_seconds)
+            while self._queues.get(listing_id):
+                queue = self._queues[listing_id]
+                self._queues[listing_id] = queue[self.max_batch:]
+                await self._flush(listing_id, queue[:self.max_batch])
+        finally:
+            self._queues.pop(listing_id, None)
+            del self._tasks[listing_id]
+
+    async def _flush(self, listing_id, batch):
+        self.batches += 1
+        self.requests += len(batch)
+        try:
+            async with AsyncSessionLocal() as db:
+                results = await AsyncInventoryManager(db).reserve_batch(listing_id, [(account_id, quantity) for account_id, quantity, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+
+        for (_, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self):
+        return {"batches": self.batches, "requests": self.requests, "pending_products": len(self._tasks)}
+
+reservation_batcher = ReservationBatcher()
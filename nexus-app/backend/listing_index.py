@@ -0,0 +1,170 @@
+#in-process inverted index from trade tag to the job listings carrying it
+import itertools
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+import config
+
+#an id skipped by a catch-up scan is read again for this long in case its transaction is still committing
+CATCH_UP_GAP_SECONDS = float(os.environ.get("CATCH_UP_GAP_SECONDS", 60))
+CATCH_UP_MAX_GAPS = int(os.environ.get("CATCH_UP_MAX_GAPS", 500))
+
+#times here are naive utc as stored, the same values the sql board orders by
+def sort_key(datetime_required, listing_id):
+    return (datetime_required, listing_id)
+
+def group_rows(rows):
+    #rows are (listing_id, datetime_required, datetime_end, trade), one per listing tag
+    listings = {}
+    for listing_id, datetime_required, datetime_end, trade in rows:
+        listings.setdefault(listing_id, (sort_key(datetime_required, listing_id), datetime_end, []))[2].append(trade)
+    return listings
+
+class CatchUpWatermark:
+    #per worker position in an id ordered table, for catching up on rows other workers committed
+    #only catch-up scans move it, writes on this worker claim their ids instead so their rows are skipped
+    #ids left behind below the mark are gaps, read again until they show up or CATCH_UP_GAP_SECONDS pass,
+    #a row whose id was allocated before another's but committed after it is still picked up
+    def __init__(self, gap_seconds=CATCH_UP_GAP_SECONDS, max_gaps=CATCH_UP_MAX_GAPS):
+        self.gap_seconds = gap_seconds
+        self.max_gaps = max_gaps
+        self.max_id = 0
+        self._gaps = {}
+        self._claimed = {}
+        self._lock = threading.Lock()
+
+    def reset(self, max_id):
+        #startup, whatever is at or below max_id was read by the rebuild
+        with self._lock:
+            self.max_id = max_id or 0
+            self._gaps.clear()
+            self._claimed.clear()
+
+    def claim(self, ids):
+        #called before the writing transaction commits, so a scan can never see the rows unclaimed
+        now = time.monotonic()
+        with self._lock:
+            for row_id in ids:
+                self._claimed[row_id] = now
+
+    def pending(self):
+        #(max_id, gap ids) for the next scan, which reads ids above max_id and the gaps
+        expired = time.monotonic() - self.gap_seconds
+        with self._lock:
+            self._gaps = {row_id: seen for row_id, seen in self._gaps.items() if seen > expired}
+            #claims of rolled back writes are never seen, they go once they're old and below the mark
+            self._claimed = {row_id: seen for row_id, seen in self._claimed.items() if seen > expired or row_id > self.max_id}
+            return self.max_id, sorted(self._gaps)
+
+    def advance(self, ids):
+        #ids a scan returned, returns the ones this worker didn't claim, in the same order
+        now = time.monotonic()
+        with self._lock:
+            seen = set(ids)
+            for row_id in seen:
+                self._gaps.pop(row_id, None)
+
+            top = max(seen, default=0)
+            if top > self.max_id:
+                for row_id in range(max(self.max_id + 1, top - self.max_gaps), top):
+                    if row_id not in seen:
+                        self._gaps[row_id] = now
+                self.max_id = top
+            while len(self._gaps) > self.max_gaps:
+                del self._gaps[next(iter(self._gaps))]
+
+            return [row_id for row_id in ids if self._claimed.pop(row_id, None) is None]
+
+    def stats(self):
+        with self._lock:
+            return {"max_id": self.max_id, "gaps": len(self._gaps), "claimed": len(self._claimed)}
+
+class TradeListingIndex:
+    def __init__(self):
+        self._by_trade = {}
+        self._listings = {}
+        self._lock = threading.Lock()
+        self.ready = False
+
+    def add(self, listing_id, datetime_required, trades, datetime_end=None):
+        key = sort_key(datetime_required, listing_id)
+
+        with self._lock:
+            if listing_id in self._listings:
+                self._remove(listing_id)
+
+            self._listings[listing_id] = (key, tuple(trades), datetime_end)
+            for trade in trades:
+                insort(self._by_trade.setdefault(trade, []), key)
+
+    def remove(self, listing_id):
+        with self._lock:
+            self._remove(listing_id)
+
+    def _remove(self, listing_id):
+        entry = self._listings.pop(listing_id, None)
+        if entry is None:
+            return
+
+        key, trades, _ = entry
+        for trade in trades:
+            keys = self._by_trade[trade]
+            position = bisect_left(keys, key)
+            if position < len(keys) and keys[position] == key:
+                del keys[position]
+
+    def rebuild(self, rows):
+        listings = group_rows(rows)
+        by_trade = {}
+        for key, _, trades in listings.values():
+            for trade in trades:
+                by_trade.setdefault(trade, []).append(key)
+
+        for keys in by_trade.values():
+            keys.sort()
+
+        #built off to the side and swapped in so readers never see a half built index
+        with self._lock:
+            self._listings = {listing_id: (key, tuple(trades), datetime_end) for listing_id, (key, datetime_end, trades) in listings.items()}
+            self._by_trade = by_trade
+            self.ready = True
+
+    def page(self, trade, limit, after=None, since=None, allowed=None, exclude=None):
+        #returns up to limit (datetime_required, id) keys in board order, after the cursor key and from since onwards
+        #allowed optionally restricts the page to a candidate set of listing ids,
+        #exclude(start, end) drops listings whose shift window it rejects
+        with self._lock:
+            if allowed is None:
+                keys = self._by_trade.get(trade, [])
+            else:
+                keys = sorted(
+                    self._listings[listing_id][0] for listing_id in allowed
+                    if listing_id in self._listings and trade in self._listings[listing_id][1]
+                )
+            start = 0
+
+            if since is not None:
+                start = bisect_left(keys, (since,))
+            if after is not None:
+                start = max(start, bisect_right(keys, sort_key(*after)))
+
+            if exclude is None:
+                return keys[start:start + limit]
+
+            page = []
+            for key in itertools.islice(keys, start, None):
+                datetime_end = self._listings[key[1]][2]
+                if datetime_end is not None and exclude(key[0], datetime_end):
+                    continue
+                page.append(key)
+                if len(page) == limit:
+                    break
+            return page
+
+    def __len__(self):
+        return len(self._listings)
+
+trade_index = TradeListingIndex()
+#listings written through other workers, feeds the trade, geo and ranking indexes and the board versions
+listing_watermark = CatchUpWatermark()
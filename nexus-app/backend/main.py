@@ -1,15 +1,132 @@
-from fastapi import FastAPI, HTTPException, Depends, status, Request
+from fastapi import FastAPI, HTTPException, Depends, status, Request, Query
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse, Response
 from jose import JWTError, jwt
-from pydantic import ValidationError
+from pydantic import BaseModel, ValidationError
 from models import *
 from schemas import *
-from database import get_db
+from migrations import run_migrations, MIGRATE_ON_STARTUP
+from database import get_engine, get_async_db, get_async_read_db, AsyncSessionLocal, replica_set, primary_pins, is_replica_session, REPLICA_PIN_SECONDS
+from cache import principal_cache, board_versions, response_cache, tag_cache
+from hashing import password_hasher
+from admission import admission_controller
+from tokens import AsyncRefreshTokenManager, token_denylist, revocation_watermark
+from board_stream import board_broker, EVICTED
+from search import AsyncSearchManager
+from archive import AsyncArchiveManager, ARCHIVE_INTERVAL_SECONDS, ARCHIVE_HISTORY_PAGE_SIZE
+from commitments import commitment_index
+from listing_index import listing_watermark
+from inventory import AsyncInventoryManager, reservation_batcher, RESERVATION_SWEEP_SECONDS
+from notifications import AsyncNotificationManager, notification_dispatcher, NOTIFICATION_POLL_SECONDS
+from instrumentation import RequestQueryStats, current_query_stats, query_metrics, render_counters, QUERY_DEBUG_HEADERS, METRICS_TOKEN
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+from datetime import datetime
+import asyncio
+import config
+import hashlib
+import hmac
+import json
 import logging
+import orjson
+import os
+import time
 
-app = FastAPI()
+LISTING_INDEX_REFRESH_SECONDS = float(os.environ.get("LISTING_INDEX_REFRESH_SECONDS", 5))
+LIVE_BOARD_STREAM_KEEPALIVE_SECONDS = float(os.environ.get("LIVE_BOARD_STREAM_KEEPALIVE_SECONDS", 15))
+SEARCH_MAX_PAGE_SIZE = 100
+BULK_JOB_LISTING_MAX_ITEMS = int(os.environ.get("BULK_JOB_LISTING_MAX_ITEMS", 1000))
+#a job listing is well under 2KB of json
+BULK_JOB_LISTING_MAX_BYTES = int(os.environ.get("BULK_JOB_LISTING_MAX_BYTES", 2 * 1024 * 1024))
+
+async def refresh_listing_indexes():
+    #the indexes are per process, so keep catching up on listings posted through other workers
+    while True:
+        await asyncio.sleep(LISTING_INDEX_REFRESH_SECONDS)
+        try:
+            async with AsyncSessionLocal() as db:
+                await AsyncListingManager(db).catch_up_listings()
+                await AsyncArchiveManager(db).catch_up_archived()
+                await AsyncApplicationManager(db).catch_up_commitments()
+                await AsyncRefreshTokenManager(db).catch_up_revocations()
+            await replica_set.check()
+        except Exception:
+            logging.exception("Failed to refresh the listing indexes")
+
+async def archive_expired_listings():
+    #every worker runs this, concurrent batches skip each other's locked rows,
+    #stale refresh tokens are purged on the same schedule
+    while True:
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+        try:
+            async with AsyncSessionLocal() as db:
+                archived = await AsyncArchiveManager(db).archive_expired()
+            if archived:
+                logging.info(f"Archived {archived} expired listings")
+        except Exception:
+            logging.exception("Failed to archive expired listings")
+        try:
+            async with AsyncSessionLocal() as db:
+                purged = await AsyncRefreshTokenManager(db).purge_stale()
+            if purged:
+                logging.info(f"Purged {purged} stale refresh tokens")
+        except Exception:
+            logging.exception("Failed to purge stale refresh tokens")
+
+async def release_expired_reservations():
+    #returns stock held by reservations that were never bought, concurrent sweeps skip each other's rows
+    while True:
+        await asyncio.sleep(RESERVATION_SWEEP_SECONDS)
+        try:
+            async with AsyncSessionLocal() as db:
+                released = await AsyncInventoryManager(db).release_expired()
+            if released:
+                logging.info(f"Released {released} expired reservations")
+        except Exception:
+            logging.exception("Failed to release expired reservations")
+
+async def deliver_notifications():
+    #drains due fan-outs back to back, then polls, posting a job listing only writes the job rows
+    while True:
+        try:
+            async with AsyncSessionLocal() as db:
+                claimed = await AsyncNotificationManager(db).deliver()
+        except Exception:
+            logging.exception("Failed to deliver notifications")
+            claimed = 0
+        if not claimed:
+            await asyncio.sleep(NOTIFICATION_POLL_SECONDS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if MIGRATE_ON_STARTUP:
+        #ddl runs on the sync engine, off the event loop
+        await asyncio.to_thread(run_migrations, get_engine())
+
+    async with AsyncSessionLocal() as db:
+        await AsyncArchiveManager(db).skip_archived()
+        await AsyncApplicationManager(db).skip_applications()
+        await AsyncRefreshTokenManager(db).start_revocations()
+        listing_manager = AsyncListingManager(db)
+        await listing_manager.start_listing_watermark()
+        await listing_manager.rebuild_trade_index()
+        await listing_manager.rebuild_geo_index()
+        await listing_manager.rebuild_ranking_index()
+        await listing_manager.warm_tag_cache()
+    refresher = asyncio.create_task(refresh_listing_indexes())
+    archiver = asyncio.create_task(archive_expired_listings())
+    sweeper = asyncio.create_task(release_expired_reservations())
+    notifier = asyncio.create_task(deliver_notifications())
+
+    yield
+
+    refresher.cancel()
+    archiver.cancel()
+    sweeper.cancel()
+    notifier.cancel()
+    password_hasher.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,9 +136,58 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_query_stats(request: Request, call_next):
+    stats = RequestQueryStats()
+    token = current_query_stats.set(stats)
+    start = time.perf_counter()
+
+    try:
+        response = await call_next(request)
+    finally:
+        current_query_stats.reset(token)
+
+    #read your writes, this client's next reads go to the primary until the replicas catch up
+    if request.method not in ("GET", "HEAD") and response.status_code < 400:
+        primary_pins.pin(request)
+
+    #label by route template so ids in paths don't explode the series
+    route = request.scope.get("route")
+    repeated = query_metrics.observe(request.method, route.path if route else "unmatched", time.perf_counter() - start, stats)
+
+    if QUERY_DEBUG_HEADERS:
+        response.headers["X-DB-Query-Count"] = str(stats.count)
+        response.headers["X-DB-Time-Ms"] = f"{stats.total_time * 1000:.2f}"
+        response.headers["X-DB-Repeated-Statements"] = str(len(repeated))
+
+    return response
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+class ORJSONResponse(JSONResponse):
+    #orjson encodes datetimes, enums and uuids natively, content is expected to be plain values already,
+    #non str keys covers the str subclasses sqlalchemy uses for column names
+    def render(self, content):
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+def serialize(model: BaseModel):
+    #one pass through orjson, response models only hold plain values so no lazy attribute is touched here
+    return orjson.dumps(model.model_dump())
+
+def etag_for(body: bytes):
+    #strong etag derived from the body, so it agrees across workers serving the same content
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+def conditional_response(request: Request, etag, body: bytes):
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return Response(content=body, media_type="application/json", headers=headers)
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_read_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -34,11 +200,36 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
             raise credentials_exception
     except JWTError:
         raise credentials_exception
+
+    #sessions ended by logout or refresh token reuse
+    family = payload.get("fam")
+    if family is not None and family in token_denylist:
+        raise credentials_exception
     
-    account_manager = AccountManager(db)
-    user = account_manager.get_user(username)
+    #repeat requests with the same token are served without touching the db
+    expiry = payload.get("exp")
+    user = principal_cache.get(username, expiry)
+    if user is not None:
+        return user
+
+    account_manager = AsyncAccountManager(db)
+    user = await account_manager.get_user(username)
+    if user is None and is_replica_session(db):
+        #an account registered moments ago may not have reached the replica yet
+        async with AsyncSessionLocal() as primary:
+            user = await AsyncAccountManager(primary).get_user(username)
+            if user is not None:
+                primary.expunge(user)
     if user is None:
         raise credentials_exception
+
+    #detach so a commit later in this request can't expire the cached instance
+    if user in db:
+        db.expunge(user)
+    #and hand the connection back, a handler waiting on another one (a reservation batch, the primary)
+    #would otherwise pin it and can exhaust the pool under a burst of new principals
+    await db.rollback()
+    principal_cache.set(username, expiry, user)
     return user
 
 def require_business_user(user = Depends(get_current_user)):
@@ -62,10 +253,45 @@ def root():
         }
     }
 
+def check_metrics_access(request: Request):
+    if METRICS_TOKEN:
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() == "bearer" and hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+            return
+    elif request.client is not None and request.client.host in ("127.0.0.1", "::1"):
+        return
+    raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed to read metrics")
+
+@app.get("/metrics", response_class=PlainTextResponse, dependencies=[Depends(check_metrics_access)])
+def metrics():
+    lines = query_metrics.render()
+    lines += render_counters("principal_cache", "Principal cache counters", principal_cache.stats())
+    lines += render_counters("response_cache", "Shared response cache counters", response_cache.stats())
+    lines += render_counters("tag_cache", "Tag name to id cache counters", tag_cache.stats())
+    lines += render_counters("live_board_stream", "Live board stream counters", {
+        "subscribers": board_broker.subscriber_count(),
+        "published": board_broker.published,
+        "evictions": board_broker.evictions,
+    })
+    lines += render_counters("database_reads", "Read routing between replicas and the primary", replica_set.stats())
+    lines += render_counters("listing_catch_up", "Cross worker listing catch-up position", listing_watermark.stats())
+    lines += render_counters("revocation_catch_up", "Cross worker refresh token revocation catch-up position", revocation_watermark.stats())
+    lines += render_counters("commitments", "Per provider shift interval sets", commitment_index.stats())
+    lines += render_counters("reservation_batches", "Product reservations grouped into shared updates", reservation_batcher.stats())
+    lines += render_counters("notifications", "New job listing notification fan-outs", notification_dispatcher.stats())
+    lines += render_counters("admission", "Login and registration admission counters", admission_controller.stats())
+    lines += render_counters("password_hasher", "Password hashing pool", {
+        "pending": password_hasher.pending,
+        "max_pending": password_hasher.max_pending,
+        "rejected": password_hasher.rejected,
+    })
+    return "\n".join(lines) + "\n"
+
 @app.post("/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    account_manager = AccountManager(db)
-    user = account_manager.authenticate_user(form_data.username, form_data.password)
+async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    admission_controller.admit_login(request, form_data.username)
+    account_manager = AsyncAccountManager(db)
+    user = await account_manager.authenticate_user(form_data.username, form_data.password)
     logging.info(f"Login attempt for username: {form_data.username}")
 
 
@@ -76,13 +302,25 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    access_token = account_manager.create_user_token(user)
+    refresh_token, family = await AsyncRefreshTokenManager(db).issue(user)
+    access_token = account_manager.create_user_token(user, family)
+
+    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer", "role": user.account_type.value}
+
+@app.post("/token/refresh")
+async def refresh_token(body: RefreshTokenModel, db: AsyncSession = Depends(get_async_db)):
+    #rotates the refresh token, the old one can't be used again
+    return await AsyncRefreshTokenManager(db).rotate(body.refresh_token)
 
-    return {"access_token": access_token, "token_type": "bearer", "role": user.account_type.value}
+@app.post("/token/revoke", status_code=status.HTTP_204_NO_CONTENT)
+async def revoke_token(body: RefreshTokenModel, db: AsyncSession = Depends(get_async_db)):
+    #logs out every device sharing this session's token family
+    await AsyncRefreshTokenManager(db).revoke(body.refresh_token)
 
 @app.post("/register")
-async def register(request: Request, db: Session = Depends(get_db)):
-    account_manager = AccountManager(db)
+async def register(request: Request, db: AsyncSession = Depends(get_async_db)):
+    admission_controller.admit_register(request)
+    account_manager = AsyncAccountManager(db)
     data = await request.json()
 
     logging.warning(f"Incoming register request: {data}")  # 👈 DEBUG LOG
@@ -99,27 +337,38 @@ async def register(request: Request, db: Session = Depends(get_db)):
             raise HTTPException(status_code=400, detail="Invalid account type")
 
         logging.info(f"Validated user model for type: {account_type}")
-        account_manager.register_user(account_type, user.model_dump())
+        hashed_password = await password_hasher.hash(user.password)
+        await account_manager.register_user(account_type, user.model_dump(), hashed_password=hashed_password)
 
         return {"message": f"{account_type} account created successfully"}
     
     except ValidationError as e:
         logging.error(f"Validation error: {e.errors()}")
         return JSONResponse(status_code=422, content={"detail": e.errors()})
+    except HTTPException:
+        raise
     except Exception as e:
         logging.exception("Unexpected error")
         return JSONResponse(status_code=500, content={"detail": str(e)})
     
-@app.get("/profile")
-async def profile(current_user = Depends(get_current_user), db: Session = Depends(get_db)):
+@app.get("/profile", response_model=ProfileResponse, response_class=ORJSONResponse)
+async def profile(request: Request, current_user = Depends(get_current_user), db: AsyncSession = Depends(get_async_read_db)):
 
-    account_manager = AccountManager(db)
+    account_manager = AsyncAccountManager(db)
     profile_data = account_manager.get_user_profile(current_user)
 
-    return profile_data
+    if isinstance(current_user, ServiceProviderAccount):
+        profile_model = ServiceProviderProfileModel(**profile_data)
+    elif isinstance(current_user, BusinessAccount):
+        profile_model = BusinessProfileModel(**profile_data)
+    else:
+        profile_model = AccountProfileModel(**profile_data)
+
+    body = serialize(profile_model)
+    return conditional_response(request, etag_for(body), body)
 
 @app.post("/add_job_listing")
-async def add_job_listing(job: JobListingModel, current_user = Depends(get_current_user), db: Session = Depends(get_db)):
+async def add_job_listing(job: JobListingModel, current_user = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
 
     if current_user.account_type != AccountType.BUSINESS:
         raise HTTPException(
@@ -128,10 +377,21 @@ async def add_job_listing(job: JobListingModel, current_user = Depends(get_curre
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    listing_manager = ListingManager(db)
+    listing_manager = AsyncListingManager(db)
 
     try:
-        listing_manager.create_job_listing(job.model_dump())
+        await listing_manager.create_job_listing(
+            type=ListingType.JOB,
+            title=job.title,
+            description=job.description,
+            location=job.location,
+            datetime_required=job.datetime_required,
+            created_by=current_user.id,
+            created_at=job.created_at,
+            tags=job.tags,
+            rate_per_h=job.rate_per_h,
+            datetime_end=job.datetime_end
+        )
         logging.warning("Incoming job listing addition request")
         return {"message": f"Job listing created successfully!"}
 
@@ -143,10 +403,185 @@ async def add_job_listing(job: JobListingModel, current_user = Depends(get_curre
         logging.exception("Unexpected error")
         return JSONResponse(status_code=500, content={"detail": str(e)})
 
-@app.get("/live_board")
-async def get_listings(current_user = Depends(get_current_user), db = Depends(get_db)):
+def bulk_too_large():
+    return HTTPException(status_code=413, detail=f"At most {BULK_JOB_LISTING_MAX_ITEMS} job listings and {BULK_JOB_LISTING_MAX_BYTES} bytes per request")
+
+async def read_bulk_body(request: Request):
+    #yields the body as it arrives and stops reading once it passes the byte cap
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > BULK_JOB_LISTING_MAX_BYTES:
+            raise bulk_too_large()
+        yield chunk
+
+#stands in for an ndjson line that isn't valid json, it is reported as an invalid item
+MALFORMED_LINE = object()
+
+def parse_ndjson_line(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return MALFORMED_LINE
+
+async def read_bulk_items(request: Request):
+    #accepts a json array, or one json object per line when sent as ndjson,
+    #an oversized request is turned away while it streams rather than after it has been buffered
+    if "ndjson" in request.headers.get("content-type", ""):
+        items = []
+        buffer = b""
+        async for chunk in read_bulk_body(request):
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            items.extend(parse_ndjson_line(line) for line in lines if line.strip())
+            if len(items) > BULK_JOB_LISTING_MAX_ITEMS:
+                raise bulk_too_large()
+        if buffer.strip():
+            items.append(parse_ndjson_line(buffer))
+    else:
+        try:
+            items = json.loads(b"".join([chunk async for chunk in read_bulk_body(request)]))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Request body is not valid JSON")
+
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Expected a list of job listings")
+    if len(items) > BULK_JOB_LISTING_MAX_ITEMS:
+        raise bulk_too_large()
+
+    return items
+
+@app.post("/job_listings/bulk")
+async def add_job_listings_bulk(request: Request, current_user = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+
+    if current_user.account_type != AccountType.BUSINESS:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Only business accounts can perform this operation",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    items = await read_bulk_items(request)
+
+    #validate everything up front, invalid items are reported and the rest are inserted together
+    results = []
+    valid = []
+    for index, item in enumerate(items):
+        if item is MALFORMED_LINE:
+            results.append({"index": index, "status": "invalid", "detail": "invalid JSON"})
+            continue
+        try:
+            job = JobListingModel.model_validate(item)
+        except ValidationError as e:
+            results.append({"index": index, "status": "invalid", "detail": e.errors(include_url=False)})
+            continue
+        valid.append((index, job.model_dump()))
+
+    listing_manager = AsyncListingManager(db)
+    listing_ids = await listing_manager.create_job_listings([job for _, job in valid], current_user.id)
+
+    for (index, _), listing_id in zip(valid, listing_ids):
+        results.append({"index": index, "status": "created", "id": listing_id})
+    results.sort(key=lambda result: result["index"])
+
+    logging.warning(f"Bulk job listing request: {len(listing_ids)} created, {len(items) - len(listing_ids)} rejected")
+    return {"created": len(listing_ids), "rejected": len(items) - len(listing_ids), "results": results}
+
+@app.post("/apply", status_code=status.HTTP_201_CREATED)
+async def apply(application: ApplicationModel, current_user = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+
+    application_manager = AsyncApplicationManager(db)
+    created = await application_manager.apply(application.listing_id, current_user)
+
+    return {"application_id": created.id, "listing_id": created.listing_id}
+
+@app.get("/applications")
+async def my_applications(current_user = Depends(get_current_user), db: AsyncSession = Depends(get_async_read_db)):
+
+    if current_user.account_type != AccountType.SERVICEPROVIDER:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only service providers have applications")
+
+    application_manager = AsyncApplicationManager(db)
+    return {"applications": await application_manager.get_applications(current_user)}
+
+@app.post("/products/{listing_id}/reserve", status_code=status.HTTP_201_CREATED)
+async def reserve_product(listing_id: int, reservation: ReservationModel, current_user = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    #holds stock for RESERVATION_TTL_SECONDS, complete it with /reservations/{id}/purchase
+
+    if current_user.account_type != AccountType.SERVICEPROVIDER:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only service providers can reserve products")
+
+    return await AsyncInventoryManager(db).reserve(listing_id, current_user, reservation.quantity)
+
+@app.post("/reservations/{reservation_id}/purchase")
+async def purchase_reservation(reservation_id: int, current_user = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    return await AsyncInventoryManager(db).purchase(reservation_id, current_user)
+
+@app.delete("/reservations/{reservation_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def release_reservation(reservation_id: int, current_user = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    await AsyncInventoryManager(db).release(reservation_id, current_user)
+
+@app.put("/products/{listing_id}/stock")
+async def set_product_stock(listing_id: int, stock: StockModel, current_user = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+
+    if current_user.account_type != AccountType.BUSINESS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only the business that listed a product can change its stock")
+
+    return await AsyncInventoryManager(db).set_stock(listing_id, current_user, stock.quantity, stock.version)
+
+@app.get("/job_listings/applicant_counts")
+async def applicant_counts(current_user = Depends(get_current_user), db: AsyncSession = Depends(get_async_read_db)):
+
+    if current_user.account_type != AccountType.BUSINESS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only business accounts can view applicant counts")
+
+    application_manager = AsyncApplicationManager(db)
+    return {"listings": await application_manager.get_applicant_counts(current_user)}
+
+@app.get("/listings/archive")
+async def listing_history(
+    limit: int = Query(ARCHIVE_HISTORY_PAGE_SIZE, ge=1, le=LIVE_BOARD_MAX_PAGE_SIZE),
+    before: int | None = Query(None, description="next_before from the previous page"),
+    current_user = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+
+    #businesses see the listings they posted, service providers the listings they applied to
+    archive_manager = AsyncArchiveManager(db)
+    listings, next_before = await archive_manager.get_history(current_user, limit, before)
+    return ORJSONResponse({"listings": listings, "next_before": next_before})
+
+@app.get("/listings/search", response_model=SearchResponseModel, response_class=ORJSONResponse)
+async def search_listings(
+    q: str = Query(..., min_length=1, max_length=200),
+    type: ListingType | None = None,
+    trade: list[TradeType] | None = Query(None),
+    limit: int = Query(20, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    current_user = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+
+    search_manager = AsyncSearchManager(db)
+    trades = [t.value for t in trade] if trade else None
+
+    listings, next_offset = await search_manager.search_listings(q, type, trades, limit, offset)
+    return ORJSONResponse(SearchResponseModel(listings=listings, next_offset=next_offset).model_dump())
+
+@app.get("/live_board", response_model=LiveBoardResponseModel, response_class=ORJSONResponse)
+async def get_listings(
+    request: Request,
+    limit: int = Query(LIVE_BOARD_PAGE_SIZE, ge=1),
+    cursor: str | None = Query(None, description="next_cursor from the previous page"),
+    since: UtcDateTime | None = Query(None, description="only listings required at or after this time"),
+    within_km: float | None = Query(None, gt=0, description="only listings within this distance of the account's address"),
+    sort: BoardSort = Query(BoardSort.TIME, description="time for the board in date order, relevance for a scored job feed"),
+    exclude_conflicts: bool = Query(False, description="hide jobs overlapping shifts the provider has already applied for"),
+    current_user = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_read_db)
+):
     
-    account_manager = AccountManager(db)
+    account_manager = AsyncAccountManager(db)
     if not account_manager.account_type_is_valid(current_user):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -154,7 +589,64 @@ async def get_listings(current_user = Depends(get_current_user), db = Depends(ge
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    listing_manager = ListingManager(db)
+    #everyone on the same board version with the same query shares one serialized page,
+    #radius searches, relevance feeds and conflict filtering depend on the caller so they are only revalidated
+    partition = user_board_partition(current_user)
+    cache_key = None
+    if within_km is None and sort == BoardSort.TIME and not exclude_conflicts:
+        cache_key = (partition, board_versions.get(partition), limit, cursor, since)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return conditional_response(request, *cached)
+
+    listing_manager = AsyncListingManager(db)
+
+    listings, next_cursor = await listing_manager.get_listings(current_user, limit, cursor, since, within_km, sort, exclude_conflicts)
+    body = serialize(LiveBoardResponseModel(listings=listings, next_cursor=next_cursor))
+    etag = etag_for(body)
+
+    #a replica can lag a fresh write, don't share a page that may predate this version
+    if cache_key is not None and not (is_replica_session(db) and board_versions.changed_within(partition, REPLICA_PIN_SECONDS)):
+        response_cache.set(cache_key, etag, body)
+    return conditional_response(request, etag, body)
+
+@app.get("/live_board/stream")
+async def stream_listings(request: Request, current_user = Depends(get_current_user), db: AsyncSession = Depends(get_async_read_db)):
+
+    account_manager = AsyncAccountManager(db)
+    if not account_manager.account_type_is_valid(current_user):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Only service provider accounts can view job listings",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    #the stream outlives the auth lookup, don't hold a pooled connection for it
+    await db.close()
+
+    subscription = board_broker.subscribe(user_board_partition(current_user))
+
+    #server-sent events carrying only listings created, changed or removed on this user's board
+    async def events():
+        try:
+            yield ": connected\n\n"
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), timeout=LIVE_BOARD_STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+
+                if event is EVICTED:
+                    #client fell too far behind, it should refetch /live_board and reconnect
+                    yield "event: evicted\ndata: {}\n\n"
+                    break
+
+                yield f"event: {event['event']}\ndata: {json.dumps(event['listing'])}\n\n"
+        finally:
+            board_broker.unsubscribe(subscription)
 
-    listings = listing_manager.get_listings(current_user)
-    return listings
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
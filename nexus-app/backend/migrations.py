@@ -0,0 +1,310 @@
+#versioned schema migrations, run once from the app lifespan (or by hand) instead of create_all on import
+#usage (from backend/): python migrations.py
+import logging
+import os
+import re
+import sys
+from datetime import datetime, timedelta, timezone
+import config
+from sqlalchemy import Column, DateTime, Enum, Float, ForeignKey, Index, Integer, MetaData, String, Table, func, inspect, select, text, update
+from sqlalchemy.exc import IntegrityError
+from models import Account, Listing, Application, ProductListing, Reservation, ServiceProviderAccount, NotificationJob, TokenRevocation, listing_tags, listing_archive, application_archive, SHIFT_DEFAULT_HOURS
+from search import ensure_search_index
+
+#workers normally migrate on startup, turn off when a deploy step runs this module instead
+MIGRATE_ON_STARTUP = os.environ.get("MIGRATE_ON_STARTUP", "true").lower() == "true"
+
+#kept out of Base.metadata, it isn't part of the migrated schema
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String(255), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+#the schema as migration 1 shipped it, frozen so a new database is built by the same steps as an
+#upgraded one, model changes after it need a migration of their own
+initial_schema = MetaData()
+
+TRADES = ('BARISTA', 'BARTENDER', 'CHEF', 'CONCIERGE', 'FOH', 'MECHANIC', 'PLUMBER', 'ELECTRICIAN', 'HVACTECH')
+
+Table(
+    'accounts',
+    initial_schema,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('username', String(255), unique=True, nullable=False),
+    Column('hashed_password', String(255), nullable=False),
+    Column('email', String(255), unique=True, nullable=False),
+    Column('phone_number', String(10), unique=True, nullable=False),
+    Column('account_type', Enum('BUSINESS', 'SERVICEPROVIDER', name='accounttype'), nullable=False),
+    Column('latitude', Float, nullable=True),
+    Column('longitude', Float, nullable=True),
+)
+
+Table(
+    'business_accounts',
+    initial_schema,
+    Column('id', Integer, ForeignKey('accounts.id'), primary_key=True),
+    Column('abn', String(11), unique=True, nullable=False),
+    Column('address', String(255), nullable=False),
+)
+
+Table(
+    'service_provider_accounts',
+    initial_schema,
+    Column('id', Integer, ForeignKey('accounts.id'), primary_key=True),
+    Column('first_name', String(100), nullable=False),
+    Column('last_name', String(100), nullable=False),
+    Column('address', String(255), nullable=False),
+    Column('trade', Enum(*TRADES, name='tradetype'), nullable=False),
+)
+
+Table(
+    'refresh_tokens',
+    initial_schema,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('account_id', Integer, ForeignKey('accounts.id'), nullable=False, index=True),
+    Column('family', String(32), nullable=False, index=True),
+    Column('token_hash', String(64), unique=True, nullable=False),
+    Column('created_at', DateTime, nullable=False),
+    Column('expires_at', DateTime, nullable=False),
+    Column('used_at', DateTime, nullable=True),
+    Column('revoked_at', DateTime, nullable=True, index=True),
+)
+
+Table(
+    'listings',
+    initial_schema,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('type', Enum('JOB', 'PRODUCT', name='listingtype'), nullable=False),
+    Column('title', String(255), nullable=False),
+    Column('description', String(255), nullable=False),
+    Column('location', String(255), nullable=False),
+    Column('latitude', Float, nullable=True),
+    Column('longitude', Float, nullable=True),
+    Column('datetime_required', DateTime, nullable=False),
+    Column('created_by', Integer, ForeignKey('accounts.id'), nullable=False),
+    Column('created_at', DateTime, nullable=False),
+    Index('ix_listings_type_datetime_required_id', 'type', 'datetime_required', 'id'),
+    Index('ix_listings_created_by', 'created_by'),
+)
+
+Table(
+    'job_listings',
+    initial_schema,
+    Column('id', Integer, ForeignKey('listings.id'), primary_key=True, nullable=False),
+    Column('rate_per_h', Float, nullable=False),
+)
+
+Table(
+    'product_listings',
+    initial_schema,
+    Column('id', Integer, ForeignKey('listings.id'), primary_key=True, nullable=False),
+    Column('price', Float, nullable=False),
+    Column('quantity', Integer, nullable=False),
+)
+
+Table(
+    'applications',
+    initial_schema,
+    Column('id', Integer, primary_key=True, autoincrement=True, index=True),
+    Column('applicant_id', Integer, ForeignKey('accounts.id'), nullable=False),
+    Column('listing_id', Integer, ForeignKey('job_listings.id'), nullable=False),
+    Index('ix_applications_listing_id_applicant_id', 'listing_id', 'applicant_id', unique=True),
+    Index('ix_applications_applicant_id', 'applicant_id'),
+)
+
+Table(
+    'tags',
+    initial_schema,
+    Column('id', Integer, primary_key=True, autoincrement=True, index=True),
+    Column('name', String(100), unique=True, index=True, nullable=False),
+)
+
+Table(
+    'listing_tags',
+    initial_schema,
+    Column('listing_id', ForeignKey('listings.id'), primary_key=True),
+    Column('tag_id', ForeignKey('tags.id'), primary_key=True),
+    Index('ix_listing_tags_tag_id_listing_id', 'tag_id', 'listing_id'),
+)
+
+Table(
+    'listing_archive',
+    initial_schema,
+    Column('archive_id', Integer, primary_key=True, autoincrement=True),
+    Column('listing_id', Integer, nullable=False, unique=True),
+    Column('type', Enum('JOB', 'PRODUCT', name='listingtype'), nullable=False),
+    Column('title', String(255), nullable=False),
+    Column('description', String(255), nullable=False),
+    Column('location', String(255), nullable=False),
+    Column('latitude', Float, nullable=True),
+    Column('longitude', Float, nullable=True),
+    Column('datetime_required', DateTime, nullable=False),
+    Column('created_by', Integer, ForeignKey('accounts.id'), nullable=False, index=True),
+    Column('created_at', DateTime, nullable=False),
+    Column('rate_per_h', Float, nullable=True),
+    Column('price', Float, nullable=True),
+    Column('quantity', Integer, nullable=True),
+    Column('archived_at', DateTime, nullable=False),
+)
+
+Table(
+    'listing_tag_archive',
+    initial_schema,
+    Column('listing_id', Integer, primary_key=True),
+    Column('tag_id', ForeignKey('tags.id'), primary_key=True),
+)
+
+Table(
+    'application_archive',
+    initial_schema,
+    Column('id', Integer, primary_key=True),
+    Column('applicant_id', Integer, ForeignKey('accounts.id'), nullable=False, index=True),
+    Column('listing_id', Integer, nullable=False, index=True),
+)
+
+def create_tables(connection):
+    #creates whatever tables don't exist yet, with their indexes
+    initial_schema.create_all(connection)
+
+def add_geo_columns(connection):
+    #latitude/longitude were added to tables that existed before migrations
+    for table in (Account.__table__, Listing.__table__):
+        existing = {column["name"] for column in inspect(connection).get_columns(table.name)}
+        for name in ("latitude", "longitude"):
+            if name not in existing:
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {name} FLOAT"))
+
+def create_board_indexes(connection):
+    #indexes added to tables that existed before migrations, the unique application index
+    #fails if duplicate applications were already stored
+    for table in (Listing.__table__, listing_tags, Application.__table__):
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+def create_search_index(connection):
+    ensure_search_index(connection)
+
+def default_shift_end(connection, start):
+    #start plus the default shift length, worked out by the database
+    if connection.dialect.name == "sqlite":
+        #no interval type, the result is padded to the microsecond format sqlalchemy stores
+        return func.strftime("%Y-%m-%d %H:%M:%f", start, f"+{SHIFT_DEFAULT_HOURS} hours").concat("000")
+    return start + timedelta(hours=SHIFT_DEFAULT_HOURS)
+
+def add_shift_end(connection):
+    #listings only had a start time, existing live and archived rows get the default shift length
+    for table in (Listing.__table__, listing_archive):
+        existing = {column["name"] for column in inspect(connection).get_columns(table.name)}
+        if "datetime_end" not in existing:
+            connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN datetime_end TIMESTAMP"))
+        connection.execute(
+            update(table)
+            .where(table.c.datetime_end.is_(None))
+            .values(datetime_end=default_shift_end(connection, table.c.datetime_required))
+        )
+
+def add_reservations(connection):
+    existing = {column["name"] for column in inspect(connection).get_columns(ProductListing.__table__.name)}
+    if "version" not in existing:
+        connection.execute(text(f"ALTER TABLE {ProductListing.__table__.name} ADD COLUMN version INTEGER NOT NULL DEFAULT 0"))
+    Reservation.__table__.create(connection, checkfirst=True)
+
+def add_notification_jobs(connection):
+    for index in ServiceProviderAccount.__table__.indexes:
+        index.create(connection, checkfirst=True)
+    NotificationJob.__table__.create(connection, checkfirst=True)
+
+def add_token_revocations(connection):
+    TokenRevocation.__table__.create(connection, checkfirst=True)
+
+def autoincrement_table_sql(sql, name, rebuilt):
+    #the stored create statement with its integer key marked autoincrement, under the rebuilt table's name
+    rewritten, renamed = re.subn(rf"^CREATE TABLE {name} \(", f"CREATE TABLE {rebuilt} (", sql)
+    rewritten, keyed = re.subn(r"\bid INTEGER NOT NULL\b", "id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT", rewritten, count=1)
+    rewritten, dropped = re.subn(r",\s*PRIMARY KEY \(id\)", "", rewritten, count=1)
+    if (renamed, keyed, dropped) != (1, 1, 1):
+        raise RuntimeError(f"Unexpected schema for {name}: {sql}")
+    return rewritten
+
+def keep_archived_ids(connection):
+    #sqlite hands out max(id) + 1, so archiving the newest listing or application made its id come round again
+    #and the archive copy then rejected the next batch, autoincrement tables never go below an id they handed out
+    if connection.dialect.name != "sqlite":
+        return
+
+    for table, archived_ids in ((Listing.__table__, listing_archive.c.listing_id), (Application.__table__, application_archive.c.id)):
+        sql = connection.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": table.name}).scalar()
+        if "AUTOINCREMENT" in sql:
+            continue
+
+        #indexes and the search triggers go with the old table
+        dependents = connection.execute(
+            text("SELECT sql FROM sqlite_master WHERE tbl_name = :name AND type IN ('index', 'trigger') AND sql IS NOT NULL"), {"name": table.name}
+        ).scalars().all()
+        rebuilt = f"{table.name}_rebuilt"
+        connection.execute(text(autoincrement_table_sql(sql, table.name, rebuilt)))
+        connection.execute(text(f"INSERT INTO {rebuilt} SELECT * FROM {table.name}"))
+        connection.execute(text(f"DROP TABLE {table.name}"))
+        connection.execute(text(f"ALTER TABLE {rebuilt} RENAME TO {table.name}"))
+        for statement in dependents:
+            connection.execute(text(statement))
+
+        #ids already archived are never handed out again either
+        last_id = max(
+            connection.execute(select(func.max(table.c.id))).scalar() or 0,
+            connection.execute(select(func.max(archived_ids))).scalar() or 0,
+        )
+        connection.execute(text("DELETE FROM sqlite_sequence WHERE name = :name"), {"name": table.name})
+        connection.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)"), {"name": table.name, "seq": last_id})
+
+#append only, a released migration is never edited
+MIGRATIONS = [
+    (1, "create tables", create_tables),
+    (2, "add geo columns", add_geo_columns),
+    (3, "create board and application indexes", create_board_indexes),
+    (4, "create search index", create_search_index),
+    (5, "add shift end", add_shift_end),
+    (6, "add product stock versions and reservations", add_reservations),
+    (7, "add notification jobs and the provider trade index", add_notification_jobs),
+    (8, "add token revocations", add_token_revocations),
+    (9, "keep archived listing and application ids", keep_archived_ids),
+]
+
+def current_version(connection):
+    return connection.execute(select(schema_migrations.c.version).order_by(schema_migrations.c.version.desc()).limit(1)).scalar() or 0
+
+def run_migrations(engine):
+    #an up to date schema costs one select, each pending migration commits with its version row
+    schema_migrations.create(engine, checkfirst=True)
+
+    with engine.connect() as connection:
+        version = current_version(connection)
+
+    applied = []
+    for number, name, migrate in MIGRATIONS:
+        if number <= version:
+            continue
+
+        try:
+            with engine.begin() as connection:
+                #claim the version first, a worker migrating concurrently fails here and skips it
+                connection.execute(schema_migrations.insert().values(version=number, name=name, applied_at=datetime.now(timezone.utc).replace(tzinfo=None)))
+                migrate(connection)
+        except IntegrityError:
+            logging.info(f"Migration {number} was applied by another worker")
+            continue
+
+        applied.append(number)
+        logging.warning(f"Applied migration {number}: {name}")
+
+    return applied
+
+if __name__ == "__main__":
+    from database import get_engine
+    logging.basicConfig(level=logging.INFO)
+    applied = run_migrations(get_engine())
+    print(f"Applied {len(applied)} migration(s)" if applied else "Schema is up to date")
+    sys.exit(0)
@@ -1,25 +1,54 @@
 #for sql alchemy models
 from datetime import datetime, timedelta, timezone
 from enum import Enum as PyEnum
-from sqlalchemy import Table, Enum, Float, Column, Integer, String, create_engine, ForeignKey, null, UniqueConstraint, DateTime, Boolean
-from sqlalchemy.orm import relationship, Session, with_polymorphic
+from sqlalchemy import Table, Enum, Float, Column, Integer, String, create_engine, ForeignKey, null, UniqueConstraint, DateTime, Boolean, event, inspect, Index, tuple_
+from sqlalchemy.orm import relationship, Session, with_polymorphic, selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, insert, update, func, or_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
-from passlib.context import CryptContext
 from jose import jwt
 from abc import ABC, abstractmethod
+import base64
+import binascii
 from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from cache import principal_cache, board_versions, tag_cache
+from listing_index import trade_index, listing_watermark
+from board_stream import board_broker
+from geo import geocode, geocode_async, geo_index, bounding_box, within_radius
+from commitments import commitment_index
+from hashing import pwd_context, password_hasher
+from database import SessionLocal, AsyncSessionLocal
 import os
-from dotenv import load_dotenv
-
-load_dotenv()
+import config
 
 
 SECRET_KEY = os.environ.get("SECRET_KEY")
+
+#ranking pulls in numpy, so it is imported the first time the relevance index is built rather than with the models,
+#until then there is no index for listing writes to keep up to date
+ranking_index = None
+
+def load_ranking_index():
+    global ranking_index
+    if ranking_index is None:
+        from ranking import ranking_index as index
+        ranking_index = index
+    return ranking_index
+
+def built_ranking_index():
+    return ranking_index
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 DEVELOPMENT_MODE = True
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+LIVE_BOARD_PAGE_SIZE = 50
+LIVE_BOARD_MAX_PAGE_SIZE = 200
+LISTING_CATCH_UP_BATCH_SIZE = 500
+#listings posted without an end time are assumed to run this long
+SHIFT_DEFAULT_HOURS = float(os.environ.get("SHIFT_DEFAULT_HOURS", 4))
+#new job listings wait this long before their providers are notified, so a burst of postings for one trade goes out together
+NOTIFICATION_COALESCE_SECONDS = float(os.environ.get("NOTIFICATION_COALESCE_SECONDS", 2))
 
 Base = declarative_base()
 
@@ -42,6 +71,21 @@ class TradeType(PyEnum):
 class ListingType(PyEnum):
     JOB = 'JOB'
     PRODUCT = 'PRODUCT'
+
+class NotificationStatus(PyEnum):
+    PENDING = 'PENDING'
+    RUNNING = 'RUNNING'
+    FAILED = 'FAILED'
+
+class ReservationStatus(PyEnum):
+    HELD = 'HELD'
+    PURCHASED = 'PURCHASED'
+    RELEASED = 'RELEASED'
+
+#live board orderings, time is the keyset paged board and relevance the scored provider feed
+class BoardSort(PyEnum):
+    TIME = 'time'
+    RELEVANCE = 'relevance'
     
 #TODO: add phone number to columns
 class Account(Base):
@@ -52,6 +96,9 @@ class Account(Base):
     email = Column(String(255), nullable = False, unique=True)
     phone_number = Column(String(10), nullable=False, unique=True)
     account_type = Column(Enum(AccountType), nullable=False)
+    #geocoded from the subclass address
+    latitude = Column(Float, nullable=True)
+    longitude = Column(Float, nullable=True)
 
     __mapper_args__ = {
         'polymorphic_on' : account_type
@@ -91,6 +138,11 @@ class ServiceProviderAccount(Account):
     address = Column(String(255), nullable=False)
     trade = Column(Enum(TradeType), nullable=False)
 
+    #new job notifications page through a trade's providers in id order
+    __table_args__ = (
+        Index('ix_service_provider_accounts_trade_id', 'trade', 'id'),
+    )
+
     __mapper_args__ = {
         'polymorphic_identity' : AccountType.SERVICEPROVIDER
     }
@@ -102,6 +154,36 @@ class ServiceProviderAccount(Account):
         self.address = address
         self.trade = trade
 
+#any change to an account row must evict its cached principal
+@event.listens_for(Account, 'after_update', propagate=True)
+@event.listens_for(Account, 'after_delete', propagate=True)
+def invalidate_cached_principal(mapper, connection, target):
+    principal_cache.invalidate(target.username)
+
+    #a renamed account is still cached under its old username
+    for old_username in inspect(target).attrs.username.history.deleted:
+        principal_cache.invalidate(old_username)
+
+#unique account fields and how a conflict on each is reported
+ACCOUNT_UNIQUE_FIELDS = {
+    "username": "username",
+    "email": "email",
+    "phone_number": "phone number",
+    "abn": "ABN",
+}
+
+def account_conflict(error: IntegrityError):
+    #sqlite reports "UNIQUE constraint failed: accounts.email", postgres "Key (email)=(...) already exists"
+    message = str(error.orig).lower()
+    for field, label in ACCOUNT_UNIQUE_FIELDS.items():
+        if f".{field}" in message or f"({field})" in message or f"_{field}_key" in message:
+            return HTTPException(status_code=409, detail=f"An account with this {label} already exists.")
+    return HTTPException(status_code=409, detail="Account already exists.")
+
+def account_row(account: Account):
+    #column values of a built account, for bulk inserts that bypass the unit of work
+    return {attr.key: getattr(account, attr.key) for attr in inspect(account).mapper.column_attrs if attr.key != "id"}
+
 class AccountManager:
     def __init__(self, session: Session):
         self.session = session
@@ -114,22 +196,41 @@ class AccountManager:
 
     def add_account(self, account: Account):
 
-        if self.username_exists(account.username):
-            #add this as a flash message or pop up in front end
-            print("Username already exists. Please try a different one.")
-            return False
-        
-        #add account to db
+        #add account to db, the unique constraints catch every duplicate in the same round trip
         self.session.add(account)
 
         #commit db updates
-        self.session.commit()
+        try:
+            self.session.commit()
+        except IntegrityError as e:
+            self.session.rollback()
+            raise account_conflict(e)
+
+        principal_cache.invalidate(account.username)
         return True
 
+    def bulk_add_accounts(self, accounts):
+        #one executemany per account type, the caller retries row by row when a batch conflicts
+        rows_by_class = {}
+        for account in accounts:
+            rows_by_class.setdefault(type(account), []).append(account_row(account))
+
+        try:
+            for account_class, rows in rows_by_class.items():
+                self.session.execute(insert(account_class), rows)
+            self.session.commit()
+        except IntegrityError:
+            self.session.rollback()
+            raise
+
+        for account in accounts:
+            principal_cache.invalidate(account.username)
+
     def get_user(self, username):
         polymorphic_acc = with_polymorphic(Account, '*')
 
-        return self.session.query(Account).filter(polymorphic_acc.username==username).first()
+        #load every subclass column up front so the account is usable once detached from the session
+        return self.session.query(polymorphic_acc).filter(polymorphic_acc.username==username).first()
     
     def verify_password(self, password, hashed_password):
         return pwd_context.verify(password, hashed_password)
@@ -141,13 +242,19 @@ class AccountManager:
             return None
         
         return user
+
         
-    def create_user_token(self, user):
+    def create_user_token(self, user, family=None):
 
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        data = {"sub" : user.username,
+                "role": user.account_type.value}
+        #the refresh token family this session belongs to, checked against the revocation denylist
+        if family is not None:
+            data["fam"] = family
+
         token = self.create_access_token(
-            data={"sub" : user.username,
-                  "role": user.account_type.value},
+            data=data,
             expires_delta = access_token_expires
         )
         return token
@@ -165,16 +272,25 @@ class AccountManager:
 
         return encoded_jwt
     
-    def register_user(self, account_type, user_data):
+    def register_user(self, account_type, user_data, hashed_password=None):
+
+        #async callers hash on the password pool beforehand, sync callers hash here
+        if hashed_password is None:
+            hashed_password = pwd_context.hash(user_data['password'])
+
+        account = self.build_account(account_type, user_data, hashed_password)
+        self.locate_account(account)
+
+        #add account to db
+        self.add_account(account)
+        return {"message": "Registration successful"}
+
+    def build_account(self, account_type, user_data, hashed_password):
 
         try:
             account_type_enum = AccountType(account_type)
         except ValueError:
             raise HTTPException(status_code=400, detail="Unrecognised account type, enum conversion failed")
-        
-        if self.username_exists(user_data['username']):
-            print("Username already exists. Please try a different one.")
-            return False
 
         if account_type_enum == AccountType.BUSINESS:
             #verify ABN
@@ -189,7 +305,7 @@ class AccountManager:
                 username = user_data['username'],
                 email=user_data['email'],
                 phone_number=user_data['phone_number'],
-                hashed_password = pwd_context.hash(user_data['password']),
+                hashed_password = hashed_password,
                 abn = user_data['abn'],
                 address = user_data['address']
             )
@@ -207,7 +323,7 @@ class AccountManager:
             #create service provider account if identity is verified
             account = ServiceProviderAccount(
                     username = user_data['username'],
-                    hashed_password = pwd_context.hash(user_data['password']),
+                    hashed_password = hashed_password,
                     email = user_data['email'],
                     phone_number = user_data['phone_number'],
                     first_name = user_data['first_name'],
@@ -218,10 +334,13 @@ class AccountManager:
                 
         else:
             raise HTTPException(status_code=400, detail="Unrecognised account type")
-        
-        #add account to db
-        self.add_account(account)
-        return {"message": "Registration successful"}
+
+        return account
+
+    def locate_account(self, account: Account):
+        coordinates = geocode(account.address)
+        if coordinates is not None:
+            account.latitude, account.longitude = coordinates
     
     def get_user_profile(self, user:Account):
         if isinstance(user, ServiceProviderAccount):
@@ -253,6 +372,136 @@ class AccountManager:
         
         return profile_data
 
+#same operations as AccountManager for endpoints running on an AsyncSession
+class AsyncAccountManager(AccountManager):
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def username_exists(self, username: str):
+        result = await self.session.execute(select(Account.id).filter_by(username=username).limit(1))
+        return result.first() is not None
+
+    async def locate_account(self, account: Account):
+        coordinates = await geocode_async(account.address)
+        if coordinates is not None:
+            account.latitude, account.longitude = coordinates
+
+    async def add_account(self, account: Account):
+
+        self.session.add(account)
+        try:
+            await self.session.commit()
+        except IntegrityError as e:
+            await self.session.rollback()
+            raise account_conflict(e)
+
+        principal_cache.invalidate(account.username)
+        return True
+
+    async def get_user(self, username):
+        polymorphic_acc = with_polymorphic(Account, '*')
+
+        result = await self.session.execute(select(polymorphic_acc).filter(polymorphic_acc.username==username).limit(1))
+        return result.scalars().first()
+
+    async def authenticate_user(self, username: str, password: str):
+        user = await self.get_user(username)
+
+        if not user:
+            return None
+
+        #verification runs on the password hashing pool instead of the event loop
+        valid, new_hash = await password_hasher.verify_and_update(password, user.hashed_password)
+        if not valid:
+            return None
+
+        #transparently upgrade hashes created with deprecated settings
+        if new_hash:
+            user.hashed_password = new_hash
+            await self.session.commit()
+
+        return user
+
+    async def register_user(self, account_type, user_data, hashed_password=None):
+
+        if hashed_password is None:
+            hashed_password = await password_hasher.hash(user_data['password'])
+
+        account = self.build_account(account_type, user_data, hashed_password)
+        await self.locate_account(account)
+
+        await self.add_account(account)
+        return {"message": "Registration successful"}
+
+class RefreshToken(Base):
+    __tablename__ = 'refresh_tokens'
+
+    id = Column(Integer, autoincrement=True, primary_key=True)
+    account_id = Column(Integer, ForeignKey('accounts.id'), nullable=False, index=True)
+    #every token rotated out of the same login shares a family, reuse of any of them revokes it
+    family = Column(String(32), nullable=False, index=True)
+    #hmac of the token, the token itself is never stored
+    token_hash = Column(String(64), nullable=False, unique=True)
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    used_at = Column(DateTime, nullable=True)
+    revoked_at = Column(DateTime, nullable=True, index=True)
+
+    def __init__(self, account_id, family, token_hash, created_at, expires_at):
+        self.account_id = account_id
+        self.family = family
+        self.token_hash = token_hash
+        self.created_at = created_at
+        self.expires_at = expires_at
+
+#one row per family revocation, other workers catch up on it by id so a revocation that commits late
+#or was stamped by a clock behind theirs is still seen, purged once the family's access tokens have expired
+class TokenRevocation(Base):
+    __tablename__ = 'token_revocations'
+
+    id = Column(Integer, autoincrement=True, primary_key=True)
+    family = Column(String(32), nullable=False)
+    revoked_at = Column(DateTime, nullable=False, index=True)
+
+class Reservation(Base):
+    __tablename__ = 'reservations'
+
+    id = Column(Integer, autoincrement=True, primary_key=True)
+    #not a foreign key, sales records outlive archived listings
+    listing_id = Column(Integer, nullable=False, index=True)
+    account_id = Column(Integer, ForeignKey('accounts.id'), nullable=False, index=True)
+    quantity = Column(Integer, nullable=False)
+    status = Column(Enum(ReservationStatus), nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    completed_at = Column(DateTime, nullable=True)
+
+    #the sweeper scans held reservations by expiry
+    __table_args__ = (
+        Index('ix_reservations_status_expires_at', 'status', 'expires_at'),
+    )
+
+#outstanding fan-outs, a job is deleted once every provider has been sent it and kept as FAILED when it runs out of attempts
+class NotificationJob(Base):
+    __tablename__ = 'notification_jobs'
+
+    id = Column(Integer, autoincrement=True, primary_key=True)
+    #not a foreign key, a job can outlive its listing being archived
+    listing_id = Column(Integer, nullable=False)
+    trade = Column(Enum(TradeType), nullable=False)
+    status = Column(Enum(NotificationStatus), nullable=False)
+    #providers are notified in id order, every provider up to this id has been sent the listing
+    cursor = Column(Integer, nullable=False, default=0)
+    attempts = Column(Integer, nullable=False, default=0)
+    #when the job can next be claimed: the end of the coalescing window, a retry backoff or a worker's lease
+    available_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    last_error = Column(String(500), nullable=True)
+
+    __table_args__ = (
+        Index('ix_notification_jobs_status_available_at', 'status', 'available_at'),
+    )
+
 class VerificationStrategy(ABC):
     @abstractmethod
     def verify(self, account_data):
@@ -285,6 +534,15 @@ class Application(Base):
 
     listing = relationship("JobListing", back_populates="applicants")
 
+    #duplicate applications are rejected by the unique index instead of scanning the listing's applicants,
+    #the applicant_id index serves "my applications"
+    __table_args__ = (
+        Index('ix_applications_listing_id_applicant_id', 'listing_id', 'applicant_id', unique=True),
+        Index('ix_applications_applicant_id', 'applicant_id'),
+        #archived ids are kept, sqlite would otherwise hand the newest one out again once it's archived
+        {'sqlite_autoincrement': True},
+    )
+
     def __init__(self, applicant_id, listing_id):
         self.applicant_id = applicant_id
         self.listing_id = listing_id
@@ -294,9 +552,15 @@ listing_tags = Table(
     'listing_tags',
     Base.metadata,
     Column('listing_id', ForeignKey('listings.id'), primary_key=True),
-    Column('tag_id', ForeignKey('tags.id'), primary_key=True)
+    Column('tag_id', ForeignKey('tags.id'), primary_key=True),
+    #the primary key leads with listing_id, boards look listings up by tag
+    Index('ix_listing_tags_tag_id_listing_id', 'tag_id', 'listing_id')
 )
 
+def default_datetime_end(context):
+    #column default for inserts that don't give an end, bulk inserts included
+    return context.get_current_parameters()["datetime_required"] + timedelta(hours=SHIFT_DEFAULT_HOURS)
+
 #TODO: add polymorphic relationships and class functionalities        
 class Tag(Base):
     __tablename__ = 'tags'
@@ -314,27 +578,40 @@ class Listing(Base):
     title = Column(String(255), nullable=False)
     description = Column(String(255), nullable=False)
     location = Column(String(255), nullable=False)
+    #geocoded from location when the listing is added
+    latitude = Column(Float, nullable=True)
+    longitude = Column(Float, nullable=True)
     datetime_required = Column(DateTime, nullable=False)
+    #the shift window is [datetime_required, datetime_end), nullable only because older rows were backfilled
+    datetime_end = Column(DateTime, nullable=True, default=default_datetime_end)
     created_by = Column(Integer, ForeignKey("accounts.id"), nullable=False)
     created_at = Column(DateTime, default=datetime.now(timezone.utc), nullable=False)
 
     tags = relationship("Tag", secondary=listing_tags, back_populates="listings")
+
+    #matches the live board's keyset ordering so each page is a single index range scan
+    __table_args__ = (
+        Index('ix_listings_type_datetime_required_id', 'type', 'datetime_required', 'id'),
+        Index('ix_listings_created_by', 'created_by'),
+        {'sqlite_autoincrement': True},
+    )
     
     __mapper_args__ = {
         'polymorphic_on' : type
     }
 
-    def __init__(self, type, title, description, location, datetime_required, created_by, created_at, tags):
+    def __init__(self, type, title, description, location, datetime_required, created_by, created_at, tags, datetime_end=None):
         self.type = type
         self.title = title
         self.description = description
         self.location = location
         self.datetime_required = datetime_required
+        self.datetime_end = datetime_end or datetime_required + timedelta(hours=SHIFT_DEFAULT_HOURS)
         self.created_by = created_by
         self.created_at = created_at
         self.tags = tags
         
-class JobListing(Base):
+class JobListing(Listing):
     __tablename__ = 'job_listings'
 
     id = Column(Integer, ForeignKey('listings.id'), primary_key=True, nullable=False)
@@ -346,81 +623,858 @@ class JobListing(Base):
         'polymorphic_identity' : ListingType.JOB
     }
 
-    def __init__(self, type, title, description, location, datetime_required, created_by, created_at, tags, rate_per_h):
-        super().__init__(type, title, description, location, datetime_required, created_by, created_at, tags)
+    def __init__(self, type, title, description, location, datetime_required, created_by, created_at, tags, rate_per_h, datetime_end=None):
+        super().__init__(type, title, description, location, datetime_required, created_by, created_at, tags, datetime_end)
         self.rate_per_h = rate_per_h
 
     def can_apply(self, service_provider) -> bool:
         #checks if the account is a service provider account and if their trade matches the requirements of the job
-        return any(tag in self.tags for tag in service_provider.trade) and isinstance(service_provider, ServiceProviderAccount)
+        return isinstance(service_provider, ServiceProviderAccount) and any(tag.name == service_provider.trade.value for tag in self.tags)
     
     def add_applicant(self,applicant):
 
+        if applicant.account_type != AccountType.SERVICEPROVIDER:
+            raise HTTPException(status_code=403, detail="Only service providers can apply.")
+
         if not self.can_apply(applicant):
             raise HTTPException(
                 status_code=403,
                 detail="Applicant does not meet trade requirements for this listing."
             )
         
-        # Check if already applied (optional safety check)
-        if any(app.user_id == applicant.id for app in self.applicants):
-            raise HTTPException(
-                status_code=409,
-                detail="Applicant has already applied for this listing."
-            )
-        
-        if applicant.account_type != AccountType.SERVICEPROVIDER:
-            raise HTTPException(status_code=403, detail="Only service providers can apply.")
-        
-        application = Application(user_id=applicant.id, listing_id=self.id)
-        self.applicants.append(application)
+        #not appended to self.applicants, that would load every existing application,
+        #a duplicate is caught by the unique index when the caller commits
+        return Application(applicant_id=applicant.id, listing_id=self.id)
 
     def get_time(self):
 
         return self.datetime_required
 
-class ProductListing(Base):
+    def get_window(self):
+
+        return self.datetime_required, self.datetime_end
+
+class ProductListing(Listing):
     __tablename__ = 'product_listings'
 
     id = Column(Integer, ForeignKey('listings.id'), primary_key=True, nullable=False)
     price = Column(Float, nullable=False)
     quantity = Column(Integer, nullable=False)
+    #bumped by every stock change, restocking is checked against it
+    version = Column(Integer, nullable=False, default=0)
 
     __mapper_args__ = {
         'polymorphic_identity' : ListingType.PRODUCT
     }
 
+    def __init__(self, type, title, description, location, datetime_required, created_by, created_at, tags, price, quantity):
+        super().__init__(type, title, description, location, datetime_required, created_by, created_at, tags)
+        self.price = price
+        self.quantity = quantity
+
+#expired listings are moved here by the archiver so the live tables only hold current listings,
+#archive_id is a high-water mark other workers use to drop archived listings from their indexes
+listing_archive = Table(
+    'listing_archive',
+    Base.metadata,
+    Column('archive_id', Integer, primary_key=True, autoincrement=True),
+    Column('listing_id', Integer, nullable=False, unique=True),
+    Column('type', Enum(ListingType), nullable=False),
+    Column('title', String(255), nullable=False),
+    Column('description', String(255), nullable=False),
+    Column('location', String(255), nullable=False),
+    Column('latitude', Float, nullable=True),
+    Column('longitude', Float, nullable=True),
+    Column('datetime_required', DateTime, nullable=False),
+    Column('datetime_end', DateTime, nullable=True),
+    Column('created_by', Integer, ForeignKey("accounts.id"), nullable=False, index=True),
+    Column('created_at', DateTime, nullable=False),
+    Column('rate_per_h', Float, nullable=True),
+    Column('price', Float, nullable=True),
+    Column('quantity', Integer, nullable=True),
+    Column('archived_at', DateTime, nullable=False),
+)
+
+listing_tag_archive = Table(
+    'listing_tag_archive',
+    Base.metadata,
+    Column('listing_id', Integer, primary_key=True),
+    Column('tag_id', ForeignKey('tags.id'), primary_key=True),
+)
+
+application_archive = Table(
+    'application_archive',
+    Base.metadata,
+    Column('id', Integer, primary_key=True),
+    Column('applicant_id', Integer, ForeignKey('accounts.id'), nullable=False, index=True),
+    Column('listing_id', Integer, nullable=False, index=True),
+)
+
+#live board cursors are the (datetime_required, id) of the last listing on the previous page
+def encode_cursor(datetime_required, listing_id):
+    raw = f"{datetime_required.isoformat()}|{listing_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        datetime_required, listing_id = raw.rsplit("|", 1)
+        datetime_required = datetime.fromisoformat(datetime_required)
+        #cursors carry the stored naive utc time, an offset means it wasn't issued by us
+        if datetime_required.tzinfo is not None:
+            raise ValueError(cursor)
+        return datetime_required, int(listing_id)
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+#relevance pages are ranked fresh on every request, so their cursor is just an offset
+def encode_rank_cursor(offset):
+    return base64.urlsafe_b64encode(f"rank|{offset}".encode()).decode()
+
+def decode_rank_cursor(cursor: str):
+    try:
+        prefix, offset = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        if prefix != "rank" or int(offset) < 0:
+            raise ValueError(cursor)
+        return int(offset)
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+#businesses see the product board, providers see the board for their trade
+def user_board_partition(user: Account):
+    if isinstance(user, BusinessAccount):
+        return ListingType.PRODUCT.value
+    return user.trade.value
+
+def listing_board_partitions(listing, tag_names):
+    if isinstance(listing, ProductListing):
+        return [ListingType.PRODUCT.value]
+    return list(tag_names)
+
+def tag_name(trade):
+    return trade.value if isinstance(trade, TradeType) else trade
+
+def listing_payload(listing, tag_names):
+    payload = {attr.key: getattr(listing, attr.key) for attr in inspect(listing).mapper.column_attrs}
+    payload["tags"] = list(tag_names)
+    return jsonable_encoder(payload)
+
 class ListingManager():
     def __init__(self, session: Session):
         self.session = session
 
-    def add_listing(self, listing):
+    def add_listing(self, listing, tags=()):
+        #tags are trade names, their listing_tags rows go in with one executemany instead of
+        #through the relationship, which would load and flush Tag objects one at a time
+        tag_names = list(dict.fromkeys(tag_name(trade) for trade in tags))
+        tag_ids, new_tags = self.resolve_tag_ids(tag_names)
 
+        self.locate_listing(listing)
         self.session.add(listing)
+        self.session.flush()
+        listing_watermark.claim([listing.id])
+        if tag_names:
+            self.session.execute(insert(listing_tags), self.listing_tag_rows([listing.id], [tag_names], tag_ids))
+        if listing.type == ListingType.JOB:
+            self.enqueue_notifications([listing.id], [tag_names])
+        entry = self.trade_index_entry(listing, tag_names)
+        location = self.geo_index_entry(listing)
+        ranking = self.ranking_index_entry(listing, tag_names)
+        event = self.board_event("created", listing, tag_names)
         self.session.commit()
 
-    def create_job_listing(self, type, title, description, location, datetime_required, created_by, created_at, tags, rate_per_h):
+        tag_cache.update(new_tags)
+        self.publish_listing_change(entry, location, event, ranking)
+
+    def create_job_listing(self, type, title, description, location, datetime_required, created_by, created_at, tags, rate_per_h, datetime_end=None):
 
-        job = JobListing(type, title, description, location, datetime_required, created_by, created_at, tags, rate_per_h)
-        self.add_listing(job)
+        job = JobListing(type, title, description, location, datetime_required, created_by, created_at, [], rate_per_h, datetime_end)
+        self.add_listing(job, tags)
 
         return job
+
+    def create_job_listings(self, jobs, created_by):
+        #one transaction for the whole batch, rows go in with executemany instead of one flush per listing
+        if not jobs:
+            return []
+
+        tag_names = self.bulk_tag_names(jobs)
+        tag_ids, new_tags = self.resolve_tag_ids(sorted({name for names in tag_names for name in names}))
+
+        rows = self.job_listing_rows(jobs, created_by, self.locate_jobs(jobs))
+        listing_ids = self.session.execute(self.bulk_insert_jobs_query(), rows).scalars().all()
+        listing_watermark.claim(listing_ids)
+
+        tag_rows = self.listing_tag_rows(listing_ids, tag_names, tag_ids)
+        if tag_rows:
+            self.session.execute(insert(listing_tags), tag_rows)
+        self.enqueue_notifications(listing_ids, tag_names)
+        self.session.commit()
+
+        tag_cache.update(new_tags)
+        self.publish_bulk_job_listings(rows, listing_ids, tag_names)
+        return listing_ids
+
+    def notification_job_rows(self, listing_ids, tag_names):
+        #one fan-out job per trade a new job listing asks for, tags that aren't trades have no providers
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        available_at = now + timedelta(seconds=NOTIFICATION_COALESCE_SECONDS)
+        trades = {trade.value: trade for trade in TradeType}
+        return [
+            {
+                "listing_id": listing_id,
+                "trade": trades[name],
+                "status": NotificationStatus.PENDING,
+                "cursor": 0,
+                "attempts": 0,
+                "available_at": available_at,
+                "created_at": now,
+            }
+            for listing_id, names in zip(listing_ids, tag_names)
+            for name in names
+            if name in trades
+        ]
+
+    def enqueue_notifications(self, listing_ids, tag_names):
+        #written in the listing's transaction, the fan-out itself runs off the request in notifications.py
+        rows = self.notification_job_rows(listing_ids, tag_names)
+        if rows:
+            self.session.execute(insert(NotificationJob), rows)
+
+    def bulk_tag_names(self, jobs):
+        return [list(dict.fromkeys(tag_name(trade) for trade in job.get("tags", []))) for job in jobs]
+
+    def job_locations(self, jobs):
+        #rosters usually repeat one location, geocode each distinct one once
+        return list(dict.fromkeys(job["location"] for job in jobs))
+
+    def locate_jobs(self, jobs):
+        return {location: geocode(location) or (None, None) for location in self.job_locations(jobs)}
+
+    def job_listing_rows(self, jobs, created_by, coordinates):
+        return [
+            {
+                "type": ListingType.JOB,
+                "title": job["title"],
+                "description": job["description"],
+                "location": job["location"],
+                "latitude": coordinates[job["location"]][0],
+                "longitude": coordinates[job["location"]][1],
+                "datetime_required": job["datetime_required"],
+                "datetime_end": job.get("datetime_end") or job["datetime_required"] + timedelta(hours=SHIFT_DEFAULT_HOURS),
+                "created_by": created_by,
+                "created_at": job["created_at"],
+                "rate_per_h": job["rate_per_h"],
+            }
+            for job in jobs
+        ]
+
+    def bulk_insert_jobs_query(self):
+        #insertmanyvalues batches the listings and job_listings rows and hands back ids in parameter order
+        return insert(JobListing).returning(JobListing.id, sort_by_parameter_order=True)
+
+    def listing_tag_rows(self, listing_ids, tag_names, tag_ids):
+        return [
+            {"listing_id": listing_id, "tag_id": tag_ids[name]}
+            for listing_id, names in zip(listing_ids, tag_names)
+            for name in names
+        ]
+
+    def publish_bulk_job_listings(self, rows, listing_ids, tag_names):
+        for row, listing_id, names in zip(rows, listing_ids, tag_names):
+            payload = jsonable_encoder({"id": listing_id, **row, "tags": names})
+            entry = (listing_id, row["datetime_required"], names, row["datetime_end"])
+            location = (listing_id, row["latitude"], row["longitude"])
+            ranking = (listing_id, row["datetime_required"], row["datetime_end"], row["rate_per_h"], row["latitude"], row["longitude"], names)
+            self.publish_listing_change(entry, location, (names, {"event": "created", "listing": payload}), ranking)
+
+    def tag_ids_query(self, names=None):
+        query = select(Tag.id, Tag.name)
+        if names is not None:
+            query = query.filter(Tag.name.in_(names))
+        return query
+
+    def warm_tag_cache(self):
+        tag_cache.replace(self.session.execute(self.tag_ids_query()).all())
+
+    def resolve_tag_ids(self, names):
+        #steady state is a dictionary lookup, a new tag costs one insert and one select,
+        #returns (tag_ids, new rows), the caller caches the new rows once its transaction commits
+        #since a rolled back tag's id would otherwise stay cached
+        tag_ids, missing = tag_cache.lookup(names)
+        if not missing:
+            return tag_ids, []
+
+        for name in missing:
+            #a concurrent request may create the same tag, the savepoint keeps the outer transaction usable
+            try:
+                with self.session.begin_nested():
+                    self.session.execute(insert(Tag).values(name=name))
+            except IntegrityError:
+                pass
+
+        rows = self.session.execute(self.tag_ids_query(missing)).all()
+        tag_ids.update({name: tag_id for tag_id, name in rows})
+        return tag_ids, rows
     
-    def get_listings(self, user: Account):
+    def needs_location(self, item):
+        return item.latitude is None or item.longitude is None
+
+    def locate_listing(self, listing):
+        if self.needs_location(listing):
+            coordinates = geocode(listing.location)
+            if coordinates is not None:
+                listing.latitude, listing.longitude = coordinates
+
+    def geo_index_entry(self, listing):
+        return listing.id, listing.latitude, listing.longitude
+
+    def trade_index_entry(self, listing, tag_names):
+        #read before commit, the sync session expires every attribute on commit
+        if not isinstance(listing, JobListing):
+            return None
+        return listing.id, listing.datetime_required, list(tag_names), listing.datetime_end
+
+    def ranking_index_entry(self, listing, tag_names):
+        if not isinstance(listing, JobListing):
+            return None
+        return listing.id, listing.datetime_required, listing.datetime_end, listing.rate_per_h, listing.latitude, listing.longitude, list(tag_names)
+
+    def board_event(self, action, listing, tag_names):
+        #built before commit for the same reason, returns (partitions, event)
+        event = {"event": action, "listing": listing_payload(listing, tag_names)}
+        return listing_board_partitions(listing, tag_names), event
+
+    def publish_listing_change(self, entry, location, event, ranking=None):
+        #only called once the listing has committed
+        if entry is not None:
+            trade_index.add(*entry)
+        if ranking is not None and ranking_index is not None:
+            ranking_index.add(*ranking)
+        geo_index.add(*location)
+
+        partitions, payload = event
+        board_versions.bump(partitions)
+        board_broker.publish(partitions, payload)
+
+    def listing_watermark_query(self):
+        return select(func.max(Listing.id))
+
+    def listing_feed_query(self, after_id, gaps):
+        #new ids past the watermark plus the gaps it is still waiting on
+        condition = Listing.id > after_id
+        if gaps:
+            condition = or_(condition, Listing.id.in_(gaps))
+        return select(Listing.id).filter(condition).order_by(Listing.id)
+
+    def caught_up_listings_query(self, ids):
+        polymorphic_listing = with_polymorphic(Listing, '*')
+        return select(polymorphic_listing).filter(polymorphic_listing.id.in_(ids)).options(selectinload(polymorphic_listing.tags))
+
+    def publish_caught_up(self, listings):
+        #listings committed through other workers go through the same path as this worker's own,
+        #so this worker's stream subscribers see them created just as they see archived ones removed
+        for listing in listings:
+            tag_names = [tag.name for tag in listing.tags]
+            self.publish_listing_change(
+                self.trade_index_entry(listing, tag_names),
+                self.geo_index_entry(listing),
+                self.board_event("created", listing, tag_names),
+                self.ranking_index_entry(listing, tag_names),
+            )
+
+    def trade_index_rows_query(self):
+        return select(Listing.id, Listing.datetime_required, Listing.datetime_end, Tag.name).join(Listing.tags).filter(Listing.type == ListingType.JOB)
+
+    def rebuild_trade_index(self):
+        trade_index.rebuild(self.session.execute(self.trade_index_rows_query()).all())
+
+    def ranking_index_rows_query(self):
+        return (
+            select(JobListing.id, JobListing.datetime_required, JobListing.datetime_end, JobListing.rate_per_h, JobListing.latitude, JobListing.longitude, Tag.name)
+            .join(JobListing.tags)
+        )
+
+    def rebuild_ranking_index(self):
+        load_ranking_index().rebuild(self.session.execute(self.ranking_index_rows_query()).all())
+
+    def geo_index_rows_query(self):
+        return select(Listing.id, Listing.latitude, Listing.longitude).filter(Listing.latitude.is_not(None))
+
+    def rebuild_geo_index(self):
+        geo_index.rebuild(self.session.execute(self.geo_index_rows_query()).all())
+
+    def user_location_statement(self, user: Account, coordinates):
+        return update(Account).where(Account.id == user.id).values(latitude=coordinates[0], longitude=coordinates[1])
+
+    def user_location(self, user: Account):
+        #accounts created before geocoding was added are located on their first search and saved,
+        #on the primary since board reads may be on a replica
+        if not self.needs_location(user):
+            return user.latitude, user.longitude
 
-        if(user.account_type != BusinessAccount and user.account_type != ServiceProviderAccount):
+        coordinates = geocode(getattr(user, "address", None))
+        if coordinates is not None:
+            with SessionLocal() as primary:
+                primary.execute(self.user_location_statement(user, coordinates))
+                primary.commit()
+            #the cached principal keeps them too, later requests don't geocode again
+            user.latitude, user.longitude = coordinates
+        return coordinates
+
+    def check_search_origin(self, origin, within_km):
+        if within_km is not None and origin is None:
+            raise HTTPException(status_code=400, detail="Your account has no location to search from.")
+
+    def nearby_listing_ids(self, origin, within_km):
+        return geo_index.within(*origin, within_km)
+
+    def check_exclude_conflicts(self, user: Account):
+        if not isinstance(user, ServiceProviderAccount):
+            raise HTTPException(status_code=400, detail="Only service providers have shifts to exclude conflicts with.")
+
+    def check_relevance_sort(self, user: Account):
+        if not isinstance(user, ServiceProviderAccount):
+            raise HTTPException(status_code=400, detail="Relevance sorting is only available on job boards.")
+
+    def ranked_page(self, user: Account, limit, cursor=None, since=None, origin=None, within_km=None, busy=None):
+        #scores every upcoming listing on the provider's board and returns one page of ids, best first
+        offset = decode_rank_cursor(cursor) if cursor is not None else 0
+        ids, has_more = load_ranking_index().rank(user.trade.value, limit, offset, since, origin, within_km, busy)
+        return ids, encode_rank_cursor(offset + limit) if has_more else None
+
+    def uses_trade_index(self, user: Account):
+        return isinstance(user, ServiceProviderAccount) and trade_index.ready
+
+    def trade_index_page(self, user: Account, limit, cursor=None, since=None, allowed=None, busy=None):
+        after = decode_cursor(cursor) if cursor is not None else None
+        keys = trade_index.page(user.trade.value, limit + 1, after, since, allowed, busy.overlaps if busy is not None else None)
+
+        next_cursor = encode_cursor(*keys[limit - 1]) if len(keys) > limit else None
+        return [listing_id for _, listing_id in keys[:limit]], next_cursor
+
+    def listings_by_ids_query(self, ids):
+        return select(JobListing).filter(Listing.id.in_(ids)).options(selectinload(JobListing.tags))
+
+    def order_by_ids(self, listings, ids):
+        by_id = {listing.id: listing for listing in listings}
+        return [by_id[listing_id] for listing_id in ids if listing_id in by_id]
+
+    def listings_query(self, user: Account, limit, cursor=None, since=None, near=None):
+
+        if not isinstance(user, (BusinessAccount, ServiceProviderAccount)):
             raise HTTPException(status_code=403, detail="Invalid account type. Account doesn't have access to the live board.")
         
-        if(user.account_type == BusinessAccount):
+        if isinstance(user, BusinessAccount):
 
-            return self.session.query(ProductListing).all()
+            query = select(ProductListing).filter(Listing.type == ListingType.PRODUCT)
         
         else:
             trade = user.trade
 
-            jobs = self.session.query(JobListing).join(JobListing.tags).filter(Tag.name.in_(trade)).all()
+            query = select(JobListing).join(JobListing.tags).filter(Listing.type == ListingType.JOB, Tag.name == trade.value)
+
+        if since is not None:
+            query = query.filter(Listing.datetime_required >= since)
+
+        if near is not None:
+            #the bounding box runs in sql, nearby_rows trims its corners to the radius
+            min_lat, max_lat, min_lon, max_lon = bounding_box(*near)
+            query = query.filter(Listing.latitude.between(min_lat, max_lat), Listing.longitude.between(min_lon, max_lon))
+
+        if cursor is not None:
+            query = query.filter(tuple_(Listing.datetime_required, Listing.id) > tuple_(*decode_cursor(cursor)))
+
+        #fetch one extra row to tell whether there is a next page, tags come in one batched select
+        return query.order_by(Listing.datetime_required, Listing.id).limit(limit + 1).options(selectinload(Listing.tags))
+
+    def nearby_rows(self, listings, near):
+        if near is None:
+            return list(listings)
+        return [listing for listing in listings if within_radius(*near, listing.latitude, listing.longitude)]
+
+    def next_batch_cursor(self, batch, limit):
+        #None once the rows run out, otherwise the cursor after the last row fetched
+        if len(batch) <= limit:
+            return None
+        return encode_cursor(batch[-1].datetime_required, batch[-1].id)
+
+    def paginate(self, listings, limit):
+        if len(listings) <= limit:
+            return listings, None
+
+        listings = listings[:limit]
+        return listings, encode_cursor(listings[-1].datetime_required, listings[-1].id)
+
+    def get_listings(self, user: Account, limit=LIVE_BOARD_PAGE_SIZE, cursor=None, since=None, within_km=None, sort=BoardSort.TIME, exclude_conflicts=False):
+        limit = min(limit, LIVE_BOARD_MAX_PAGE_SIZE)
+
+        if sort == BoardSort.RELEVANCE:
+            self.check_relevance_sort(user)
+        #located before anything is read, saving a missing location commits on its own primary session
+        origin = None
+        if sort == BoardSort.RELEVANCE or within_km is not None:
+            origin = self.user_location(user)
+            self.check_search_origin(origin, within_km)
+
+        #the provider's shifts are one cached interval set, each candidate is checked against it in memory
+        busy = None
+        if exclude_conflicts:
+            self.check_exclude_conflicts(user)
+            busy = ApplicationManager(self.session).get_commitments(user)
+            if not trade_index.ready:
+                self.rebuild_trade_index()
+
+        if sort == BoardSort.RELEVANCE:
+            if not load_ranking_index().ready:
+                self.rebuild_ranking_index()
+            ids, next_cursor = self.ranked_page(user, limit, cursor, since, origin, within_km, busy)
+            listings = self.session.execute(self.listings_by_ids_query(ids)).scalars().all()
+            return self.order_by_ids(listings, ids), next_cursor
+
+        near = (*origin, within_km) if within_km is not None else None
+
+        #provider boards resolve to ids in memory and cost a single primary key fetch
+        if self.uses_trade_index(user):
+            allowed = None
+            if near is not None:
+                if not geo_index.ready:
+                    self.rebuild_geo_index()
+                allowed = self.nearby_listing_ids(origin, within_km)
+            ids, next_cursor = self.trade_index_page(user, limit, cursor, since, allowed, busy)
+            listings = self.session.execute(self.listings_by_ids_query(ids)).scalars().all()
+            return self.order_by_ids(listings, ids), next_cursor
+
+        #rows outside the radius but inside its bounding box are dropped, refill until the page is full
+        listings = []
+        while True:
+            batch = self.session.execute(self.listings_query(user, limit, cursor, since, near)).scalars().all()
+            listings += self.nearby_rows(batch, near)
+            cursor = self.next_batch_cursor(batch, limit)
+            if len(listings) > limit or cursor is None:
+                return self.paginate(listings, limit)
+
+#same operations as ListingManager for endpoints running on an AsyncSession
+class AsyncListingManager(ListingManager):
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def add_listing(self, listing, tags=()):
+        tag_names = list(dict.fromkeys(tag_name(trade) for trade in tags))
+        tag_ids, new_tags = await self.resolve_tag_ids(tag_names)
 
-            return jobs
+        await self.locate_listing(listing)
+        self.session.add(listing)
+        await self.session.flush()
+        listing_watermark.claim([listing.id])
+        if tag_names:
+            await self.session.execute(insert(listing_tags), self.listing_tag_rows([listing.id], [tag_names], tag_ids))
+        if listing.type == ListingType.JOB:
+            await self.enqueue_notifications([listing.id], [tag_names])
+        entry = self.trade_index_entry(listing, tag_names)
+        location = self.geo_index_entry(listing)
+        ranking = self.ranking_index_entry(listing, tag_names)
+        event = self.board_event("created", listing, tag_names)
+        await self.session.commit()
+
+        tag_cache.update(new_tags)
+        self.publish_listing_change(entry, location, event, ranking)
+
+    async def create_job_listing(self, type, title, description, location, datetime_required, created_by, created_at, tags, rate_per_h, datetime_end=None):
+
+        job = JobListing(type, title, description, location, datetime_required, created_by, created_at, [], rate_per_h, datetime_end)
+        await self.add_listing(job, tags)
+
+        return job
+
+    async def create_job_listings(self, jobs, created_by):
+        if not jobs:
+            return []
+
+        tag_names = self.bulk_tag_names(jobs)
+        tag_ids, new_tags = await self.resolve_tag_ids(sorted({name for names in tag_names for name in names}))
+
+        rows = self.job_listing_rows(jobs, created_by, await self.locate_jobs(jobs))
+        result = await self.session.execute(self.bulk_insert_jobs_query(), rows)
+        listing_ids = result.scalars().all()
+        listing_watermark.claim(listing_ids)
+
+        tag_rows = self.listing_tag_rows(listing_ids, tag_names, tag_ids)
+        if tag_rows:
+            await self.session.execute(insert(listing_tags), tag_rows)
+        await self.enqueue_notifications(listing_ids, tag_names)
+        await self.session.commit()
+
+        tag_cache.update(new_tags)
+        self.publish_bulk_job_listings(rows, listing_ids, tag_names)
+        return listing_ids
+
+    async def locate_listing(self, listing):
+        if self.needs_location(listing):
+            coordinates = await geocode_async(listing.location)
+            if coordinates is not None:
+                listing.latitude, listing.longitude = coordinates
+
+    async def locate_jobs(self, jobs):
+        coordinates = {}
+        for location in self.job_locations(jobs):
+            coordinates[location] = await geocode_async(location) or (None, None)
+        return coordinates
+
+    async def user_location(self, user: Account):
+        if not self.needs_location(user):
+            return user.latitude, user.longitude
+
+        coordinates = await geocode_async(getattr(user, "address", None))
+        if coordinates is not None:
+            async with AsyncSessionLocal() as primary:
+                await primary.execute(self.user_location_statement(user, coordinates))
+                await primary.commit()
+            user.latitude, user.longitude = coordinates
+        return coordinates
+
+    async def enqueue_notifications(self, listing_ids, tag_names):
+        rows = self.notification_job_rows(listing_ids, tag_names)
+        if rows:
+            await self.session.execute(insert(NotificationJob), rows)
+
+    async def warm_tag_cache(self):
+        result = await self.session.execute(self.tag_ids_query())
+        tag_cache.replace(result.all())
+
+    async def resolve_tag_ids(self, names):
+        tag_ids, missing = tag_cache.lookup(names)
+        if not missing:
+            return tag_ids, []
+
+        for name in missing:
+            try:
+                async with self.session.begin_nested():
+                    await self.session.execute(insert(Tag).values(name=name))
+            except IntegrityError:
+                pass
+
+        result = await self.session.execute(self.tag_ids_query(missing))
+        rows = result.all()
+        tag_ids.update({name: tag_id for tag_id, name in rows})
+        return tag_ids, rows
+
+    async def rebuild_trade_index(self):
+        result = await self.session.execute(self.trade_index_rows_query())
+        trade_index.rebuild(result.all())
+
+    async def start_listing_watermark(self):
+        #read before the indexes are rebuilt, a listing committed in between is caught up again harmlessly
+        result = await self.session.execute(self.listing_watermark_query())
+        listing_watermark.reset(result.scalar())
+
+    async def catch_up_listings(self):
+        #picks up listings committed by other workers since the last catch-up
+        after_id, gaps = listing_watermark.pending()
+        result = await self.session.execute(self.listing_feed_query(after_id, gaps))
+        ids = listing_watermark.advance(result.scalars().all())
+
+        for start in range(0, len(ids), LISTING_CATCH_UP_BATCH_SIZE):
+            result = await self.session.execute(self.caught_up_listings_query(ids[start:start + LISTING_CATCH_UP_BATCH_SIZE]))
+            self.publish_caught_up(result.scalars().all())
+        return len(ids)
+
+    async def rebuild_ranking_index(self):
+        result = await self.session.execute(self.ranking_index_rows_query())
+        load_ranking_index().rebuild(result.all())
+
+    async def rebuild_geo_index(self):
+        result = await self.session.execute(self.geo_index_rows_query())
+        geo_index.rebuild(result.all())
+
+    async def get_listings(self, user: Account, limit=LIVE_BOARD_PAGE_SIZE, cursor=None, since=None, within_km=None, sort=BoardSort.TIME, exclude_conflicts=False):
+        limit = min(limit, LIVE_BOARD_MAX_PAGE_SIZE)
+
+        if sort == BoardSort.RELEVANCE:
+            self.check_relevance_sort(user)
+        #located before anything is read, saving a missing location commits on its own primary session
+        origin = None
+        if sort == BoardSort.RELEVANCE or within_km is not None:
+            origin = await self.user_location(user)
+            self.check_search_origin(origin, within_km)
+
+        busy = None
+        if exclude_conflicts:
+            self.check_exclude_conflicts(user)
+            busy = await AsyncApplicationManager(self.session).get_commitments(user)
+            if not trade_index.ready:
+                await self.rebuild_trade_index()
+
+        if sort == BoardSort.RELEVANCE:
+            if not load_ranking_index().ready:
+                await self.rebuild_ranking_index()
+            ids, next_cursor = self.ranked_page(user, limit, cursor, since, origin, within_km, busy)
+            result = await self.session.execute(self.listings_by_ids_query(ids))
+            return self.order_by_ids(result.scalars().all(), ids), next_cursor
+
+        near = (*origin, within_km) if within_km is not None else None
+
+        if self.uses_trade_index(user):
+            allowed = None
+            if near is not None:
+                if not geo_index.ready:
+                    await self.rebuild_geo_index()
+                allowed = self.nearby_listing_ids(origin, within_km)
+            ids, next_cursor = self.trade_index_page(user, limit, cursor, since, allowed, busy)
+            result = await self.session.execute(self.listings_by_ids_query(ids))
+            return self.order_by_ids(result.scalars().all(), ids), next_cursor
+
+        listings = []
+        while True:
+            result = await self.session.execute(self.listings_query(user, limit, cursor, since, near))
+            batch = result.scalars().all()
+            listings += self.nearby_rows(batch, near)
+            cursor = self.next_batch_cursor(batch, limit)
+            if len(listings) > limit or cursor is None:
+                return self.paginate(listings, limit)
+
+class ApplicationManager:
+    def __init__(self, session: Session):
+        self.session = session
 
+    def job_listing_query(self, listing_id):
+        #tags are all can_apply needs, the applicant collection is never loaded
+        return select(JobListing).filter(JobListing.id == listing_id).options(selectinload(JobListing.tags))
 
+    def duplicate_application(self):
+        return HTTPException(status_code=409, detail="Applicant has already applied for this listing.")
 
+    def listing_not_found(self):
+        return HTTPException(status_code=404, detail="Job listing not found")
+
+    def shift_conflict(self, listing_id):
+        return HTTPException(status_code=409, detail=f"This shift overlaps listing {listing_id} you have already applied for.")
+
+    def commitments_query(self, applicant: Account):
+        #served by the applicant_id index, archived listings have already left the applications table
+        return (
+            select(Application.listing_id, Listing.datetime_required, Listing.datetime_end)
+            .join(Listing, Listing.id == Application.listing_id)
+            .filter(Application.applicant_id == applicant.id)
+        )
+
+    def get_commitments(self, applicant: Account):
+        intervals = commitment_index.get(applicant.id)
+        if intervals is None:
+            intervals = commitment_index.load(applicant.id, self.session.execute(self.commitments_query(applicant)).all())
+        return intervals
+
+    def reserve_shift(self, applicant: Account, listing: JobListing):
+        #the window is held in memory before the commit, an overlapping apply racing this one on the same
+        #worker is turned away here, one through another worker is caught by overlapping_application_query
+        conflict = commitment_index.reserve(applicant.id, listing.id, *listing.get_window())
+        if conflict == listing.id:
+            raise self.duplicate_application()
+        if conflict is not None:
+            raise self.shift_conflict(conflict)
+
+    def lock_applicant_query(self, applicant: Account):
+        #serialises a provider's applies across workers, sqlite has no row locks but serialises writers,
+        #which the application insert ahead of the overlap check waits on
+        return select(Account.id).filter(Account.id == applicant.id).with_for_update()
+
+    def overlapping_application_query(self, applicant: Account, listing: JobListing):
+        #run after the application is flushed, on the applicant_id index, same overlap test as IntervalSet
+        start, end = listing.get_window()
+        return (
+            select(Application.listing_id)
+            .join(Listing, Listing.id == Application.listing_id)
+            .filter(
+                Application.applicant_id == applicant.id,
+                Application.listing_id != listing.id,
+                Listing.datetime_required < (end or start),
+                func.coalesce(Listing.datetime_end, Listing.datetime_required) > start,
+            )
+            .limit(1)
+        )
+
+    def commitment_rows_query(self, after_id=0, gaps=()):
+        condition = Application.id > after_id
+        if gaps:
+            condition = or_(condition, Application.id.in_(gaps))
+        return (
+            select(Application.id, Application.applicant_id, Application.listing_id, Listing.datetime_required, Listing.datetime_end)
+            .join(Listing, Listing.id == Application.listing_id)
+            .filter(condition)
+        )
+
+    def applications_query(self, applicant: Account):
+        return select(Application.id, Application.listing_id).filter(Application.applicant_id == applicant.id).order_by(Application.id)
+
+    def applicant_counts_query(self, business: Account):
+        #one grouped scan over the business's listings, listings without applicants count zero
+        return (
+            select(JobListing.id, func.count(Application.id))
+            .outerjoin(Application, Application.listing_id == JobListing.id)
+            .filter(Listing.created_by == business.id)
+            .group_by(JobListing.id)
+            .order_by(JobListing.id)
+        )
+
+class AsyncApplicationManager(ApplicationManager):
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def get_commitments(self, applicant: Account):
+        intervals = commitment_index.get(applicant.id)
+        if intervals is None:
+            result = await self.session.execute(self.commitments_query(applicant))
+            intervals = commitment_index.load(applicant.id, result.all())
+        return intervals
+
+    async def apply(self, listing_id, applicant: Account):
+        result = await self.session.execute(self.job_listing_query(listing_id))
+        listing = result.scalar_one_or_none()
+        if listing is None:
+            raise self.listing_not_found()
+
+        application = listing.add_applicant(applicant)
+        await self.get_commitments(applicant)
+        self.reserve_shift(applicant, listing)
+        #read up front, a rollback expires the applicant when it belongs to this session
+        applicant_id = applicant.id
+
+        try:
+            await self.session.execute(self.lock_applicant_query(applicant))
+            self.session.add(application)
+            await self.session.flush()
+            result = await self.session.execute(self.overlapping_application_query(applicant, listing))
+            conflict = result.scalar()
+            if conflict is not None:
+                commitment_index.late_conflicts += 1
+                raise self.shift_conflict(conflict)
+            commitment_index.watermark.claim([application.id])
+            await self.session.commit()
+        except IntegrityError:
+            await self.session.rollback()
+            commitment_index.release(applicant_id, listing_id)
+            raise self.duplicate_application()
+        except Exception:
+            await self.session.rollback()
+            commitment_index.release(applicant_id, listing_id)
+            raise
+
+        return application
+
+    async def skip_applications(self):
+        #at startup every provider is loaded from the database on first use, only later applications need catching up
+        result = await self.session.execute(select(func.max(Application.id)))
+        commitment_index.watermark.reset(result.scalar())
+
+    async def catch_up_commitments(self):
+        #applications made through other workers since the last catch-up
+        result = await self.session.execute(self.commitment_rows_query(*commitment_index.watermark.pending()))
+        commitment_index.extend(result.all())
+
+    async def get_applications(self, applicant: Account):
+        result = await self.session.execute(self.applications_query(applicant))
+        return [{"application_id": row.id, "listing_id": row.listing_id} for row in result]
+
+    async def get_applicant_counts(self, business: Account):
+        result = await self.session.execute(self.applicant_counts_query(business))
+        return [{"listing_id": listing_id, "applicants": count} for listing_id, count in result]
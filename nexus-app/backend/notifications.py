@@ -0,0 +1,231 @@
+#fans new job listings out to the providers of their trades, off the posting request
+#jobs are notification_jobs rows written with the listing, every worker claims and delivers them from the app lifespan
+import logging
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+import config
+from sqlalchemy import bindparam, case, delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Account, Listing, NotificationJob, NotificationStatus, ServiceProviderAccount
+
+NOTIFICATION_POLL_SECONDS = float(os.environ.get("NOTIFICATION_POLL_SECONDS", 1))
+#providers per sender call
+NOTIFICATION_BATCH_SIZE = int(os.environ.get("NOTIFICATION_BATCH_SIZE", 500))
+#pending jobs for one trade folded into one pass over its providers
+NOTIFICATION_MAX_COALESCE = int(os.environ.get("NOTIFICATION_MAX_COALESCE", 100))
+#a claimed job goes back to the queue if its worker doesn't report progress for this long
+NOTIFICATION_LEASE_SECONDS = float(os.environ.get("NOTIFICATION_LEASE_SECONDS", 60))
+NOTIFICATION_MAX_ATTEMPTS = int(os.environ.get("NOTIFICATION_MAX_ATTEMPTS", 5))
+#doubles with every failed attempt
+NOTIFICATION_RETRY_SECONDS = float(os.environ.get("NOTIFICATION_RETRY_SECONDS", 5))
+NOTIFICATION_SENDER = os.environ.get("NOTIFICATION_SENDER", "log")
+
+notification_jobs = NotificationJob.__table__
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+class NotificationSender(ABC):
+    @abstractmethod
+    async def send(self, notifications):
+        #notifications are {"account_id", "email", "trade", "listings"} dicts, raising retries the whole batch
+        pass
+
+class LogNotificationSender(NotificationSender):
+    #local stand in, logs each batch instead of delivering it
+    async def send(self, notifications):
+        logging.info(f"Notifying {len(notifications)} providers of new job listings")
+
+NOTIFICATION_SENDERS = {
+    "log": LogNotificationSender,
+}
+
+class NotificationDispatcher:
+    #holds the sender, swap it with register or NOTIFICATION_SENDER, and counts what went through it
+    def __init__(self, sender_name=NOTIFICATION_SENDER):
+        if sender_name not in NOTIFICATION_SENDERS:
+            raise ValueError(f"Unknown NOTIFICATION_SENDER {sender_name}, expected one of {sorted(NOTIFICATION_SENDERS)}")
+        self.sender = NOTIFICATION_SENDERS[sender_name]()
+        self.fanouts = 0
+        self.jobs = 0
+        self.sent = 0
+        self.retries = 0
+        self.failed = 0
+
+    def register(self, sender: NotificationSender):
+        self.sender = sender
+
+    async def dispatch(self, notifications):
+        if not notifications:
+            return
+        await self.sender.send(notifications)
+        self.sent += len(notifications)
+
+    def stats(self):
+        return {"fanouts": self.fanouts, "jobs": self.jobs, "sent": self.sent, "retries": self.retries, "failed": self.failed}
+
+notification_dispatcher = NotificationDispatcher()
+
+class AsyncNotificationManager:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    def claimable(self, now):
+        #pending past its coalescing window or backoff, or running on a worker whose lease ran out
+        return (
+            notification_jobs.c.status.in_([NotificationStatus.PENDING, NotificationStatus.RUNNING]),
+            notification_jobs.c.available_at <= now,
+        )
+
+    def next_trade_query(self, now):
+        return select(notification_jobs.c.trade).where(*self.claimable(now)).order_by(notification_jobs.c.available_at).limit(1)
+
+    def claim_ids_query(self, trade, now):
+        #skip locked keeps workers off each other's jobs, they pick the next trade instead
+        return (
+            select(notification_jobs.c.id)
+            .where(*self.claimable(now), notification_jobs.c.trade == trade)
+            .order_by(notification_jobs.c.id)
+            .limit(NOTIFICATION_MAX_COALESCE)
+            .with_for_update(skip_locked=True)
+        )
+
+    def claim_statement(self, ids, now):
+        #claimable is checked again, a job claimed by another worker in the meantime isn't taken twice
+        return (
+            update(notification_jobs)
+            .where(notification_jobs.c.id.in_(ids), *self.claimable(now))
+            .values(status=NotificationStatus.RUNNING, available_at=now + timedelta(seconds=NOTIFICATION_LEASE_SECONDS))
+            .returning(notification_jobs.c.id, notification_jobs.c.listing_id, notification_jobs.c.trade, notification_jobs.c.cursor, notification_jobs.c.attempts)
+        )
+
+    def listings_query(self, listing_ids):
+        #archived listings drop out, nobody needs telling about a shift that is gone
+        return select(Listing.id, Listing.title, Listing.location, Listing.datetime_required, Listing.datetime_end).filter(Listing.id.in_(listing_ids))
+
+    def providers_query(self, trade, after, limit=NOTIFICATION_BATCH_SIZE):
+        #keyset paged on the (trade, id) index, a page costs the same however far into the trade it is
+        return (
+            select(ServiceProviderAccount.id, Account.email)
+            .filter(ServiceProviderAccount.trade == trade, ServiceProviderAccount.id > after)
+            .order_by(ServiceProviderAccount.id)
+            .limit(limit)
+        )
+
+    def advance_statement(self, ids, cursor, now):
+        #records progress and renews the lease, a retry or another worker resumes after this provider
+        return (
+            update(notification_jobs)
+            .where(notification_jobs.c.id.in_(ids))
+            .values(
+                cursor=case((notification_jobs.c.cursor < cursor, cursor), else_=notification_jobs.c.cursor),
+                available_at=now + timedelta(seconds=NOTIFICATION_LEASE_SECONDS),
+            )
+        )
+
+    def complete_statement(self, ids):
+        return delete(notification_jobs).where(notification_jobs.c.id.in_(ids))
+
+    def retry_statement(self):
+        #executemany over retry_rows, attempts differ between coalesced jobs
+        return (
+            update(notification_jobs)
+            .where(notification_jobs.c.id == bindparam("job_id"))
+            .values(status=bindparam("status"), attempts=bindparam("attempts"), available_at=bindparam("available_at"), last_error=bindparam("error"))
+        )
+
+    def retry_rows(self, jobs, error, now):
+        rows = []
+        for job in jobs:
+            attempts = job.attempts + 1
+            rows.append({
+                "job_id": job.id,
+                "status": NotificationStatus.FAILED if attempts >= NOTIFICATION_MAX_ATTEMPTS else NotificationStatus.PENDING,
+                "attempts": attempts,
+                "available_at": now + timedelta(seconds=NOTIFICATION_RETRY_SECONDS * 2 ** job.attempts),
+                "error": error[:500],
+            })
+        return rows
+
+    def listing_summary(self, row):
+        return {"id": row.id, "title": row.title, "location": row.location, "datetime_required": row.datetime_required, "datetime_end": row.datetime_end}
+
+    def sent_up_to(self, jobs):
+        #duplicate jobs for one listing count once, every provider up to the furthest of their cursors already has it
+        cursors = {}
+        for job in jobs:
+            cursors[job.listing_id] = max(cursors.get(job.listing_id, 0), job.cursor)
+        return cursors
+
+    def notifications(self, providers, jobs, listings):
+        #one notification per provider covering every coalesced listing, minus the ones they were already sent
+        cursors = self.sent_up_to(jobs)
+        notifications = []
+        for provider_id, email in providers:
+            unsent = [listings[listing_id] for listing_id, cursor in cursors.items() if provider_id > cursor]
+            if unsent:
+                notifications.append({"account_id": provider_id, "email": email, "trade": jobs[0].trade.value, "listings": unsent})
+        return notifications
+
+    async def claim(self, now):
+        trade = (await self.session.execute(self.next_trade_query(now))).scalar()
+        if trade is None:
+            await self.session.rollback()
+            return []
+
+        ids = (await self.session.execute(self.claim_ids_query(trade, now))).scalars().all()
+        if not ids:
+            await self.session.rollback()
+            return []
+
+        jobs = (await self.session.execute(self.claim_statement(ids, now))).all()
+        await self.session.commit()
+        return jobs
+
+    async def fan_out(self, jobs):
+        result = await self.session.execute(self.listings_query({job.listing_id for job in jobs}))
+        listings = {row.id: self.listing_summary(row) for row in result}
+        live = [job for job in jobs if job.listing_id in listings]
+
+        ids = [job.id for job in jobs]
+        cursor = min((job.cursor for job in live), default=None)
+        while cursor is not None:
+            providers = (await self.session.execute(self.providers_query(live[0].trade, cursor))).all()
+            if not providers:
+                break
+
+            await notification_dispatcher.dispatch(self.notifications(providers, live, listings))
+            cursor = providers[-1].id
+            await self.session.execute(self.advance_statement(ids, cursor, utcnow()))
+            await self.session.commit()
+
+            if len(providers) < NOTIFICATION_BATCH_SIZE:
+                break
+
+        await self.session.execute(self.complete_statement(ids))
+        await self.session.commit()
+
+    async def deliver(self, now=None):
+        #claims the oldest due trade's jobs and sends them, returns how many jobs were claimed
+        now = now or utcnow()
+        jobs = await self.claim(now)
+        if not jobs:
+            return 0
+
+        notification_dispatcher.fanouts += 1
+        try:
+            await self.fan_out(jobs)
+        except Exception as e:
+            #delivery is at least once, providers in the failed batch are sent it again on the retry
+            logging.warning(f"Notification fan-out for {len(jobs)} jobs failed: {e}")
+            await self.session.rollback()
+            rows = self.retry_rows(jobs, str(e), utcnow())
+            await self.session.execute(self.retry_statement(), rows)
+            await self.session.commit()
+            notification_dispatcher.retries += sum(row["status"] == NotificationStatus.PENDING for row in rows)
+            notification_dispatcher.failed += sum(row["status"] == NotificationStatus.FAILED for row in rows)
+            return len(jobs)
+
+        notification_dispatcher.jobs += len(jobs)
+        return len(jobs)
@@ -0,0 +1,235 @@
+#in-process columnar store of job listings for the relevance sorted provider board
+#every candidate of a trade is scored in one vectorized pass instead of a python loop per listing
+import math
+import os
+import threading
+import time
+from datetime import timezone
+import numpy as np
+import config
+from geo import EARTH_RADIUS_KM
+
+#relative weight of each signal, every signal is scaled to 0..1 before weighting
+RANKING_WEIGHTS = {
+    "rate": float(os.environ.get("RANKING_WEIGHT_RATE", 1.0)),
+    "soon": float(os.environ.get("RANKING_WEIGHT_SOON", 1.0)),
+    "distance": float(os.environ.get("RANKING_WEIGHT_DISTANCE", 1.0)),
+    "tags": float(os.environ.get("RANKING_WEIGHT_TAGS", 0.5)),
+}
+
+#a listing this many hours away scores half of one starting now
+RANKING_SOON_HOURS = float(os.environ.get("RANKING_SOON_HOURS", 24))
+#distance score decays by 1/e every this many km
+RANKING_DISTANCE_KM = float(os.environ.get("RANKING_DISTANCE_KM", 10))
+
+INITIAL_CAPACITY = 1024
+MAX_TAGS = 64
+
+def epoch_seconds(datetime_required):
+    #naive values are utc, same convention as the trade index
+    if datetime_required.tzinfo is None:
+        datetime_required = datetime_required.replace(tzinfo=timezone.utc)
+    return datetime_required.timestamp()
+
+def group_rows(rows):
+    #rows are (listing_id, datetime_required, datetime_end, rate_per_h, latitude, longitude, trade), one per listing tag
+    listings = {}
+    for listing_id, datetime_required, datetime_end, rate_per_h, latitude, longitude, trade in rows:
+        listings.setdefault(listing_id, (datetime_required, datetime_end, rate_per_h, latitude, longitude, []))[5].append(trade)
+    return listings
+
+def distance_km(latitude, longitude, latitudes, longitudes):
+    #haversine from one origin to every candidate, listings without coordinates come back nan
+    lat1, lon1 = math.radians(latitude), math.radians(longitude)
+    lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+def overlaps_any(busy, starts, ends):
+    #same test as IntervalSet.overlapping for every window at once: the held shifts starting before
+    #each window's end overlap it iff the latest of their ends is after the window's start
+    busy_starts, busy_max_ends = busy.bounds()
+    busy_starts = np.array([epoch_seconds(value) for value in busy_starts])
+    busy_max_ends = np.array([epoch_seconds(value) for value in busy_max_ends])
+
+    positions = np.searchsorted(busy_starts, ends, side="left")
+    latest_ends = busy_max_ends[np.maximum(positions - 1, 0)]
+    return (positions > 0) & (latest_ends > starts)
+
+class RankingIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bits = {}
+        self._reset(INITIAL_CAPACITY)
+        self.ready = False
+
+    def _reset(self, capacity):
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._required = np.zeros(capacity, dtype=np.float64)
+        self._end = np.zeros(capacity, dtype=np.float64)
+        self._rate = np.zeros(capacity, dtype=np.float64)
+        self._latitude = np.full(capacity, np.nan)
+        self._longitude = np.full(capacity, np.nan)
+        self._tags = np.zeros(capacity, dtype=np.uint64)
+        self._live = np.zeros(capacity, dtype=bool)
+        self._rows = {}
+        #rows freed by remove, add fills them before growing so the scanned prefix stays at the peak live count
+        self._free = []
+        self._size = 0
+
+    def _columns(self):
+        return ("_ids", "_required", "_end", "_rate", "_latitude", "_longitude", "_tags", "_live")
+
+    def _grow(self):
+        capacity = len(self._ids) * 2
+        for name in self._columns():
+            column = getattr(self, name)
+            #missing coordinates are nan, everything else starts at zero
+            grown = np.full(capacity, np.nan if name in ("_latitude", "_longitude") else 0, dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+
+    def _tag_mask(self, trades):
+        #each trade gets one bit, there are only a handful so 64 is plenty
+        mask = 0
+        for trade in trades:
+            if trade not in self._bits:
+                if len(self._bits) >= MAX_TAGS:
+                    continue
+                self._bits[trade] = 1 << len(self._bits)
+            mask |= self._bits[trade]
+        return mask
+
+    def _set(self, row, listing_id, datetime_required, datetime_end, rate_per_h, latitude, longitude, trades):
+        self._ids[row] = listing_id
+        self._required[row] = epoch_seconds(datetime_required)
+        self._end[row] = epoch_seconds(datetime_end or datetime_required)
+        self._rate[row] = rate_per_h or 0
+        self._latitude[row] = np.nan if latitude is None else latitude
+        self._longitude[row] = np.nan if longitude is None else longitude
+        self._tags[row] = self._tag_mask(trades)
+        self._live[row] = True
+
+    def add(self, listing_id, datetime_required, datetime_end, rate_per_h, latitude, longitude, trades):
+        with self._lock:
+            row = self._rows.get(listing_id)
+            if row is None:
+                if self._free:
+                    row = self._free.pop()
+                else:
+                    if self._size == len(self._ids):
+                        self._grow()
+                    row = self._size
+                    self._size += 1
+                self._rows[listing_id] = row
+
+            self._set(row, listing_id, datetime_required, datetime_end, rate_per_h, latitude, longitude, trades)
+
+    def remove(self, listing_id):
+        #the row is masked out until the next add reuses it
+        with self._lock:
+            row = self._rows.pop(listing_id, None)
+            if row is not None:
+                self._live[row] = False
+                self._free.append(row)
+
+    def rebuild(self, rows):
+        listings = group_rows(rows)
+
+        #built off to the side and swapped in so readers never see a half built index
+        rebuilt = RankingIndex()
+        rebuilt._bits = dict(self._bits)
+        rebuilt._reset(max(INITIAL_CAPACITY, len(listings)))
+        for row, (listing_id, (datetime_required, datetime_end, rate_per_h, latitude, longitude, trades)) in enumerate(listings.items()):
+            rebuilt._set(row, listing_id, datetime_required, datetime_end, rate_per_h, latitude, longitude, trades)
+            rebuilt._rows[listing_id] = row
+        rebuilt._size = len(listings)
+
+        with self._lock:
+            for name in self._columns():
+                setattr(self, name, getattr(rebuilt, name))
+            self._bits = rebuilt._bits
+            self._rows = rebuilt._rows
+            self._free = rebuilt._free
+            self._size = rebuilt._size
+            self.ready = True
+
+    def candidates(self, trade, since=None, origin=None, within_km=None, busy=None, now=None):
+        #returns copies of the columns for listings on this trade's board that haven't started yet,
+        #busy is an IntervalSet of shifts the provider already holds, listings overlapping them are left out
+        now = time.time() if now is None else now
+        start = now if since is None else max(now, epoch_seconds(since))
+
+        with self._lock:
+            bit = self._bits.get(trade)
+            if bit is None:
+                return None
+
+            size = self._size
+            tags = self._tags[:size]
+            required = self._required[:size]
+            mask = self._live[:size] & ((tags & np.uint64(bit)) != 0) & (required >= start)
+            if busy is not None and len(busy):
+                mask &= ~overlaps_any(busy, required, self._end[:size])
+            rows = np.flatnonzero(mask)
+
+            columns = {
+                "ids": self._ids[rows],
+                "required": required[rows],
+                "rate": self._rate[rows],
+                "latitude": self._latitude[rows],
+                "longitude": self._longitude[rows],
+                "tags": tags[rows],
+            }
+
+        if origin is not None:
+            columns["distance"] = distance_km(*origin, columns["latitude"], columns["longitude"])
+            if within_km is not None:
+                nearby = columns["distance"] <= within_km
+                columns = {name: column[nearby] for name, column in columns.items()}
+
+        columns["now"] = now
+        return columns
+
+    def rank(self, trade, limit, offset=0, since=None, origin=None, within_km=None, busy=None, weights=None, now=None):
+        #returns (listing ids best first, whether there are more after this page)
+        columns = self.candidates(trade, since, origin, within_km, busy, now)
+        if columns is None or len(columns["ids"]) == 0:
+            return [], False
+
+        scores = score(columns, weights or RANKING_WEIGHTS)
+        ids = columns["ids"]
+        count = len(ids)
+
+        k = min(offset + limit, count)
+        if k <= offset:
+            return [], False
+
+        #only the top k are sorted, argpartition puts them in front in linear time
+        top = np.argpartition(-scores, k - 1)[:k] if k < count else np.arange(count)
+        top = top[np.lexsort((ids[top], -scores[top]))]
+        return ids[top[offset:k]].tolist(), count > k
+
+    def __len__(self):
+        return len(self._rows)
+
+def score(columns, weights):
+    #weighted sum of signals that are each scaled to 0..1
+    rate = columns["rate"]
+    spread = np.ptp(rate)
+    rate_score = (rate - rate.min()) / spread if spread > 0 else np.ones_like(rate)
+
+    hours = np.maximum(columns["required"] - columns["now"], 0) / 3600
+    soon_score = 1 / (1 + hours / RANKING_SOON_HOURS)
+
+    scores = weights["rate"] * rate_score + weights["soon"] * soon_score
+
+    if "distance" in columns:
+        #listings without coordinates get no distance credit
+        scores += weights["distance"] * np.nan_to_num(np.exp(-columns["distance"] / RANKING_DISTANCE_KM), nan=0.0)
+
+    #every candidate carries the provider's trade, listings asking for fewer trades are a closer match
+    scores += weights["tags"] / np.maximum(np.bitwise_count(columns["tags"]), 1)
+    return scores
+
+ranking_index = RankingIndex()
@@ -1,7 +1,17 @@
-from pydantic import BaseModel, EmailStr, ValidationError
-from datetime import datetime
+from typing import Annotated
+from pydantic import AfterValidator, BaseModel, ConfigDict, EmailStr, Field, ValidationError, field_validator, model_validator
+from datetime import datetime, timezone
 from models import AccountType, TradeType, ListingType
 
+def naive_utc(value):
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+#listing times are stored and compared as naive utc, every time a client sends is converted on the way in
+#so the database, the cursors and the in-memory indexes all see the same value
+UtcDateTime = Annotated[datetime, AfterValidator(naive_utc)]
+
 class BaseRegisterModel(BaseModel):
     username: str
     email: EmailStr
@@ -24,13 +34,94 @@ class BaseListingModel(BaseModel):
     title: str
     description: str
     location: str
-    datetime_required: datetime
+    datetime_required: UtcDateTime
     created_by: str
-    created_at: datetime
+    created_at: UtcDateTime
 
 class JobListingModel(BaseListingModel):
     rate_per_h: int
+    tags: list[TradeType] = []
+    #end of the shift, defaults to SHIFT_DEFAULT_HOURS after datetime_required
+    datetime_end: UtcDateTime | None = None
+
+    @model_validator(mode="after")
+    def end_after_start(self):
+        if self.datetime_end is not None and self.datetime_end <= self.datetime_required:
+            raise ValueError("datetime_end must be after datetime_required")
+        return self
 
 class ProductListing(BaseListingModel):
     price: float
-    quantity: int
\ No newline at end of file
+    quantity: int
+
+class ApplicationModel(BaseModel):
+    listing_id: int
+
+class RefreshTokenModel(BaseModel):
+    refresh_token: str
+
+class ReservationModel(BaseModel):
+    quantity: int = Field(1, ge=1)
+
+class StockModel(BaseModel):
+    quantity: int = Field(ge=0)
+    #the version the owner last read, a stock change since then makes the update fail
+    version: int
+
+#response models, listings are validated straight from orm objects whose tags were eager loaded
+class ListingResponseModel(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    type: ListingType
+    title: str
+    description: str
+    location: str
+    latitude: float | None = None
+    longitude: float | None = None
+    datetime_required: datetime
+    datetime_end: datetime | None = None
+    created_by: int
+    created_at: datetime
+    tags: list[str] = []
+
+    @field_validator("tags", mode="before")
+    @classmethod
+    def tag_names(cls, tags):
+        return [getattr(tag, "name", tag) for tag in tags]
+
+class JobListingResponseModel(ListingResponseModel):
+    rate_per_h: float
+
+class ProductListingResponseModel(ListingResponseModel):
+    price: float
+    quantity: int
+    version: int = 0
+
+ListingResponse = JobListingResponseModel | ProductListingResponseModel
+
+class LiveBoardResponseModel(BaseModel):
+    listings: list[ListingResponse]
+    next_cursor: str | None = None
+
+class SearchResponseModel(BaseModel):
+    listings: list[ListingResponse]
+    next_offset: int | None = None
+
+class AccountProfileModel(BaseModel):
+    username: str
+    email: str
+
+class BusinessProfileModel(AccountProfileModel):
+    phone_number: str
+    abn: str
+    address: str
+
+class ServiceProviderProfileModel(AccountProfileModel):
+    phone_number: str
+    first_name: str
+    last_name: str
+    address: str
+    trade: TradeType
+
+ProfileResponse = ServiceProviderProfileModel | BusinessProfileModel | AccountProfileModel
@@ -0,0 +1,123 @@
+#full-text search over listing titles and descriptions
+#sqlite uses an fts5 table kept in sync by triggers, postgres a generated tsvector column with a gin index
+import re
+from sqlalchemy import Column, Integer, MetaData, Table, Text, func, literal_column, select, text, or_
+from sqlalchemy.orm import with_polymorphic, selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Listing, listing_tags, Tag
+
+#kept out of Base.metadata, create_all can't create virtual tables
+listings_fts = Table("listings_fts", MetaData(), Column("rowid", Integer), Column("title", Text), Column("description", Text))
+
+SQLITE_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS listings_fts USING fts5(title, description, content='listings', content_rowid='id')",
+    """CREATE TRIGGER IF NOT EXISTS listings_fts_insert AFTER INSERT ON listings BEGIN
+        INSERT INTO listings_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS listings_fts_delete AFTER DELETE ON listings BEGIN
+        INSERT INTO listings_fts(listings_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS listings_fts_update AFTER UPDATE OF title, description ON listings BEGIN
+        INSERT INTO listings_fts(listings_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO listings_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""",
+]
+
+POSTGRES_SEARCH_DDL = [
+    """ALTER TABLE listings ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('english', coalesce(title, '') || ' ' || coalesce(description, ''))) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_listings_search_vector ON listings USING gin (search_vector)",
+]
+
+def ensure_search_index(connection):
+    #runs inside the migration's transaction
+    dialect = connection.dialect.name
+
+    if dialect == "sqlite":
+        exists = connection.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'listings_fts'")).first()
+        for statement in SQLITE_SEARCH_DDL:
+            connection.execute(text(statement))
+        #index rows that were written before the fts table existed
+        if not exists:
+            connection.execute(text("INSERT INTO listings_fts(listings_fts) VALUES ('rebuild')"))
+
+    elif dialect == "postgresql":
+        for statement in POSTGRES_SEARCH_DDL:
+            connection.execute(text(statement))
+
+def fts5_query(terms):
+    #user input is reduced to quoted word prefixes so fts5 syntax characters can't break the query
+    words = re.findall(r"\w+", terms)
+    return " ".join(f'"{word}"*' for word in words)
+
+def search_query(dialect, terms, listing_type=None, trades=None, limit=20, offset=0):
+    #returns a select of listing ids, best match first
+    if dialect == "sqlite":
+        match = fts5_query(terms)
+        if not match:
+            return None
+        rank = func.bm25(literal_column("listings_fts"))
+        query = (
+            select(Listing.id)
+            .join(listings_fts, listings_fts.c.rowid == Listing.id)
+            .filter(literal_column("listings_fts").match(match))
+            .order_by(rank, Listing.id)
+        )
+
+    elif dialect == "postgresql":
+        ts_query = func.websearch_to_tsquery("english", terms)
+        search_vector = literal_column("listings.search_vector")
+        query = (
+            select(Listing.id)
+            .filter(search_vector.op("@@")(ts_query))
+            .order_by(func.ts_rank(search_vector, ts_query).desc(), Listing.id)
+        )
+
+    else:
+        #no index on other dialects, this is a full scan, % and _ in the terms match themselves
+        pattern = "%" + re.sub(r"([\\%_])", r"\\\1", terms) + "%"
+        query = (
+            select(Listing.id)
+            .filter(or_(Listing.title.ilike(pattern, escape="\\"), Listing.description.ilike(pattern, escape="\\")))
+            .order_by(Listing.id)
+        )
+
+    if listing_type is not None:
+        query = query.filter(Listing.type == listing_type)
+
+    if trades:
+        tagged = select(listing_tags.c.listing_id).join(Tag, Tag.id == listing_tags.c.tag_id).filter(Tag.name.in_(trades))
+        query = query.filter(Listing.id.in_(tagged))
+
+    return query.limit(limit).offset(offset)
+
+class AsyncSearchManager:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    def dialect(self):
+        return self.session.get_bind().dialect.name
+
+    def listings_by_ids_query(self, ids):
+        polymorphic_listing = with_polymorphic(Listing, '*')
+        return select(polymorphic_listing).filter(polymorphic_listing.id.in_(ids)).options(selectinload(polymorphic_listing.tags))
+
+    def order_by_ids(self, listings, ids):
+        by_id = {listing.id: listing for listing in listings}
+        return [by_id[listing_id] for listing_id in ids if listing_id in by_id]
+
+    def page(self, ids, limit, offset):
+        #one extra id was fetched to tell whether there is a next page
+        next_offset = offset + limit if len(ids) > limit else None
+        return ids[:limit], next_offset
+
+    async def search_listings(self, terms, listing_type=None, trades=None, limit=20, offset=0):
+        query = search_query(self.dialect(), terms, listing_type, trades, limit + 1, offset)
+        if query is None:
+            return [], None
+
+        result = await self.session.execute(query)
+        ids, next_offset = self.page(result.scalars().all(), limit, offset)
+
+        result = await self.session.execute(self.listings_by_ids_query(ids))
+        return self.order_by_ids(result.scalars().all(), ids), next_offset
@@ -0,0 +1,66 @@
+#tests run against a throwaway sqlite database, configured before any app module is imported
+import itertools
+import os
+import sys
+import tempfile
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/test.db"
+os.environ.setdefault("SECRET_KEY", "test")
+
+#unique usernames, phone numbers and abns for accounts created by fixtures
+account_numbers = itertools.count(1)
+
+@pytest.fixture(scope="session")
+def database():
+    from database import get_engine
+    from migrations import run_migrations
+
+    run_migrations(get_engine())
+    return get_engine()
+
+@pytest.fixture
+def business(database):
+    from database import SessionLocal
+    from models import BusinessAccount
+
+    number = next(account_numbers)
+    with SessionLocal() as db:
+        account = BusinessAccount(f"business_{number}", "x", f"business_{number}@example.com", f"{number:010d}", f"{number:011d}", "1 Collins St Melbourne")
+        db.add(account)
+        db.commit()
+        return account.id
+
+@pytest.fixture
+def provider(database):
+    from database import SessionLocal
+    from models import ServiceProviderAccount, TradeType
+
+    number = next(account_numbers)
+    with SessionLocal() as db:
+        account = ServiceProviderAccount(f"provider_{number}", "x", f"provider_{number}@example.com", f"{number:010d}", "P", "R", "1 Collins St Melbourne", TradeType.CHEF)
+        db.add(account)
+        db.commit()
+        return account.id
+
+@pytest.fixture
+def client(database):
+    #no lifespan, so the background loops and index rebuilds don't run
+    from fastapi.testclient import TestClient
+    import main
+
+    return TestClient(main.app)
+
+@pytest.fixture
+def auth_headers(database):
+    #returns the bearer header for an account id
+    from database import SessionLocal
+    from models import Account, AccountManager
+
+    def headers(account_id):
+        with SessionLocal() as db:
+            token = AccountManager(db).create_user_token(db.get(Account, account_id))
+        return {"Authorization": f"Bearer {token}"}
+
+    return headers
@@ -0,0 +1,33 @@
+from types import SimpleNamespace
+import pytest
+from fastapi import HTTPException
+from admission import AdmissionController, LOGIN_IP_BURST, LOGIN_USERNAME_BURST
+
+def request_from(ip):
+    return SimpleNamespace(client=SimpleNamespace(host=ip), headers={})
+
+def test_one_address_runs_out_before_the_username_does():
+    controller = AdmissionController()
+
+    for _ in range(int(LOGIN_IP_BURST)):
+        controller.admit_login(request_from("203.0.113.1"), "victim")
+    with pytest.raises(HTTPException) as rejected:
+        controller.admit_login(request_from("203.0.113.1"), "Victim")
+    assert rejected.value.status_code == 429
+    assert controller.rejected["login_ip"] == 1
+
+    #the account owner on another address still gets in
+    controller.admit_login(request_from("198.51.100.7"), "victim")
+
+def test_spraying_one_username_from_many_addresses_is_limited():
+    controller = AdmissionController()
+
+    for attempt in range(int(LOGIN_USERNAME_BURST)):
+        controller.admit_login(request_from(f"203.0.113.{attempt}"), "victim")
+    with pytest.raises(HTTPException) as rejected:
+        controller.admit_login(request_from("198.51.100.7"), "VICTIM")
+    assert rejected.value.status_code == 429
+    assert controller.rejected["login_username"] == 1
+
+    #other accounts are unaffected
+    controller.admit_login(request_from("198.51.100.7"), "someone_else")
@@ -0,0 +1,89 @@
+import asyncio
+from datetime import datetime, timedelta
+
+def add_past_shifts(business, count):
+    #required long before every other test's listings, so a cutoff just after them archives only these
+    from database import SessionLocal
+    from models import JobListing, ListingManager, ListingType
+
+    start = datetime(2000, 1, 1) + timedelta(days=business)
+    ids = []
+    with SessionLocal() as db:
+        for i in range(count):
+            job = JobListing(ListingType.JOB, f"shift {i}", "d", "Melbourne", start + timedelta(minutes=i), business, datetime.now(), [], 30.0)
+            ListingManager(db).add_listing(job, ["CHEF"])
+            ids.append(job.id)
+    return ids, start + timedelta(hours=1)
+
+def apply(provider, listing_id):
+    from database import SessionLocal
+    from models import Application
+
+    with SessionLocal() as db:
+        db.add(Application(provider, listing_id))
+        db.commit()
+
+def archive(action):
+    from archive import AsyncArchiveManager
+    from database import AsyncSessionLocal
+
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            return await action(AsyncArchiveManager(db))
+    return asyncio.run(scenario())
+
+def test_expired_listings_move_in_batches_with_their_tags_and_applications(business, provider):
+    from sqlalchemy import select
+    from board_stream import board_broker
+    from database import SessionLocal
+    from models import Application, Listing, application_archive, listing_archive, listing_tag_archive
+
+    ids, cutoff = add_past_shifts(business, 5)
+    apply(provider, ids[0])
+
+    assert [archive(lambda manager: manager.archive_batch(cutoff, limit=2)) for _ in range(4)] == [2, 2, 1, 0]
+    with SessionLocal() as db:
+        assert db.execute(select(Listing.id).filter(Listing.id.in_(ids))).all() == []
+        assert db.execute(select(Application.id).filter(Application.listing_id == ids[0])).all() == []
+        assert sorted(db.execute(select(listing_archive.c.listing_id).filter(listing_archive.c.listing_id.in_(ids))).scalars()) == ids
+        assert sorted(db.execute(select(listing_tag_archive.c.listing_id).filter(listing_tag_archive.c.listing_id.in_(ids))).scalars()) == ids
+        assert db.execute(select(application_archive.c.applicant_id).filter(application_archive.c.listing_id == ids[0])).scalars().all() == [provider]
+
+    #the live board hears about every archived listing once
+    async def caught_up():
+        from archive import AsyncArchiveManager
+        from database import AsyncSessionLocal
+
+        subscription = board_broker.subscribe("CHEF")
+        try:
+            async with AsyncSessionLocal() as db:
+                await AsyncArchiveManager(db).catch_up_archived()
+                await AsyncArchiveManager(db).catch_up_archived()
+            events = []
+            while not subscription.queue.empty():
+                events.append(subscription.queue.get_nowait())
+            return events
+        finally:
+            board_broker.unsubscribe(subscription)
+
+    removed = [event["listing"]["id"] for event in asyncio.run(caught_up()) if event["event"] == "removed"]
+    assert sorted(set(removed) & set(ids)) == ids
+    assert len(removed) == len(set(removed))
+
+def test_history_pages_newest_first_for_the_owner_and_the_applicant(client, auth_headers, business, provider):
+    ids, cutoff = add_past_shifts(business, 5)
+    apply(provider, ids[2])
+    assert archive(lambda manager: manager.archive_expired(cutoff)) == 5
+
+    def history(account_id, limit):
+        pages, before = [], None
+        while True:
+            response = client.get("/listings/archive", headers=auth_headers(account_id), params={"limit": limit, **({"before": before} if before else {})})
+            assert response.status_code == 200
+            pages.append([(listing["listing_id"], listing["tags"]) for listing in response.json()["listings"]])
+            before = response.json()["next_before"]
+            if before is None:
+                return pages
+
+    assert history(business, 2) == [[(ids[4], ["CHEF"]), (ids[3], ["CHEF"])], [(ids[2], ["CHEF"]), (ids[1], ["CHEF"])], [(ids[0], ["CHEF"])]]
+    assert history(provider, 2) == [[(ids[2], ["CHEF"])]]
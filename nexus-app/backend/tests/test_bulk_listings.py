@@ -0,0 +1,64 @@
+import asyncio
+import json
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+def streamed_request(chunks, content_type):
+    #a request whose body arrives chunk by chunk, sent counts how many chunks were read
+    sent = []
+
+    async def receive():
+        chunk = chunks[len(sent)]
+        sent.append(chunk)
+        return {"type": "http.request", "body": chunk, "more_body": len(sent) < len(chunks)}
+
+    scope = {"type": "http", "method": "POST", "path": "/job_listings/bulk", "headers": [(b"content-type", content_type.encode())]}
+    return Request(scope, receive), sent
+
+def test_ndjson_stops_reading_once_past_the_item_cap(monkeypatch):
+    import main
+
+    monkeypatch.setattr(main, "BULK_JOB_LISTING_MAX_ITEMS", 3)
+    chunks = [json.dumps({"title": str(i)}).encode() + b"\n" for i in range(100)]
+    request, sent = streamed_request(chunks, "application/x-ndjson")
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main.read_bulk_items(request))
+    assert error.value.status_code == 413
+    assert len(sent) == 4
+
+def test_json_array_stops_reading_once_past_the_byte_cap(monkeypatch):
+    import main
+
+    monkeypatch.setattr(main, "BULK_JOB_LISTING_MAX_BYTES", 1000)
+    chunks = [b"["] + [json.dumps({"title": "x" * 100}).encode() + b"," for _ in range(100)] + [b"{}]"]
+    request, sent = streamed_request(chunks, "application/json")
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main.read_bulk_items(request))
+    assert error.value.status_code == 413
+    assert len(sent) < 20
+
+def test_items_under_the_caps_are_parsed():
+    import main
+
+    request, _ = streamed_request([b'[{"title": "a"},', b' {"title": "b"}]'], "application/json")
+    assert asyncio.run(main.read_bulk_items(request)) == [{"title": "a"}, {"title": "b"}]
+
+    request, _ = streamed_request([b'{"title": "a"}\n{"ti', b'tle": "b"}'], "application/x-ndjson")
+    assert asyncio.run(main.read_bulk_items(request)) == [{"title": "a"}, {"title": "b"}]
+
+def test_malformed_ndjson_line_is_reported_with_the_other_items(client, auth_headers, business):
+    from datetime import datetime, timedelta
+
+    valid = json.dumps({
+        "type": "JOB", "title": "t", "description": "d", "location": "Melbourne", "created_by": "x",
+        "datetime_required": (datetime.now() + timedelta(days=1)).isoformat(), "created_at": datetime.now().isoformat(), "rate_per_h": 30,
+    })
+    body = "\n".join([valid, '{"title": ', valid])
+
+    response = client.post("/job_listings/bulk", content=body, headers={**auth_headers(business), "Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert (response.json()["created"], response.json()["rejected"]) == (2, 1)
+    assert response.json()["results"][1] == {"index": 1, "status": "invalid", "detail": "invalid JSON"}
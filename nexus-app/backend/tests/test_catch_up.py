@@ -0,0 +1,123 @@
+import asyncio
+from datetime import datetime, timedelta
+from listing_index import CatchUpWatermark
+
+def job(title, tags=("CHEF",)):
+    return {
+        "title": title,
+        "description": "d",
+        "location": "Melbourne",
+        "datetime_required": datetime.now() + timedelta(days=1),
+        "created_at": datetime.now(),
+        "rate_per_h": 30.0,
+        "tags": list(tags),
+    }
+
+def post_from_another_worker(business, title):
+    #writes the listing without touching this process's indexes, the way another worker's post looks from here
+    from database import SessionLocal
+    from models import ListingManager, listing_tags
+    from sqlalchemy import insert
+
+    with SessionLocal() as db:
+        manager = ListingManager(db)
+        jobs = [job(title)]
+        tag_names = manager.bulk_tag_names(jobs)
+        tag_ids, _ = manager.resolve_tag_ids(tag_names[0])
+        listing_ids = db.execute(manager.bulk_insert_jobs_query(), manager.job_listing_rows(jobs, business, manager.locate_jobs(jobs))).scalars().all()
+        db.execute(insert(listing_tags), manager.listing_tag_rows(listing_ids, tag_names, tag_ids))
+        db.commit()
+        return listing_ids[0]
+
+async def post_locally(business, title):
+    from database import AsyncSessionLocal
+    from models import AsyncListingManager, ListingType
+
+    async with AsyncSessionLocal() as db:
+        listing = await AsyncListingManager(db).create_job_listing(ListingType.JOB, title, "d", "Melbourne", datetime.now() + timedelta(days=1), business, datetime.now(), ["CHEF"], 30.0)
+        return listing.id
+
+async def catch_up():
+    from database import AsyncSessionLocal
+    from models import AsyncListingManager
+
+    async with AsyncSessionLocal() as db:
+        return await AsyncListingManager(db).catch_up_listings()
+
+async def start():
+    from database import AsyncSessionLocal
+    from models import AsyncListingManager
+
+    async with AsyncSessionLocal() as db:
+        manager = AsyncListingManager(db)
+        await manager.start_listing_watermark()
+        await manager.rebuild_trade_index()
+
+def test_listing_from_another_worker_survives_a_later_local_post(business):
+    from listing_index import trade_index
+    from cache import board_versions
+
+    asyncio.run(start())
+    first = asyncio.run(post_locally(business, "first"))
+    second = post_from_another_worker(business, "second")
+    third = asyncio.run(post_locally(business, "third"))
+    version = board_versions.get("CHEF")
+
+    assert asyncio.run(catch_up()) == 1
+    board = [listing_id for _, listing_id in trade_index.page("CHEF", 100)]
+    assert {first, second, third} <= set(board)
+    assert board_versions.get("CHEF") > version
+
+    #the local posts were claimed, a second pass has nothing left to apply
+    assert asyncio.run(catch_up()) == 0
+
+def test_late_commit_below_the_watermark_is_read_again():
+    watermark = CatchUpWatermark()
+    watermark.reset(1)
+
+    #3 commits while 2 is still in flight
+    assert watermark.advance([3]) == [3]
+    assert watermark.pending() == (3, [2])
+
+    assert watermark.advance([2]) == [2]
+    assert watermark.pending() == (3, [])
+
+def test_claimed_ids_are_skipped_once():
+    watermark = CatchUpWatermark()
+    watermark.claim([2])
+
+    assert watermark.advance([1, 2]) == [1]
+    assert watermark.advance([2]) == [2]
+
+def test_gaps_expire():
+    watermark = CatchUpWatermark(gap_seconds=0)
+    watermark.advance([1, 3])
+
+    assert watermark.pending() == (3, [])
+
+def test_gaps_are_bounded():
+    watermark = CatchUpWatermark(max_gaps=2)
+    watermark.advance([10])
+
+    assert watermark.pending() == (10, [8, 9])
+
+def test_stream_subscribers_see_listings_from_other_workers_once(business):
+    from board_stream import board_broker
+
+    async def scenario():
+        subscription = board_broker.subscribe("CHEF")
+        try:
+            await catch_up()
+            local = await post_locally(business, "local")
+            remote = post_from_another_worker(business, "remote")
+            await catch_up()
+
+            events = []
+            while not subscription.queue.empty():
+                events.append(subscription.queue.get_nowait())
+            return local, remote, events
+        finally:
+            board_broker.unsubscribe(subscription)
+
+    local, remote, events = asyncio.run(scenario())
+    assert [(event["event"], event["listing"]["id"]) for event in events] == [("created", local), ("created", remote)]
@@ -0,0 +1,94 @@
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+from fastapi import HTTPException
+
+def add_shift(business, start):
+    from database import SessionLocal
+    from models import JobListing, ListingManager, ListingType
+
+    with SessionLocal() as db:
+        job = JobListing(ListingType.JOB, "shift", "d", "Melbourne", start, business, datetime.now(), [], 30.0, start + timedelta(hours=4))
+        ListingManager(db).add_listing(job, ["CHEF"])
+        return job.id
+
+def apply_from_another_worker(provider, listing_id):
+    #commits without touching this process's commitment index
+    from database import SessionLocal
+    from models import Application
+
+    with SessionLocal() as db:
+        db.add(Application(provider, listing_id))
+        db.commit()
+
+async def apply(provider, listing_id):
+    from database import AsyncSessionLocal
+    from models import AsyncAccountManager, AsyncApplicationManager, Account
+
+    async with AsyncSessionLocal() as db:
+        user = await db.get(Account, provider)
+        user = await AsyncAccountManager(db).get_user(user.username)
+        return await AsyncApplicationManager(db).apply(listing_id, user)
+
+async def cached_commitments(provider):
+    from database import AsyncSessionLocal
+    from models import AsyncApplicationManager, Account
+
+    async with AsyncSessionLocal() as db:
+        return await AsyncApplicationManager(db).get_commitments(await db.get(Account, provider))
+
+def test_overlap_committed_through_another_worker_is_rejected(business, provider):
+    from commitments import commitment_index
+
+    start = datetime(2100, 1, 1) + timedelta(days=provider)
+    first = add_shift(business, start)
+    overlapping = add_shift(business, start + timedelta(hours=2))
+
+    #this worker cached the provider before the other worker's apply
+    intervals = asyncio.run(cached_commitments(provider))
+    apply_from_another_worker(provider, first)
+    assert first not in intervals
+
+    late_conflicts = commitment_index.late_conflicts
+    with pytest.raises(HTTPException) as rejected:
+        asyncio.run(apply(provider, overlapping))
+    assert rejected.value.status_code == 409
+    assert str(first) in rejected.value.detail
+    assert commitment_index.late_conflicts == late_conflicts + 1
+    assert overlapping not in intervals
+
+def test_applications_committed_out_of_order_are_caught_up(business, provider):
+    from commitments import CommitmentIndex
+
+    index = CommitmentIndex()
+    index.watermark.reset(10)
+    index.load(provider, [])
+    start = datetime(2100, 1, 1)
+
+    index.extend([(12, provider, 1, start, start + timedelta(hours=1))])
+    #application 11 was allocated first but committed after 12
+    index.extend([(11, provider, 2, start + timedelta(hours=2), start + timedelta(hours=3))])
+    assert index.watermark.pending() == (12, [])
+    assert 2 in index.get(provider)
+
+def test_offset_shift_times_are_checked_in_utc_by_the_database(client, auth_headers, business, provider):
+    from sqlalchemy import select
+    from database import SessionLocal
+    from models import Listing
+
+    day = (datetime(2300, 1, 1) + timedelta(days=provider)).date()
+    for title, start, end in (("first", f"{day}T10:00:00+10:00", f"{day}T14:00:00+10:00"), ("second", f"{day}T02:00:00Z", f"{day}T06:00:00Z")):
+        response = client.post("/add_job_listing", headers=auth_headers(business), json={
+            "type": "JOB", "title": f"{title} {provider}", "description": "d", "location": "Melbourne", "created_by": "x",
+            "datetime_required": start, "datetime_end": end, "created_at": datetime.now().isoformat(), "rate_per_h": 30, "tags": ["CHEF"],
+        })
+        assert response.status_code == 200
+    with SessionLocal() as db:
+        first, second = db.execute(select(Listing.id).filter(Listing.title.in_([f"first {provider}", f"second {provider}"])).order_by(Listing.id)).scalars()
+
+    #00:00-04:00 and 02:00-06:00 utc overlap, the first is only known to the database
+    asyncio.run(cached_commitments(provider))
+    apply_from_another_worker(provider, first)
+    with pytest.raises(HTTPException) as rejected:
+        asyncio.run(apply(provider, second))
+    assert rejected.value.status_code == 409
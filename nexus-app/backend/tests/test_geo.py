@@ -0,0 +1,82 @@
+import asyncio
+import threading
+from datetime import datetime, timedelta
+import pytest
+from geo import Geocoder, geocode_async, set_geocoder
+import geo
+
+ORIGIN = (-37.8136, 144.9631)
+
+class FixedGeocoder(Geocoder):
+    #a network geocoder stand in, records which threads it was called on
+    PLACES = {
+        "1 Collins St Melbourne": ORIGIN,
+        "near": (ORIGIN[0] + 0.01, ORIGIN[1] + 0.01),
+        #inside the 10km bounding box but about 12.5km away
+        "corner": (ORIGIN[0] + 0.08, ORIGIN[1] + 0.1),
+        "far": (-33.8688, 151.2093),
+    }
+
+    def __init__(self):
+        self.calls = []
+
+    def geocode(self, address):
+        self.calls.append((address, threading.get_ident()))
+        return self.PLACES.get(address)
+
+@pytest.fixture
+def geocoder():
+    previous = geo.geocoder
+    fixed = FixedGeocoder()
+    set_geocoder(fixed)
+    yield fixed
+    set_geocoder(previous)
+
+def test_blocking_geocoder_runs_off_the_event_loop(geocoder):
+    assert asyncio.run(geocode_async("near")) == FixedGeocoder.PLACES["near"]
+    assert geocoder.calls[0][1] != threading.get_ident()
+
+def add_products(business, locations, required):
+    from database import SessionLocal
+    from models import ListingManager, ListingType, ProductListing
+
+    with SessionLocal() as db:
+        manager = ListingManager(db)
+        for offset, location in enumerate(locations):
+            product = ProductListing(ListingType.PRODUCT, location, "d", location, required + timedelta(minutes=offset), business, datetime.now(), [], 1.0, 1)
+            manager.add_listing(product)
+
+async def nearby_pages(username, since, limit):
+    from database import AsyncSessionLocal
+    from models import AsyncAccountManager, AsyncListingManager
+
+    async with AsyncSessionLocal() as db:
+        user = await AsyncAccountManager(db).get_user(username)
+        db.expunge(user)
+
+    pages, cursor = [], None
+    while True:
+        async with AsyncSessionLocal() as db:
+            listings, cursor = await AsyncListingManager(db).get_listings(user, limit, cursor, since, within_km=10)
+        pages.append([listing.title for listing in listings])
+        if cursor is None:
+            return pages
+
+def test_radius_search_pages_past_the_bounding_box_corners_and_saves_the_location(business, geocoder):
+    from database import SessionLocal
+    from models import Account
+
+    required = datetime(2100, 1, 1) + timedelta(days=business)
+    add_products(business, ["corner", "corner", "corner", "near", "far", "near", "near"], required)
+
+    with SessionLocal() as db:
+        username = db.get(Account, business).username
+
+    pages = asyncio.run(nearby_pages(username, required, 2))
+    assert pages == [["near", "near"], ["near"]]
+
+    #geocoded once on the first page and saved, the next pages reuse it
+    assert [address for address, _ in geocoder.calls].count("1 Collins St Melbourne") == 1
+    with SessionLocal() as db:
+        account = db.get(Account, business)
+        assert (account.latitude, account.longitude) == ORIGIN
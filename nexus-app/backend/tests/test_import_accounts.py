@@ -0,0 +1,11 @@
+from import_accounts import read_rows, validate
+
+def test_bad_ndjson_lines_are_rejected_without_stopping_the_import(tmp_path):
+    path = tmp_path / "accounts.ndjson"
+    path.write_text('{"account_type": "NOPE"}\n{"account_type": \n\n[1, 2]\n{"account_type": "BUSINESS"}\n')
+
+    valid, rejected = validate(read_rows(str(path)))
+
+    assert valid == []
+    assert rejected[:3] == [(1, "Invalid account type"), (2, "invalid JSON"), (4, "Expected a JSON object")]
+    assert rejected[3][0] == 5
@@ -0,0 +1,94 @@
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+from fastapi import HTTPException
+import cache
+from cache import BoardVersions
+
+def test_product_board_version_moves_on_without_a_local_bump(monkeypatch):
+    #stock changed through another worker never bumps this one, the ttl retires its cached pages
+    versions = BoardVersions({"PRODUCT": 5})
+    monkeypatch.setattr(cache.time, "time", lambda: 1000.0)
+    before = versions.get("PRODUCT")
+    assert versions.get("CHEF") == 0
+
+    monkeypatch.setattr(cache.time, "time", lambda: 1005.0)
+    assert versions.get("PRODUCT") != before
+
+def add_product(business, quantity):
+    from database import SessionLocal
+    from models import ListingType, ProductListing
+
+    with SessionLocal() as db:
+        product = ProductListing(ListingType.PRODUCT, "p", "d", "Melbourne", datetime.now() + timedelta(days=1), business, datetime.now(), [], 1.0, quantity)
+        db.add(product)
+        db.commit()
+        return product.id
+
+def test_reserve_takes_stock_until_it_runs_out(business, provider):
+    from database import AsyncSessionLocal
+    from inventory import AsyncInventoryManager
+    from models import Account
+
+    product_id = add_product(business, 3)
+
+    async def reserve(quantity):
+        async with AsyncSessionLocal() as db:
+            return await AsyncInventoryManager(db).reserve(product_id, await db.get(Account, provider), quantity)
+
+    reserved = asyncio.run(reserve(2))
+    assert (reserved["remaining"], reserved["version"], reserved["quantity"]) == (1, 1, 2)
+    with pytest.raises(HTTPException) as rejected:
+        asyncio.run(reserve(2))
+    assert rejected.value.detail == "Not enough stock"
+
+def test_only_service_providers_can_reserve(client, auth_headers, business, provider):
+    product_id = add_product(business, 3)
+
+    response = client.post(f"/products/{product_id}/reserve", headers=auth_headers(business), json={"quantity": 1})
+    assert response.status_code == 403
+    response = client.post(f"/products/{product_id}/reserve", headers=auth_headers(provider), json={"quantity": 1})
+    assert (response.status_code, response.json()["remaining"]) == (201, 2)
+
+def test_stock_changes_are_streamed_to_product_subscribers(business, provider):
+    from board_stream import board_broker
+    from database import AsyncSessionLocal
+    from inventory import AsyncInventoryManager
+    from models import Account
+
+    product_id = add_product(business, 3)
+
+    async def scenario():
+        subscription = board_broker.subscribe("PRODUCT")
+        try:
+            async with AsyncSessionLocal() as db:
+                manager = AsyncInventoryManager(db)
+                reserved = await manager.reserve(product_id, await db.get(Account, provider), 2)
+                await manager.release(reserved["reservation_id"], await db.get(Account, provider))
+                await manager.set_stock(product_id, await db.get(Account, business), 10, 2)
+
+            events = []
+            while not subscription.queue.empty():
+                events.append(subscription.queue.get_nowait())
+            return events
+        finally:
+            board_broker.unsubscribe(subscription)
+
+    assert asyncio.run(scenario()) == [
+        {"event": "changed", "listing": {"id": product_id, "quantity": quantity, "version": version}}
+        for quantity, version in [(1, 1), (3, 2), (10, 3)]
+    ]
+
+def test_batched_reserves_share_a_transaction_first_come_first_served(business, provider):
+    from inventory import ReservationBatcher
+
+    product_id = add_product(business, 4)
+    batcher = ReservationBatcher(window_seconds=0.01)
+
+    async def scenario():
+        return await asyncio.gather(*(batcher.submit(product_id, provider, quantity) for quantity in [2, 1, 2]), return_exceptions=True)
+
+    first, second, third = asyncio.run(scenario())
+    assert (first["remaining"], second["remaining"]) == (2, 1)
+    assert isinstance(third, HTTPException) and third.status_code == 409
+    assert batcher.stats() == {"batches": 1, "requests": 3, "pending_products": 0}
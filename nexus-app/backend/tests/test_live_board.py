@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+
+def post_job(client, headers, title, datetime_required):
+    response = client.post("/add_job_listing", headers=headers, json={
+        "type": "JOB", "title": title, "description": "d", "location": "Melbourne", "created_by": "x",
+        "datetime_required": datetime_required, "created_at": datetime.now().isoformat(), "rate_per_h": 30, "tags": ["CHEF"],
+    })
+    assert response.status_code == 200
+
+def board_titles(client, headers, **params):
+    response = client.get("/live_board", headers=headers, params=params)
+    assert response.status_code == 200
+    return [listing["title"] for listing in response.json()["listings"]], response.json()["next_cursor"]
+
+def test_offset_times_are_ordered_the_same_by_sql_and_the_trade_index(client, auth_headers, business, provider, monkeypatch):
+    from listing_index import trade_index
+
+    day = datetime(2300, 1, 1) + timedelta(days=business)
+    #a is 00:00 utc and b is 05:00 utc, a stored wall clock would put b first
+    post_job(client, auth_headers(business), "a", f"{day.date()}T10:00:00+10:00")
+    post_job(client, auth_headers(business), "b", f"{day.date()}T05:00:00Z")
+    headers = auth_headers(provider)
+
+    monkeypatch.setattr(trade_index, "ready", False)
+    sql_page, sql_cursor = board_titles(client, headers, since=f"{day.date()}T00:00:00Z", limit=1)
+    monkeypatch.setattr(trade_index, "ready", True)
+    index_page, index_cursor = board_titles(client, headers, since=f"{day.date()}T00:00:00Z", limit=1)
+    assert sql_page == index_page == ["a"]
+
+    #a cursor from either path continues on the other, and an offset since matches the same listings
+    monkeypatch.setattr(trade_index, "ready", False)
+    assert board_titles(client, headers, since=f"{day.date()}T10:00:00+10:00", cursor=index_cursor, limit=1)[0] == ["b"]
+    monkeypatch.setattr(trade_index, "ready", True)
+    assert board_titles(client, headers, since=f"{day.date()}T10:00:00+10:00", cursor=sql_cursor, limit=1)[0] == ["b"]
+
+def test_cursor_pages_walk_the_board_in_time_order_on_both_paths(client, auth_headers, business, provider, monkeypatch):
+    import base64
+    from listing_index import trade_index
+
+    day = datetime(2400, 1, 1) + timedelta(days=business)
+    hours = [9, 11, 13, 15, 17]
+    titles = [f"{business}-{hour}" for hour in hours]
+    #posted out of order, the board is ordered by required time
+    for hour, title in reversed(list(zip(hours, titles))):
+        post_job(client, auth_headers(business), title, f"{day.date()}T{hour:02d}:00:00")
+    headers = auth_headers(provider)
+
+    for ready in (False, True):
+        monkeypatch.setattr(trade_index, "ready", ready)
+        pages, cursor = [], None
+        while len(pages) < len(titles):
+            page, cursor = board_titles(client, headers, since=f"{day.date()}T00:00:00", limit=2, **({"cursor": cursor} if cursor else {}))
+            pages += page
+        assert pages[:len(titles)] == titles
+
+    offset_cursor = base64.urlsafe_b64encode(f"{day.date()}T09:00:00+00:00|1".encode()).decode()
+    for cursor in ["not-a-cursor", base64.urlsafe_b64encode(b"yesterday|1").decode(), offset_cursor]:
+        assert client.get("/live_board", headers=headers, params={"cursor": cursor}).status_code == 400
+
+def test_unchanged_board_revalidates_and_a_write_changes_it(client, auth_headers, business, provider):
+    from cache import response_cache
+
+    day = datetime(2500, 1, 1) + timedelta(days=business)
+    post_job(client, auth_headers(business), "first", f"{day.date()}T09:00:00")
+    headers = auth_headers(provider)
+    params = {"since": f"{day.date()}T00:00:00", "limit": 1}
+
+    first = client.get("/live_board", headers=headers, params=params)
+    hits = response_cache.hits
+    revalidated = client.get("/live_board", headers={**headers, "If-None-Match": first.headers["ETag"]}, params=params)
+    assert (revalidated.status_code, revalidated.content, revalidated.headers["ETag"]) == (304, b"", first.headers["ETag"])
+    assert response_cache.hits == hits + 1
+
+    #a new listing on the board moves its version on, the cached page and its etag are retired
+    post_job(client, auth_headers(business), "earlier", f"{day.date()}T08:00:00")
+    changed = client.get("/live_board", headers={**headers, "If-None-Match": first.headers["ETag"]}, params=params)
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != first.headers["ETag"]
+    assert [listing["title"] for listing in changed.json()["listings"]] == ["earlier"]
+
+def test_stock_change_retires_the_cached_product_board(client, auth_headers, business, provider):
+    from database import SessionLocal
+    from models import ListingType, ProductListing
+
+    day = datetime(2500, 1, 1) + timedelta(days=business)
+    with SessionLocal() as db:
+        product = ProductListing(ListingType.PRODUCT, "p", "d", "Melbourne", day, business, datetime.now(), [], 1.0, 5)
+        db.add(product)
+        db.commit()
+        product_id = product.id
+    headers = auth_headers(business)
+    params = {"since": day.isoformat(), "limit": 1}
+
+    first = client.get("/live_board", headers=headers, params=params)
+    assert client.post(f"/products/{product_id}/reserve", headers=auth_headers(provider), json={"quantity": 2}).status_code == 201
+    changed = client.get("/live_board", headers={**headers, "If-None-Match": first.headers["ETag"]}, params=params)
+    assert changed.status_code == 200
+    assert [(listing["id"], listing["quantity"]) for listing in changed.json()["listings"]] == [(product_id, 3)]
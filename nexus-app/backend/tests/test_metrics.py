@@ -0,0 +1,22 @@
+from fastapi.testclient import TestClient
+
+def test_metrics_needs_the_token_from_other_hosts(monkeypatch):
+    import main
+
+    client = TestClient(main.app)
+    assert client.get("/metrics").status_code == 403
+
+    monkeypatch.setattr(main, "METRICS_TOKEN", "secret")
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 403
+    response = client.get("/metrics", headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200
+    assert "http_request_duration_seconds" in response.text
+
+def test_query_headers_are_off_by_default(monkeypatch):
+    import main
+
+    client = TestClient(main.app)
+    assert "X-DB-Query-Count" not in client.get("/").headers
+
+    monkeypatch.setattr(main, "QUERY_DEBUG_HEADERS", True)
+    assert "X-DB-Query-Count" in client.get("/").headers
@@ -0,0 +1,78 @@
+from sqlalchemy import create_engine, inspect, text
+
+def describe(engine, tables):
+    inspector = inspect(engine)
+    return {
+        table: (
+            sorted((column["name"], column["nullable"]) for column in inspector.get_columns(table)),
+            sorted((index["name"], tuple(index["column_names"]), bool(index["unique"])) for index in inspector.get_indexes(table)),
+            sorted(tuple(constraint["column_names"]) for constraint in inspector.get_unique_constraints(table)),
+        )
+        for table in tables
+    }
+
+def test_migrating_a_new_database_builds_the_current_models(tmp_path):
+    from migrations import run_migrations
+    from models import Base
+
+    migrated = create_engine(f"sqlite:///{tmp_path}/migrated.db")
+    run_migrations(migrated)
+    created = create_engine(f"sqlite:///{tmp_path}/created.db")
+    Base.metadata.create_all(created)
+
+    tables = sorted(Base.metadata.tables)
+    assert describe(migrated, tables) == describe(created, tables)
+
+def test_shift_end_backfill_covers_live_and_archived_listings(tmp_path, monkeypatch):
+    from datetime import datetime, timedelta
+    import migrations
+    from migrations import initial_schema, run_migrations
+    from models import SHIFT_DEFAULT_HOURS, Listing, listing_archive
+
+    engine = create_engine(f"sqlite:///{tmp_path}/upgraded.db")
+    migrations_before_shift_end = [migration for migration in migrations.MIGRATIONS if migration[0] < 5]
+    monkeypatch.setattr(migrations, "MIGRATIONS", migrations_before_shift_end)
+    run_migrations(engine)
+
+    start = datetime(2100, 1, 1, 9, 30, 0, 250000)
+    listing = {"type": "JOB", "title": "t", "description": "d", "location": "l", "datetime_required": start, "created_by": 1, "created_at": start}
+    with engine.begin() as connection:
+        connection.execute(initial_schema.tables["listings"].insert().values(id=1, **listing))
+        connection.execute(initial_schema.tables["listing_archive"].insert().values(listing_id=2, archived_at=start, **listing))
+
+    monkeypatch.undo()
+    run_migrations(engine)
+    with engine.connect() as connection:
+        ends = [
+            connection.execute(Listing.__table__.select().with_only_columns(Listing.__table__.c.datetime_end)).scalar(),
+            connection.execute(listing_archive.select().with_only_columns(listing_archive.c.datetime_end)).scalar(),
+        ]
+    assert ends == [start + timedelta(hours=SHIFT_DEFAULT_HOURS)] * 2
+
+def test_sqlite_ids_are_not_handed_out_again_after_archiving(tmp_path, monkeypatch):
+    from datetime import datetime
+    import migrations
+    from migrations import initial_schema, run_migrations
+
+    engine = create_engine(f"sqlite:///{tmp_path}/upgraded.db")
+    monkeypatch.setattr(migrations, "MIGRATIONS", [migration for migration in migrations.MIGRATIONS if migration[0] < 9])
+    run_migrations(engine)
+
+    start = datetime(2100, 1, 1)
+    listing = {"type": "JOB", "title": "t", "description": "d", "location": "l", "datetime_required": start, "created_by": 1, "created_at": start}
+    listings = initial_schema.tables["listings"]
+    with engine.begin() as connection:
+        connection.execute(listings.insert().values(id=1, **listing))
+        #listing 2 was the newest when it was archived
+        connection.execute(initial_schema.tables["listing_archive"].insert().values(listing_id=2, archived_at=start, **listing))
+
+    monkeypatch.undo()
+    run_migrations(engine)
+    with engine.begin() as connection:
+        new_id = connection.execute(listings.insert().values(**listing)).inserted_primary_key[0]
+        connection.execute(listings.delete().where(listings.c.id == new_id))
+        after_delete = connection.execute(listings.insert().values(**listing)).inserted_primary_key[0]
+        searchable = connection.execute(text("SELECT rowid FROM listings_fts WHERE listings_fts MATCH 't'")).scalars().all()
+    assert (new_id, after_delete) == (3, 4)
+    #the search triggers came back with the rebuilt table
+    assert sorted(searchable) == [1, 4]
@@ -0,0 +1,137 @@
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+
+@pytest.fixture
+def jobs_db(tmp_path):
+    #a database of its own, claims take the oldest due job of any trade and the shared one has jobs from other tests
+    from sqlalchemy import create_engine
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from sqlalchemy.orm import sessionmaker
+    from migrations import run_migrations
+
+    engine = create_engine(f"sqlite:///{tmp_path}/notifications.db")
+    run_migrations(engine)
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/notifications.db")
+    yield sessionmaker(engine), async_sessionmaker(async_engine, expire_on_commit=False)
+    asyncio.run(async_engine.dispose())
+
+@pytest.fixture
+def sent(monkeypatch):
+    #notifications handed to the sender, in order
+    from notifications import NotificationSender, notification_dispatcher
+
+    class RecordingSender(NotificationSender):
+        def __init__(self):
+            self.batches = []
+
+        async def send(self, notifications):
+            self.batches.append(notifications)
+
+    sender = RecordingSender()
+    monkeypatch.setattr(notification_dispatcher, "sender", sender)
+    return sender.batches
+
+def add_jobs(jobs_db, providers, jobs, attempts=0):
+    #jobs are (listing title, trade) pairs, returns (listing ids by title, job ids, provider ids)
+    from models import BusinessAccount, JobListing, ListingType, NotificationJob, NotificationStatus, ServiceProviderAccount, TradeType
+
+    Session, _ = jobs_db
+    now = datetime.now() - timedelta(seconds=1)
+    with Session() as db:
+        business = BusinessAccount("business", "x", "business@example.com", "0000000001", "00000000001", "1 Collins St Melbourne")
+        db.add(business)
+        provider_accounts = [
+            ServiceProviderAccount(f"provider_{i}", "x", f"provider_{i}@example.com", f"{i + 2:010d}", "P", "R", "1 Collins St Melbourne", TradeType.CHEF)
+            for i in range(providers)
+        ]
+        db.add_all(provider_accounts)
+        db.flush()
+
+        listings = {}
+        for title in dict.fromkeys(title for title, _ in jobs):
+            listing = JobListing(ListingType.JOB, title, "d", "Melbourne", datetime.now() + timedelta(days=1), business.id, now, [], 30.0)
+            db.add(listing)
+            db.flush()
+            listings[title] = listing.id
+
+        rows = [
+            NotificationJob(listing_id=listings[title], trade=trade, status=NotificationStatus.PENDING, cursor=0, attempts=attempts, available_at=now, created_at=now)
+            for title, trade in jobs
+        ]
+        db.add_all(rows)
+        db.commit()
+        return listings, [row.id for row in rows], [account.id for account in provider_accounts]
+
+def remaining_jobs(jobs_db):
+    from models import NotificationJob
+
+    Session, _ = jobs_db
+    with Session() as db:
+        return [(job.id, job.status.value, job.attempts, job.cursor) for job in db.query(NotificationJob).order_by(NotificationJob.id)]
+
+def run(jobs_db, action):
+    async def scenario():
+        async with jobs_db[1]() as db:
+            return await action(db)
+    return asyncio.run(scenario())
+
+def test_a_job_whose_lease_runs_out_is_claimed_again_from_its_cursor(jobs_db, sent):
+    from notifications import AsyncNotificationManager, NOTIFICATION_LEASE_SECONDS, utcnow
+    from models import TradeType
+
+    _, (job_id,), providers = add_jobs(jobs_db, 3, [("shift", TradeType.CHEF)])
+    now = utcnow()
+
+    async def claim_then_stall(db):
+        #the first worker gets through one provider and is never heard from again
+        manager = AsyncNotificationManager(db)
+        jobs = await manager.claim(now)
+        await db.execute(manager.advance_statement([job.id for job in jobs], providers[0], now))
+        await db.commit()
+        return jobs
+
+    assert [job.id for job in run(jobs_db, claim_then_stall)] == [job_id]
+    assert run(jobs_db, lambda db: AsyncNotificationManager(db).claim(now + timedelta(seconds=NOTIFICATION_LEASE_SECONDS - 1))) == []
+
+    expired = now + timedelta(seconds=NOTIFICATION_LEASE_SECONDS + 1)
+    assert run(jobs_db, lambda db: AsyncNotificationManager(db).deliver(expired)) == 1
+    assert [notification["account_id"] for batch in sent for notification in batch] == providers[1:]
+    assert remaining_jobs(jobs_db) == []
+
+def test_jobs_for_one_trade_are_sent_together_and_duplicates_once(jobs_db, sent):
+    from notifications import AsyncNotificationManager
+    from models import TradeType
+
+    listings, job_ids, providers = add_jobs(jobs_db, 2, [("a", TradeType.CHEF), ("b", TradeType.CHEF), ("a", TradeType.CHEF), ("c", TradeType.BARISTA)])
+
+    assert run(jobs_db, lambda db: AsyncNotificationManager(db).deliver()) == 3
+    assert len(sent) == 1
+    assert [(notification["account_id"], [listing["id"] for listing in notification["listings"]]) for notification in sent[0]] == [
+        (provider, [listings["a"], listings["b"]]) for provider in providers
+    ]
+    #the other trade's job is left for the next pass
+    assert [job_id for job_id, *_ in remaining_jobs(jobs_db)] == [job_ids[3]]
+
+def test_a_job_that_keeps_failing_is_retried_then_marked_failed(jobs_db, monkeypatch):
+    import notifications
+    from notifications import AsyncNotificationManager, NotificationSender, NOTIFICATION_MAX_ATTEMPTS, notification_dispatcher, utcnow
+    from models import TradeType
+
+    class FailingSender(NotificationSender):
+        async def send(self, notifications):
+            raise ConnectionError("mail relay down")
+
+    monkeypatch.setattr(notification_dispatcher, "sender", FailingSender())
+    monkeypatch.setattr(notifications, "NOTIFICATION_RETRY_SECONDS", 0)
+    _, (job_id,), _ = add_jobs(jobs_db, 1, [("shift", TradeType.CHEF)])
+    retries, failed = notification_dispatcher.retries, notification_dispatcher.failed
+
+    for attempt in range(1, NOTIFICATION_MAX_ATTEMPTS):
+        assert run(jobs_db, lambda db: AsyncNotificationManager(db).deliver(utcnow() + timedelta(seconds=1))) == 1
+        assert remaining_jobs(jobs_db) == [(job_id, "PENDING", attempt, 0)]
+
+    assert run(jobs_db, lambda db: AsyncNotificationManager(db).deliver(utcnow() + timedelta(seconds=1))) == 1
+    assert remaining_jobs(jobs_db) == [(job_id, "FAILED", NOTIFICATION_MAX_ATTEMPTS, 0)]
+    assert run(jobs_db, lambda db: AsyncNotificationManager(db).deliver(utcnow() + timedelta(days=1))) == 0
+    assert (notification_dispatcher.retries - retries, notification_dispatcher.failed - failed) == (NOTIFICATION_MAX_ATTEMPTS - 1, 1)
@@ -0,0 +1,76 @@
+import pytest
+from cache import PrincipalCache
+
+def cached_subjects():
+    from cache import principal_cache
+
+    return {subject for subject, _ in principal_cache._entries}
+
+def username_of(account_id):
+    from database import SessionLocal
+    from models import Account
+
+    with SessionLocal() as db:
+        return db.get(Account, account_id).username
+
+@pytest.fixture
+def update_account(database):
+    #commits a change to the account row through the orm, the way every account write does
+    from database import SessionLocal
+    from models import Account
+
+    def update(account_id, **values):
+        with SessionLocal() as db:
+            account = db.get(Account, account_id)
+            for name, value in values.items():
+                setattr(account, name, value)
+            db.commit()
+
+    return update
+
+def test_an_account_update_evicts_its_cached_principal(client, auth_headers, provider, update_account):
+    from cache import principal_cache
+    from models import TradeType
+
+    headers = auth_headers(provider)
+    username = username_of(provider)
+    assert client.get("/live_board", headers=headers).status_code == 200
+    assert username in cached_subjects()
+
+    update_account(provider, trade=TradeType.BARISTA)
+    assert username not in cached_subjects()
+
+    #the same token now loads the updated account
+    assert client.get("/live_board", headers=headers).status_code == 200
+    (key,) = [key for key in principal_cache._entries if key[0] == username]
+    assert principal_cache.get(*key).trade == TradeType.BARISTA
+
+def test_a_renamed_account_is_not_served_under_its_old_username(client, auth_headers, provider, update_account):
+    headers = auth_headers(provider)
+    username = username_of(provider)
+    assert client.get("/live_board", headers=headers).status_code == 200
+
+    update_account(provider, username=f"{username}_renamed")
+    assert username not in cached_subjects()
+    assert client.get("/live_board", headers=headers).status_code == 401
+
+def test_entries_expire_with_their_token_and_the_least_recent_is_evicted(monkeypatch):
+    import cache
+
+    principals = PrincipalCache(maxsize=2, ttl=60)
+    monkeypatch.setattr(cache.time, "time", lambda: 1000.0)
+    monkeypatch.setattr(cache.time, "monotonic", lambda: 0.0)
+
+    principals.set("expired", 1000, "x")
+    assert principals.get("expired", 1000) is None
+
+    principals.set("a", 1010, "a")
+    principals.set("b", None, "b")
+    assert principals.get("a", 1010) == "a"
+    principals.set("c", None, "c")
+    assert (principals.get("b", None), principals.get("a", 1010), principals.evictions) == (None, "a", 1)
+
+    #a token ten seconds from expiry is cached for ten seconds, not the full ttl
+    monkeypatch.setattr(cache.time, "monotonic", lambda: 11.0)
+    assert principals.get("a", 1010) is None
+    assert principals.get("c", None) == "c"
@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta
+import pytest
+from fastapi import HTTPException
+from ranking import RankingIndex
+
+def test_removed_rows_are_reused_instead_of_growing_the_scan():
+    index = RankingIndex()
+    index.rebuild([])
+    required = datetime.now() + timedelta(days=1)
+
+    for listing_id in range(1, 4):
+        index.add(listing_id, required, None, 30.0, None, None, ["CHEF"])
+    for _ in range(100):
+        index.remove(1)
+        index.remove(2)
+        index.add(1, required, None, 30.0, None, None, ["CHEF"])
+        index.add(2, required, None, 40.0, None, None, ["CHEF"])
+
+    assert index._size == 3
+    assert index.rank("CHEF", 10)[0] == [2, 1, 3]
+
+def only(signal):
+    weights = {"rate": 0.0, "soon": 0.0, "distance": 0.0, "tags": 0.0}
+    weights[signal] = 1.0
+    return weights
+
+def test_each_signal_orders_listings_best_first():
+    index = RankingIndex()
+    now = datetime(2100, 1, 1)
+    index.rebuild([
+        (1, now + timedelta(hours=30), None, 20.0, -37.80, 144.90, "CHEF"),
+        (2, now + timedelta(hours=10), None, 40.0, -37.90, 145.00, "CHEF"),
+        (2, now + timedelta(hours=10), None, 40.0, -37.90, 145.00, "WAITER"),
+        (3, now + timedelta(hours=20), None, 30.0, None, None, "CHEF"),
+        (4, now + timedelta(hours=20), None, 10.0, -37.81, 144.96, "CLEANER"),
+    ])
+    rank = lambda signal: index.rank("CHEF", 10, origin=(-37.81, 144.96), weights=only(signal), now=now.timestamp())[0]
+
+    assert rank("rate") == [2, 3, 1]
+    assert rank("soon") == [2, 3, 1]
+    #listings without coordinates come last
+    assert rank("distance") == [1, 2, 3]
+    #equal scores fall back to the listing id
+    assert rank("tags") == [1, 3, 2]
+
+def test_pages_follow_on_from_each_other():
+    index = RankingIndex()
+    now = datetime(2100, 1, 1)
+    index.rebuild([(listing_id, now + timedelta(hours=listing_id), None, 30.0, None, None, "CHEF") for listing_id in range(1, 8)])
+
+    pages = [index.rank("CHEF", 3, offset, now=now.timestamp()) for offset in (0, 3, 6)]
+    assert pages == [([1, 2, 3], True), ([4, 5, 6], True), ([7], False)]
+    assert index.rank("CHEF", 3, 9, now=now.timestamp()) == ([], False)
+
+def test_rank_cursor_round_trips_and_rejects_other_cursors():
+    from models import decode_rank_cursor, encode_cursor, encode_rank_cursor
+
+    assert decode_rank_cursor(encode_rank_cursor(40)) == 40
+    for cursor in [encode_cursor(datetime(2100, 1, 1), 5), "bm90IGEgY3Vyc29y", "%%%", encode_rank_cursor(-1)]:
+        with pytest.raises(HTTPException) as rejected:
+            decode_rank_cursor(cursor)
+        assert rejected.value.status_code == 400
+
+def test_relevance_board_pages_through_every_listing_once(client, auth_headers, business, provider):
+    headers = auth_headers(business)
+    for title in "abcde":
+        response = client.post("/add_job_listing", headers=headers, json={
+            "type": "JOB", "title": title, "description": "d", "location": "Melbourne", "created_by": "x",
+            "datetime_required": (datetime.now() + timedelta(days=400)).isoformat(), "created_at": datetime.now().isoformat(), "rate_per_h": 30, "tags": ["CHEF"],
+        })
+        assert response.status_code == 200
+
+    def page(**params):
+        response = client.get("/live_board", headers=auth_headers(provider), params={"sort": "relevance", **params})
+        assert response.status_code == 200
+        return [listing["id"] for listing in response.json()["listings"]], response.json()["next_cursor"]
+
+    everything, _ = page(limit=100)
+    paged, cursor = page(limit=2)
+    while cursor is not None:
+        ids, cursor = page(limit=2, cursor=cursor)
+        paged += ids
+    assert paged == everything
+
+    response = client.get("/live_board", headers=auth_headers(provider), params={"sort": "relevance", "cursor": "bm90IGEgY3Vyc29y"})
+    assert response.status_code == 400
+
+def test_importing_the_app_leaves_numpy_for_the_first_index_build():
+    import os
+    import subprocess
+    import sys
+
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    check = "import sys, main; assert 'numpy' not in sys.modules; main.load_ranking_index(); assert 'numpy' in sys.modules"
+    subprocess.run([sys.executable, "-c", check], cwd=backend, env=os.environ, check=True)
@@ -0,0 +1,66 @@
+import asyncio
+import shutil
+from datetime import datetime, timedelta
+import pytest
+
+@pytest.fixture
+def lagging_replica(tmp_path, monkeypatch, business, provider):
+    #a copy of the database taken now, it never sees a later write
+    import database
+    from database import ReplicaSet, get_engine
+
+    replica_path = tmp_path / "replica.db"
+    shutil.copy(get_engine().url.database, replica_path)
+    replicas = ReplicaSet([f"sqlite:///{replica_path}"])
+    monkeypatch.setattr(database, "replica_set", replicas)
+    yield replicas
+    asyncio.run(replicas.replicas[0].async_engine.dispose())
+
+def post_job(client, headers, title):
+    return client.post("/add_job_listing", headers=headers, json={
+        "type": "JOB", "title": title, "description": "d", "location": "Melbourne", "created_by": "x",
+        "datetime_required": (datetime.now() + timedelta(days=1)).isoformat(), "created_at": datetime.now().isoformat(), "rate_per_h": 30, "tags": ["CHEF"],
+    })
+
+def found(client, headers, title):
+    response = client.get("/listings/search", headers=headers, params={"q": title})
+    assert response.status_code == 200
+    return [listing["title"] for listing in response.json()["listings"]] == [title]
+
+def test_a_writer_reads_its_own_write_from_the_primary_until_the_pin_expires(client, auth_headers, business, provider, lagging_replica, monkeypatch):
+    import database
+
+    writer, reader = auth_headers(business), auth_headers(provider)
+    title = f"replica{business}"
+    assert post_job(client, writer, title).status_code == 200
+
+    reads = dict(lagging_replica.reads)
+    assert found(client, writer, title)
+    assert not found(client, reader, title)
+    assert lagging_replica.reads == {"replica": reads["replica"] + 1, "primary": reads["primary"]}
+
+    #once the pin runs out the writer is back on the replica like everyone else
+    now = database.time.monotonic()
+    monkeypatch.setattr(database.time, "monotonic", lambda: now + database.REPLICA_PIN_SECONDS + 1)
+    assert not found(client, writer, title)
+
+def test_rejected_writes_dont_pin_and_writes_never_go_to_a_replica(client, auth_headers, business, provider, lagging_replica):
+    writer = auth_headers(business)
+    title = f"replica{business}"
+
+    #a provider can't post jobs, so nothing was written and nothing is pinned
+    assert post_job(client, auth_headers(provider), title).status_code == 401
+    assert not found(client, auth_headers(provider), title)
+
+    reads = dict(lagging_replica.reads)
+    assert post_job(client, writer, title).status_code == 200
+    assert lagging_replica.reads == reads
+
+def test_reads_fall_back_to_the_primary_without_a_healthy_replica(client, auth_headers, business, provider, lagging_replica):
+    title = f"replica{business}"
+    assert post_job(client, auth_headers(business), title).status_code == 200
+
+    lagging_replica.mark(lagging_replica.replicas[0], False)
+    primary_reads = lagging_replica.reads["primary"]
+    assert found(client, auth_headers(provider), title)
+    assert lagging_replica.reads["primary"] == primary_reads + 1
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+def add_products(business, titles):
+    from database import SessionLocal
+    from models import ListingType, ProductListing
+
+    with SessionLocal() as db:
+        products = [ProductListing(ListingType.PRODUCT, title, "d", "Melbourne", datetime.now() + timedelta(days=1), business, datetime.now(), [], 1.0, 1) for title in titles]
+        db.add_all(products)
+        db.commit()
+        return [product.id for product in products]
+
+def test_fallback_search_matches_wildcards_literally(business):
+    from database import SessionLocal
+    from search import search_query
+
+    percent, underscore, plain = add_products(business, [f"{business} 100% wool", f"{business} wool_blend", f"{business} 1000 wool blend"])
+
+    #a dialect without a full text index takes the ilike branch
+    with SessionLocal() as db:
+        assert db.execute(search_query("mysql", f"{business} 100%")).scalars().all() == [percent]
+        assert db.execute(search_query("mysql", f"{business} wool_")).scalars().all() == [underscore]
+        assert plain not in db.execute(search_query("mysql", f"{business} 10_0")).scalars().all()
+
+def add_jobs(business, jobs):
+    #jobs are (title, trade) pairs
+    from database import SessionLocal
+    from models import JobListing, ListingManager, ListingType
+
+    ids = []
+    with SessionLocal() as db:
+        for title, trade in jobs:
+            job = JobListing(ListingType.JOB, title, "d", "Melbourne", datetime.now() + timedelta(days=1), business, datetime.now(), [], 30.0)
+            ListingManager(db).add_listing(job, [trade])
+            ids.append(job.id)
+    return ids
+
+def test_search_filters_by_type_and_trade_and_pages_by_offset(client, auth_headers, business):
+    word = f"kiwi{business}"
+    chef_jobs = add_jobs(business, [(f"{word} prep", "CHEF"), (f"{word} line", "CHEF"), (f"{word} pastry", "CHEF")])
+    barista_jobs = add_jobs(business, [(f"{word} espresso", "BARISTA")])
+    products = add_products(business, [f"{word} apron"])
+    headers = auth_headers(business)
+
+    def search(**params):
+        response = client.get("/listings/search", headers=headers, params={"q": word, **params})
+        assert response.status_code == 200
+        return sorted(listing["id"] for listing in response.json()["listings"]), response.json()["next_offset"]
+
+    assert search() == (sorted(chef_jobs + barista_jobs + products), None)
+    assert search(type="PRODUCT") == (products, None)
+    assert search(trade="BARISTA") == (barista_jobs, None)
+    assert search(trade=["CHEF", "BARISTA"]) == (sorted(chef_jobs + barista_jobs), None)
+    #words match by prefix
+    assert search(q=word[:-1], type="JOB", trade="BARISTA") == (barista_jobs, None)
+
+    pages, offset = [], 0
+    while offset is not None:
+        ids, offset = search(limit=2, offset=offset)
+        pages.append(ids)
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert sorted(sum(pages, [])) == sorted(chef_jobs + barista_jobs + products)
+    assert client.get("/listings/search", headers=headers, params={"q": word, "trade": "ASTRONAUT"}).status_code == 422
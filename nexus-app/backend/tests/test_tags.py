@@ -0,0 +1,24 @@
+from datetime import datetime, timedelta
+
+def test_tag_created_in_a_rolled_back_transaction_is_not_cached(business):
+    from cache import tag_cache
+    from database import SessionLocal
+    from models import JobListing, ListingManager, ListingType
+
+    name = f"rolled_back_{business}"
+    with SessionLocal() as db:
+        tag_ids, new_tags = ListingManager(db).resolve_tag_ids([name])
+        assert [tag_name for _, tag_name in new_tags] == [name]
+        db.rollback()
+    assert tag_cache.lookup([name]) == ({}, [name])
+
+    #the next listing creates the tag again, with an id that exists
+    with SessionLocal() as db:
+        job = JobListing(ListingType.JOB, "t", "d", "Melbourne", datetime.now() + timedelta(days=1), business, datetime.now(), [], 30.0)
+        ListingManager(db).add_listing(job, [name])
+        listing_id = job.id
+    found, _ = tag_cache.lookup([name])
+
+    with SessionLocal() as db:
+        listing = db.get(JobListing, listing_id)
+        assert [(tag.id, tag.name) for tag in listing.tags] == [(found[name], name)]
@@ -0,0 +1,80 @@
+import asyncio
+from datetime import timedelta
+from sqlalchemy import select
+
+def test_purge_keeps_live_tokens_and_recent_reuse_evidence(business):
+    from database import AsyncSessionLocal
+    from models import RefreshToken
+    from tokens import AsyncRefreshTokenManager, REFRESH_TOKEN_REUSE_DAYS, utcnow
+
+    now = utcnow()
+    long_ago = now - timedelta(days=REFRESH_TOKEN_REUSE_DAYS + 1)
+
+    async def run():
+        async with AsyncSessionLocal() as db:
+            manager = AsyncRefreshTokenManager(db)
+            rows = {}
+            for name in ("live", "expired", "used_recently", "used_long_ago", "revoked_long_ago"):
+                _, rows[name] = manager.new_token(business)
+                db.add(rows[name])
+            rows["expired"].expires_at = now - timedelta(seconds=1)
+            rows["used_recently"].used_at = now - timedelta(hours=1)
+            rows["used_long_ago"].used_at = long_ago
+            rows["revoked_long_ago"].revoked_at = long_ago
+            await db.commit()
+            ids = {name: row.id for name, row in rows.items()}
+
+            assert await manager.purge_stale(now) >= 3
+            result = await db.execute(select(RefreshToken.id).filter(RefreshToken.id.in_(ids.values())))
+            return ids, set(result.scalars().all())
+
+    ids, remaining = asyncio.run(run())
+    assert remaining == {ids["live"], ids["used_recently"]}
+
+def revoke_from_another_worker(family, revoked_at):
+    #commits a revocation without touching this process's denylist or watermark
+    from database import SessionLocal
+    from models import TokenRevocation
+
+    with SessionLocal() as db:
+        db.add(TokenRevocation(family=family, revoked_at=revoked_at))
+        db.commit()
+
+async def catch_up():
+    from database import AsyncSessionLocal
+    from tokens import AsyncRefreshTokenManager
+
+    async with AsyncSessionLocal() as db:
+        return await AsyncRefreshTokenManager(db).catch_up_revocations()
+
+def test_revocation_stamped_by_a_slow_clock_is_still_caught_up(database):
+    from tokens import token_denylist, utcnow
+
+    asyncio.run(catch_up())
+    now = utcnow()
+    revoke_from_another_worker("fast_clock_family", now)
+    assert asyncio.run(catch_up()) == 1
+
+    #committed after the one above but stamped earlier, a revoked_at watermark would skip it
+    revoke_from_another_worker("slow_clock_family", now - timedelta(minutes=5))
+    assert asyncio.run(catch_up()) == 1
+    assert "fast_clock_family" in token_denylist
+    assert "slow_clock_family" in token_denylist
+
+def test_local_revocations_are_not_caught_up_again(business):
+    from database import AsyncSessionLocal
+    from tokens import AsyncRefreshTokenManager, token_denylist
+
+    async def issue_and_revoke():
+        async with AsyncSessionLocal() as db:
+            manager = AsyncRefreshTokenManager(db)
+            token, row = manager.new_token(business)
+            db.add(row)
+            await db.commit()
+            await manager.revoke(token)
+            return row.family
+
+    asyncio.run(catch_up())
+    family = asyncio.run(issue_and_revoke())
+    assert family in token_denylist
+    assert asyncio.run(catch_up()) == 0
@@ -0,0 +1,189 @@
+#rotating refresh tokens, renewing a session costs an hmac and one indexed lookup instead of a bcrypt verify
+import hashlib
+import hmac
+import os
+import secrets
+from datetime import datetime, timedelta, timezone
+import config
+from fastapi import HTTPException, status
+from sqlalchemy import delete, func, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Account, AccountManager, RefreshToken, TokenRevocation, SECRET_KEY, ACCESS_TOKEN_EXPIRE_MINUTES
+from cache import TokenDenylist
+from listing_index import CatchUpWatermark
+
+REFRESH_TOKEN_EXPIRE_DAYS = float(os.environ.get("REFRESH_TOKEN_EXPIRE_DAYS", 30))
+#used and revoked tokens are kept this long so a replayed one still ends its family, then purged
+REFRESH_TOKEN_REUSE_DAYS = float(os.environ.get("REFRESH_TOKEN_REUSE_DAYS", 7))
+REFRESH_TOKEN_PURGE_BATCH_SIZE = int(os.environ.get("REFRESH_TOKEN_PURGE_BATCH_SIZE", 1000))
+#upper bound on batches per pass, a backlog is worked off over several passes
+REFRESH_TOKEN_PURGE_MAX_BATCHES = int(os.environ.get("REFRESH_TOKEN_PURGE_MAX_BATCHES", 20))
+
+#a revoked family's access tokens expire on their own after this long
+token_denylist = TokenDenylist(ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def hash_refresh_token(token: str):
+    return hmac.new(SECRET_KEY.encode(), token.encode(), hashlib.sha256).hexdigest()
+
+#token_revocations ids already copied into the local denylist, revokes on this worker claim theirs
+revocation_watermark = CatchUpWatermark()
+
+class AsyncRefreshTokenManager:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    def invalid_token(self):
+        return HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    def new_token(self, account_id, family=None):
+        #returns (token, row), the token is only ever handed to the client
+        token = secrets.token_urlsafe(32)
+        now = utcnow()
+        row = RefreshToken(
+            account_id=account_id,
+            family=family or secrets.token_hex(16),
+            token_hash=hash_refresh_token(token),
+            created_at=now,
+            expires_at=now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+        )
+        return token, row
+
+    def lookup_query(self, token: str):
+        return (
+            select(RefreshToken, Account.username, Account.account_type)
+            .join(Account, Account.id == RefreshToken.account_id)
+            .filter(RefreshToken.token_hash == hash_refresh_token(token))
+        )
+
+    def mark_used_query(self, row: RefreshToken, now):
+        #conditional so two concurrent refreshes with the same token can't both rotate it
+        return update(RefreshToken).filter(RefreshToken.id == row.id, RefreshToken.used_at.is_(None), RefreshToken.revoked_at.is_(None)).values(used_at=now)
+
+    def revoke_family_query(self, family, now):
+        return update(RefreshToken).filter(RefreshToken.family == family, RefreshToken.revoked_at.is_(None)).values(revoked_at=now)
+
+    def record_revocation_query(self, family, now):
+        return insert(TokenRevocation).values(family=family, revoked_at=now).returning(TokenRevocation.id)
+
+    def revocations_query(self, after_id=0, gaps=()):
+        condition = TokenRevocation.id > after_id
+        if gaps:
+            condition = or_(condition, TokenRevocation.id.in_(gaps))
+        return select(TokenRevocation.id, TokenRevocation.family).filter(condition).order_by(TokenRevocation.id)
+
+    def recent_revocations_query(self, now):
+        #families whose access tokens may still be unexpired
+        return select(TokenRevocation.family).filter(TokenRevocation.revoked_at > now - timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)).distinct()
+
+    def max_revocation_id_query(self):
+        return select(func.coalesce(func.max(TokenRevocation.id), 0))
+
+    def stale_revocations_statement(self, now):
+        return delete(TokenRevocation).filter(TokenRevocation.revoked_at <= now - timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+
+    def stale_tokens_query(self, now, limit):
+        #expired tokens are refused anyway, used and revoked ones only matter until the reuse window ends
+        retired = now - timedelta(days=REFRESH_TOKEN_REUSE_DAYS)
+        return (
+            select(RefreshToken.id)
+            .filter(or_(RefreshToken.expires_at <= now, RefreshToken.used_at <= retired, RefreshToken.revoked_at <= retired))
+            .limit(limit)
+        )
+
+    def purge_statement(self, ids):
+        return delete(RefreshToken).filter(RefreshToken.id.in_(ids))
+
+    def token_response(self, username, account_type, family, refresh_token):
+        access_token = AccountManager(self.session).create_access_token(
+            data={"sub": username, "role": account_type.value, "fam": family},
+            expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
+        )
+        return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer", "role": account_type.value}
+
+    async def revoke_family(self, family, now):
+        #commits, the revocation row is claimed first so this worker's catch-up skips it
+        await self.session.execute(self.revoke_family_query(family, now))
+        result = await self.session.execute(self.record_revocation_query(family, now))
+        revocation_watermark.claim([result.scalar()])
+        await self.session.commit()
+        token_denylist.add(family)
+
+    async def issue(self, account: Account):
+        token, row = self.new_token(account.id)
+        self.session.add(row)
+        await self.session.commit()
+        return token, row.family
+
+    async def rotate(self, token: str):
+        result = await self.session.execute(self.lookup_query(token))
+        found = result.first()
+        if found is None:
+            raise self.invalid_token()
+
+        row, username, account_type = found
+        now = utcnow()
+        if row.revoked_at is not None or row.expires_at <= now:
+            raise self.invalid_token()
+
+        result = await self.session.execute(self.mark_used_query(row, now))
+        if result.rowcount != 1:
+            await self.revoke_family(row.family, now)
+            raise self.invalid_token()
+
+        new_token, new_row = self.new_token(row.account_id, row.family)
+        self.session.add(new_row)
+        await self.session.commit()
+        return self.token_response(username, account_type, row.family, new_token)
+
+    async def revoke(self, token: str):
+        result = await self.session.execute(self.lookup_query(token))
+        found = result.first()
+        if found is None:
+            raise self.invalid_token()
+
+        await self.revoke_family(found[0].family, utcnow())
+
+    async def start_revocations(self, now=None):
+        #startup, families revoked recently enough that their access tokens may still be live are denied
+        #and only later revocations are caught up
+        result = await self.session.execute(self.max_revocation_id_query())
+        revocation_watermark.reset(result.scalar())
+        result = await self.session.execute(self.recent_revocations_query(now or utcnow()))
+        for family in result.scalars():
+            token_denylist.add(family)
+
+    async def catch_up_revocations(self):
+        #revocations committed through other workers since the last catch-up
+        result = await self.session.execute(self.revocations_query(*revocation_watermark.pending()))
+        rows = result.all()
+        fresh = set(revocation_watermark.advance([row.id for row in rows]))
+        for row in rows:
+            if row.id in fresh:
+                token_denylist.add(row.family)
+        return len(fresh)
+
+    async def purge_stale(self, now=None):
+        #returns how many refresh tokens were deleted, a worker racing this one just deletes fewer
+        now = now or utcnow()
+        await self.session.execute(self.stale_revocations_statement(now))
+        await self.session.commit()
+
+        purged = 0
+        for _ in range(REFRESH_TOKEN_PURGE_MAX_BATCHES):
+            result = await self.session.execute(self.stale_tokens_query(now, REFRESH_TOKEN_PURGE_BATCH_SIZE))
+            ids = result.scalars().all()
+            if not ids:
+                break
+            await self.session.execute(self.purge_statement(ids))
+            await self.session.commit()
+            purged += len(ids)
+            if len(ids) < REFRESH_TOKEN_PURGE_BATCH_SIZE:
+                break
+        return purged